@@ -1,45 +1,202 @@
-from security.permissions import is_valid_mobile, test_only
-from appconf import IOS_APP_ID
-from security.attest.ios import validate_attestation
+from security.permissions import is_valid_mobile, test_only, admin_only
+from appconf import (
+    IOS_APP_ID,
+    PROTEIN_BATCH_MAX_SIZE,
+    PROTEIN_BATCH_CONCURRENCY,
+    CHALLENGE_BATCH_MAX_SIZE
+)
+from security.attest.ios import (
+    validate_attestation,
+    ParsedAttestation,
+    public_key_cache
+)
 from rags.protein_amount import chain
 import base64
-from cryptography import x509
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, HTTPException, Depends, Request, Header
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
 import cbor2
+import json
+import time
 import redis
+import redis.asyncio
 from typing import Annotated
 
-from db.comp_food_database import get_db
-from fastapi_types import AttestRequest, SearchRequest
+from db.comp_food_database import get_db, SessionLocal
+from fastapi_types import AttestRequest, SearchRequest, BatchSearchRequest
+from utils import metrics
 from cache import (
-    get_redis,
+    get_async_redis,
+    get_cached_response,
+    get_cached_responses,
+    set_cached_response,
+    normalize_text,
+    response_key,
+    SingleFlight,
     generate_challenge,
+    generate_challenges,
     CHALLENGE_PREFIX,
     KEY_CHALLENGE_PREFIX,
     KEY_PUBLIC_KEY_PREFIX,
     KEY_COUNTER_PREFIX,
+    CHALLENGE_TTL_SECONDS,
+    KEY_CHALLENGE_TTL_SECONDS,
+    prefix_usage,
 )
 
 router = APIRouter()
 
+# Identical meals in flight at the same time share one chain execution
+protein_flight = SingleFlight("protein")
+
+
+async def _analyze(text: str, db: Session, cache_client: redis.asyncio.Redis):
+    """Run the protein chain, coalesced with identical meals in flight"""
+
+    async def run():
+        results = await chain.arun(text, db, cache_client)
+        await set_cached_response(cache_client, text, results)
+        return results
+
+    return await protein_flight.do(response_key(text), run, cache_client)
+
 
 @router.post("/protein")
 async def protein(request: SearchRequest,
                   is_valid_mobile: Annotated[bool, Depends(is_valid_mobile)],
-                  db: Session = Depends(get_db)):
+                  db: Session = Depends(get_db),
+                  cache_client: redis.asyncio.Redis = Depends(get_async_redis)):
     try:
-        results = chain.run(request.text, db)
+        results = await get_cached_response(cache_client, request.text)
+        if results is None:
+            results = await _analyze(request.text, db, cache_client)
         return {"results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/protein/batch")
+async def protein_batch(
+    request: BatchSearchRequest,
+    is_valid_mobile: Annotated[bool, Depends(is_valid_mobile)],
+    cache_client: redis.asyncio.Redis = Depends(get_async_redis)
+):
+    '''
+    Analyze many meals under one assertion check. Identical meals are only
+    analyzed once, and at most PROTEIN_BATCH_CONCURRENCY chains run at a time.
+    Results are returned in request order, with an error for failed meals.
+    '''
+    if len(request.texts) > PROTEIN_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {PROTEIN_BATCH_MAX_SIZE} meals per batch"
+        )
+
+    # Deduplicate on the normalized text, keeping the first spelling
+    unique = {}
+    for text in request.texts:
+        unique.setdefault(normalize_text(text), text)
+    texts = list(unique.values())
+
+    cached = await get_cached_responses(cache_client, texts)
+    semaphore = asyncio.Semaphore(PROTEIN_BATCH_CONCURRENCY)
+
+    async def analyze(text: str, results):
+        if results is not None:
+            return {"results": results}
+        async with semaphore:
+            try:
+                # Each chain gets its own session since they run concurrently
+                with SessionLocal() as db:
+                    results = await _analyze(text, db, cache_client)
+                return {"results": results}
+            except Exception as e:
+                return {"error": str(e)}
+
+    analyzed = await asyncio.gather(
+        *(analyze(text, results) for text, results in zip(texts, cached)))
+    by_key = {normalize_text(text): result
+              for text, result in zip(texts, analyzed)}
+
+    return {"results": [
+        {"text": text, **by_key[normalize_text(text)]}
+        for text in request.texts
+    ]}
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/protein/stream")
+async def protein_stream(
+    request: SearchRequest,
+    is_valid_mobile: Annotated[bool, Depends(is_valid_mobile)]
+):
+    '''
+    Server-sent events version of /protein. Each food item is sent as an
+    `item` event as soon as it is complete, followed by a `summary` event.
+    '''
+
+    async def events():
+        start = time.perf_counter()
+        first_item_ms = None
+        results = []
+
+        # Dependencies with yield exit before a streamed response is sent,
+        # so the session and Redis client are opened for the stream itself
+        with contextmanager(get_db)() as db:
+            async with asynccontextmanager(get_async_redis)() as cache_client:
+                try:
+                    cached = await get_cached_response(
+                        cache_client, request.text)
+                    items = _aiter(cached) if cached is not None else \
+                        chain.astream(request.text, db, cache_client)
+
+                    async for item in items:
+                        if first_item_ms is None:
+                            first_item_ms = (time.perf_counter() - start) * 1000
+                        results.append(item)
+                        yield _sse("item", item)
+
+                    if cached is None:
+                        await set_cached_response(
+                            cache_client, request.text, results)
+                except Exception as e:
+                    yield _sse("error", {"detail": str(e)})
+                    return
+
+        yield _sse("summary", {
+            "count": len(results),
+            "total_protein": _total_protein(results),
+            "cached": cached is not None,
+            "time_to_first_item_ms": first_item_ms,
+            "total_ms": (time.perf_counter() - start) * 1000
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def _total_protein(results: list[dict]) -> float:
+    total = 0
+    for result in results:
+        try:
+            total += float(result.get("protein_amount", 0))
+        except (TypeError, ValueError):
+            pass
+    return total
+
+
 @router.post("/challenge")
 async def challenge(
-    redis_client: redis.Redis = Depends(get_redis),
+    redis_client: redis.asyncio.Redis = Depends(get_async_redis),
     x_key_id: str = Header(None)
 ):
 
@@ -48,18 +205,53 @@ async def challenge(
 
     # If key id provided, update challenge for this key id
     if x_key_id:
-        redis_client.set(f"{KEY_CHALLENGE_PREFIX}{x_key_id}",
-                         f"{value}.{counter}")
+        await redis_client.set(f"{KEY_CHALLENGE_PREFIX}{x_key_id}",
+                               f"{value}.{counter}",
+                               ex=KEY_CHALLENGE_TTL_SECONDS or None)
     else:
-        redis_client.set(f"{CHALLENGE_PREFIX}{id}", f"{value}.{counter}")
+        await redis_client.set(f"{CHALLENGE_PREFIX}{id}", f"{value}.{counter}",
+                               ex=CHALLENGE_TTL_SECONDS or None)
 
     return challenge
 
 
+@router.post("/challenge/batch")
+async def challenge_batch(
+    count: int,
+    redis_client: redis.asyncio.Redis = Depends(get_async_redis),
+    x_key_id: str = Header(None)
+):
+    '''
+    Issue several challenges at once, stored with one pipelined write.
+    Per-key challenges have a single slot, so they cannot be batched.
+    '''
+    if x_key_id:
+        raise HTTPException(
+            status_code=400,
+            detail="Per-key challenges cannot be batched"
+        )
+    if not 0 < count <= CHALLENGE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Between 1 and {CHALLENGE_BATCH_MAX_SIZE} challenges "
+                   "per batch"
+        )
+
+    challenges = generate_challenges(count)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for challenge in challenges:
+            id, value, counter = challenge.split('.')
+            pipe.set(f"{CHALLENGE_PREFIX}{id}", f"{value}.{counter}",
+                     ex=CHALLENGE_TTL_SECONDS or None)
+        await pipe.execute()
+
+    return challenges
+
+
 @router.post("/attest")
 async def attest(
     request: AttestRequest,
-    redis_client: redis.Redis = Depends(get_redis)
+    redis_client: redis.asyncio.Redis = Depends(get_async_redis)
 ):
     '''
     Validate the attestation and create a new key if it doesn't exist.
@@ -68,11 +260,11 @@ async def attest(
 
     try:
         # Validate the attestation with Apple
-        decoded_attestation = cbor2.loads(
-            base64.b64decode(request.attestation))
+        attestation = ParsedAttestation.parse(cbor2.loads(
+            base64.b64decode(request.attestation)))
 
         is_valid = validate_attestation(
-            attestation=decoded_attestation,
+            attestation=attestation,
             challenge=request.challenge,
             key_id=request.keyId,
             app_id=IOS_APP_ID
@@ -84,26 +276,18 @@ async def attest(
                 detail="Invalid attestation"
             )
 
-        x5c = decoded_attestation.get('attStmt', {}).get('x5c', [])
-        if not x5c:
-            raise ValueError("No x5c found in attestation")
-
-        cred_cert = x509.load_der_x509_certificate(x5c[0], default_backend())
-        public_key = cred_cert.public_key()
-        public_bytes = public_key.public_bytes(
-            encoding=serialization.Encoding.DER,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        key_hash_b64 = base64.b64encode(public_bytes).decode()
-
-        redis_client.mset({
-            f"{KEY_PUBLIC_KEY_PREFIX}{request.keyId}": key_hash_b64,
+        await redis_client.mset({
+            f"{KEY_PUBLIC_KEY_PREFIX}{request.keyId}":
+                attestation.public_key_der_b64,
             f"{KEY_COUNTER_PREFIX}{request.keyId}": 0
         })
+        public_key_cache.invalidate(request.keyId)
 
-        # Delete challenge provided in request (front end will request a new one)
-        redis_client.delete(
-            f"{CHALLENGE_PREFIX}{request.challenge.split('.')[0]}")
+        # Delete challenge provided in request (front end will request a new
+        # one), and any challenge left from an earlier registration of the key
+        await redis_client.delete(
+            f"{CHALLENGE_PREFIX}{request.challenge.split('.')[0]}",
+            f"{KEY_CHALLENGE_PREFIX}{request.keyId}")
 
         return {"status": "ok", "keyId": request.keyId}
     except Exception as e:
@@ -131,6 +315,23 @@ async def health():
     return {"status": "ok"}
 
 
+@router.get("/metrics")
+async def get_metrics(is_admin=Depends(admin_only)):
+    return metrics.snapshot()
+
+
+@router.get("/metrics/redis")
+async def get_redis_metrics(
+    is_admin=Depends(admin_only),
+    redis_client: redis.asyncio.Redis = Depends(get_async_redis)
+):
+    '''
+    Key count and estimated memory of each Redis key prefix.
+    Scans the whole keyspace, so it is meant for occasional admin use.
+    '''
+    return await prefix_usage(redis_client)
+
+
 # @router.post("/imagine/webhook")
 # async def imagine_webhook(request: Request, db: Session = Depends(get_db)):
 #     try:
@@ -6,3 +6,10 @@ BUNDLE_ID_PREFIX = "." + EXPO_ENVIRONMENT if EXPO_ENVIRONMENT != "production" el
 IOS_TEAM_ID = "J694G989HW"
 IOS_BUNDLE_ID = "com.northof60labs.proteinhabit" + BUNDLE_ID_PREFIX
 IOS_APP_ID = IOS_TEAM_ID + "." + IOS_BUNDLE_ID
+
+# Batch /protein requests
+PROTEIN_BATCH_MAX_SIZE = int(os.getenv("PROTEIN_BATCH_MAX_SIZE", 50))
+PROTEIN_BATCH_CONCURRENCY = int(os.getenv("PROTEIN_BATCH_CONCURRENCY", 4))
+
+# Batch /challenge requests
+CHALLENGE_BATCH_MAX_SIZE = int(os.getenv("CHALLENGE_BATCH_MAX_SIZE", 20))
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the API. Run them from the api directory, e.g.
+`python -m benchmarks.protein_concurrency`.
+"""
@@ -0,0 +1,86 @@
+'''
+Android challenge checks per second, before (GET, compare in Python, SET)
+and after (one ADVANCE_CHALLENGE_SCRIPT call), with many requests in flight.
+It also reports how many of several concurrent requests replaying the same
+counter were accepted, which should be exactly one.
+
+Run it against a local Redis or any stand-in that supports Lua scripts:
+
+    REDIS_URL=redis://localhost:6379/0 python -m benchmarks.android_challenge
+'''
+import argparse
+import asyncio
+import time
+
+import redis.asyncio
+
+from cache.store import REDIS_URL, CHALLENGE_PREFIX
+from cache.scripts import ADVANCE_CHALLENGE_SCRIPT
+
+VALUE = "a" * 32
+
+
+async def check_two_round_trips(redis_client, key, value, counter) -> bool:
+    # validate_challenge before the script
+    stored_value, stored_counter = (await redis_client.get(key)).split('.')
+    if stored_value != value or not int(counter) > int(stored_counter):
+        return False
+    await redis_client.set(key, f"{value}.{counter}")
+    return True
+
+
+async def check_script(redis_client, key, value, counter) -> bool:
+    result = await ADVANCE_CHALLENGE_SCRIPT(
+        redis_client, [key], [value, value, counter])
+    return result == 'ok'
+
+
+async def throughput(redis_client, check, requests: int, concurrency: int):
+    keys = [f"{CHALLENGE_PREFIX}benchmark:{i}" for i in range(concurrency)]
+    await redis_client.mset({key: f"{VALUE}.{10**15}" for key in keys})
+
+    async def device(key):
+        # Each device sends increasing counters, one request at a time
+        for i in range(1, requests // concurrency + 1):
+            assert await check(redis_client, key, VALUE, f"{10**15 + i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[device(key) for key in keys])
+    elapsed = time.perf_counter() - start
+    await redis_client.delete(*keys)
+    return requests / elapsed
+
+
+async def replays_accepted(redis_client, check, concurrency: int) -> int:
+    key = f"{CHALLENGE_PREFIX}benchmark:replay"
+    await redis_client.set(key, f"{VALUE}.{10**15}")
+    results = await asyncio.gather(*[
+        check(redis_client, key, VALUE, f"{10**15 + 1}")
+        for _ in range(concurrency)
+    ])
+    await redis_client.delete(key)
+    return sum(results)
+
+
+async def main(args):
+    redis_client = redis.asyncio.from_url(
+        REDIS_URL, decode_responses=True, max_connections=args.concurrency)
+    try:
+        print(f"{'path':>16} {'checks/s':>10} {'replays accepted':>17}")
+        for name, check in [("get + set", check_two_round_trips),
+                            ("script", check_script)]:
+            rate = await throughput(
+                redis_client, check, args.requests, args.concurrency)
+            accepted = await replays_accepted(
+                redis_client, check, args.concurrency)
+            print(f"{name:>16} {rate:>10.0f} "
+                  f"{f'{accepted}/{args.concurrency}':>17}")
+    finally:
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
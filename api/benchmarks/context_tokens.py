@@ -0,0 +1,65 @@
+'''
+Input tokens of the nutrition data sent to the generation LLM, the repr of
+the retrieved rows against the compact encoding, for a set of meals. Tokens
+are counted with the generation model's encoding, or as characters / 4
+when it cannot be loaded.
+
+    python -m benchmarks.context_tokens --budget 1000 --rows-per-item 4
+'''
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+
+from db.comp_food_database import SessionLocal
+from rags.protein_amount.chain import fetch_data
+from rags.protein_amount.compaction import (
+    compact_rows,
+    count_tokens,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_ROWS_PER_ITEM
+)
+from rags.protein_amount.retrieval import get_query
+
+MEALS = [
+    ('none', ["chicken breast", "white rice"]),
+    ('none', ["egg", "toast", "milk"]),
+    ('none', ["greek yogurt"]),
+    ('none', ["salmon", "quinoa", "chicken"]),
+    ('none', ["ground beef", "bread", "cheese", "tomato"]),
+    ('restaurant_name: Chipotle', ["chicken burrito bowl"]),
+    ("restaurant_name: McDonald's", ["big mac", "french fries"]),
+    ('brand_name: Chobani', ["greek yogurt"]),
+]
+
+
+def main(args):
+    print(f"{'meal':>42} {'repr':>6} {'compact':>8} {'saved':>6}")
+    saved, durations = [], []
+    with SessionLocal() as conn:
+        for restaurant_or_brand, items in MEALS:
+            queries, _, _ = get_query({
+                'restaurant_or_brand': AIMessage(content=restaurant_or_brand),
+                'food_items': AIMessage(content=json.dumps(items))
+            })
+            data = fetch_data(conn, queries)
+            start = time.perf_counter()
+            compacted = compact_rows(data, args.rows_per_item, args.budget)
+            durations.append((time.perf_counter() - start) * 1e6)
+
+            before, after = count_tokens(str(data)), count_tokens(compacted)
+            saved.append(before - after)
+            print(f"{', '.join(items)[:42]:>42} {before:>6} {after:>8} "
+                  f"{before - after:>6}")
+    print(f"Median tokens saved per request: {statistics.median(saved):.0f}, "
+          f"compaction p50 {statistics.median(durations):.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=int, default=CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--rows-per-item", type=int,
+                        default=CONTEXT_ROWS_PER_ITEM)
+    main(parser.parse_args())
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+RESTAURANT_OR_BRAND_RESPONSE = 'none'
+FOOD_ITEMS_RESPONSE = '["Chicken Breast", "Rice"]'
+GENERATION_RESPONSE = (
+    '[{"food_item": "Chicken Breast", "protein_amount": 31, '
+    '"protein_unit": "grams"}, '
+    '{"food_item": "Rice", "protein_amount": 4, "protein_unit": "grams"}]'
+)
+
+
+class SimulatedLatencyChatModel(BaseChatModel):
+    '''
+    Chat model that answers the protein prompts with canned responses after
+    a fixed delay, standing in for an OpenAI round trip.
+    '''
+
+    latency: float = 0.25
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-latency"
+
+    def _respond(self, messages: list[BaseMessage]) -> ChatResult:
+        prompt = messages[-1].content
+        if 'restaurant chain' in prompt:
+            content = RESTAURANT_OR_BRAND_RESPONSE
+        elif 'Identify all of the main food' in prompt:
+            content = FOOD_ITEMS_RESPONSE
+        else:
+            content = GENERATION_RESPONSE
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(self, messages: list[BaseMessage],
+                  stop: Optional[list[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages: list[BaseMessage],
+                         stop: Optional[list[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages)
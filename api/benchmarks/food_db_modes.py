@@ -0,0 +1,104 @@
+'''
+FTS query latency and per-worker memory of each FOOD_DB_MODE. Every mode
+runs in a fresh process, which reports its startup time, its first (cold)
+query, warm p50/p99 over a set of meals and its resident memory. Startup
+includes loading the database in memory mode.
+
+    python -m benchmarks.food_db_modes --modes default readonly memory
+
+With --drop-caches (root on Linux only) the OS page cache is dropped before
+each mode, so the cold query also reads from disk.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ITEMS = [
+    ["chicken breast", "white rice"],
+    ["egg", "toast"],
+    ["greek yogurt"],
+    ["salmon", "quinoa"],
+    ["ground beef"],
+    ["whole milk"],
+]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def worker(requests: int):
+    start = time.perf_counter()
+    from langchain_core.messages import AIMessage
+    from db.comp_food_database import SessionLocal
+    from rags.protein_amount.chain import fetch_data
+    from rags.protein_amount.retrieval import get_query
+    startup_ms = (time.perf_counter() - start) * 1e3
+
+    stages = [{
+        'restaurant_or_brand': AIMessage(content='none'),
+        'food_items': AIMessage(content=json.dumps(items))
+    } for items in ITEMS]
+
+    latencies = []
+    with SessionLocal() as conn:
+        for i in range(requests):
+            queries, _, _ = get_query(stages[i % len(stages)])
+            query_start = time.perf_counter()
+            fetch_data(conn, queries)
+            latencies.append((time.perf_counter() - query_start) * 1e6)
+
+    warm = latencies[len(ITEMS):]
+    print(json.dumps({
+        "startup_ms": startup_ms,
+        "cold_us": latencies[0],
+        "warm_p50_us": statistics.median(warm),
+        "warm_p99_us": statistics.quantiles(warm, n=100)[98],
+        "rss_mb": rss_mb(),
+    }))
+
+
+def drop_caches():
+    subprocess.run(["sync"], check=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def main(args):
+    print(f"{'mode':>10} {'startup ms':>11} {'cold us':>9} {'p50 us':>8} "
+          f"{'p99 us':>8} {'RSS MB':>8}")
+    for mode in args.modes:
+        if args.drop_caches:
+            drop_caches()
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.food_db_modes",
+             "--worker", "--requests", str(args.requests)],
+            env={**os.environ, "FOOD_DB_MODE": mode},
+            capture_output=True, text=True, check=True
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:>10} {stats['startup_ms']:>11.0f} "
+              f"{stats['cold_us']:>9.0f} {stats['warm_p50_us']:>8.0f} "
+              f"{stats['warm_p99_us']:>8.0f} {stats['rss_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modes", nargs="+", default=["default", "readonly", "memory"])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.requests)
+    else:
+        main(args)
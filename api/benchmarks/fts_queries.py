@@ -0,0 +1,106 @@
+'''
+Latency of the FTS retrieval queries, before (one SQL string rendered with
+Jinja per request, terms inlined as literals) and after (fixed statements
+with bound parameters, reused from SQLite's statement cache). Each request
+builds and runs the queries of the same food items.
+
+    python -m benchmarks.fts_queries --items "chicken breast" "white rice"
+'''
+import argparse
+import json
+import statistics
+import time
+
+from jinja2 import Template
+from langchain_core.messages import AIMessage
+from sqlalchemy import text
+
+from db.comp_food_database import SessionLocal
+from rags.protein_amount.chain import fetch_data
+from rags.protein_amount.retrieval import get_query
+
+# get_query before the fixed statements
+query_block_template = Template("""    SELECT '{{ item }}' AS food_item, {{ fields }}, tfts.rank
+    FROM {{ table }} t
+    INNER JOIN {{ table }}_fts tfts
+    ON t.id = tfts.id
+    WHERE {%- for d in description %} tfts.description MATCH '"{{ d }}"'
+    {%- if not loop.last %}
+    AND {%- endif %} {%- endfor %}
+    ORDER BY tfts.rank
+    LIMIT {{ limit }}
+""")
+
+final_query_template = Template("""WITH {%- for query in queries %}
+query_{{ loop.index }} AS (
+{{ query }}
+){%- if not loop.last %},{%- endif %}
+{%- endfor %}
+{%- for query in queries %}
+SELECT * FROM query_{{ loop.index }}
+{%- if not loop.last %}
+UNION ALL
+{%- endif %}
+{%- endfor %}
+ORDER BY rank;
+""")
+
+
+def templated_fetch(conn, stages: dict, limit: int = 12):
+    items = json.loads(stages['food_items'].content)
+    fields = 't.description, t.serving_size, t.protein_amount'
+    queries = [
+        query_block_template.render(
+            item=item.replace("'", "''"),
+            fields=fields,
+            table='non_branded_foods',
+            description=item.replace("'", "''").split(' '),
+            limit=limit
+        )
+        for item in items
+    ]
+    result = conn.execute(text(final_query_template.render(queries=queries)))
+    return [tuple(result.keys()), *result.fetchall()]
+
+
+def parameterized_fetch(conn, stages: dict):
+    queries, _, _ = get_query(stages)
+    return fetch_data(conn, queries)
+
+
+def measure(fetch, conn, stages, requests: int) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fetch(conn, stages)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def main(args):
+    # The retrieval stage outputs of a meal without a restaurant or brand
+    stages = {
+        'restaurant_or_brand': AIMessage(content='none'),
+        'food_items': AIMessage(content=json.dumps(args.items))
+    }
+    with SessionLocal() as conn:
+        same = [tuple(row) for row in templated_fetch(conn, stages)] == \
+            [tuple(row) for row in parameterized_fetch(conn, stages)]
+        print(f"Same rows: {same}")
+        print(f"{'query':>14} {'p50 us':>8} {'p99 us':>8}")
+        for name, fetch in [("templated", templated_fetch),
+                            ("parameterized", parameterized_fetch)]:
+            # Warm up the page cache and the statement cache
+            measure(fetch, conn, stages, 20)
+            latencies = measure(fetch, conn, stages, args.requests)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{name:>14} {statistics.median(latencies):>8.0f} "
+                  f"{p99:>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", nargs="+",
+                        default=["chicken breast", "white rice", "egg"])
+    parser.add_argument("--requests", type=int, default=1000)
+    main(parser.parse_args())
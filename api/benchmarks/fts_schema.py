@@ -0,0 +1,88 @@
+'''
+Query plans, latency and file size of the FTS retrieval queries on the
+legacy *_fts tables and on the external-content tables of
+db/fts_migration.sql. The migration is applied to a temporary copy of the
+food database, which is left unchanged.
+
+    python -m benchmarks.fts_schema --items "chicken breast" "white rice"
+'''
+import argparse
+import json
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage
+from sqlalchemy import create_engine, text
+
+from db.comp_food_database import DATABASE_URL
+from rags.protein_amount.chain import fetch_data
+from rags.protein_amount.retrieval import (
+    get_query,
+    detect_fts_schema,
+    LEGACY_SCHEMA,
+    EXTERNAL_CONTENT_SCHEMA
+)
+
+MIGRATION = Path(DATABASE_URL).parent / 'fts_migration.sql'
+
+
+def migrate(path: Path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.executescript(MIGRATION.read_text())
+    finally:
+        conn.close()
+
+
+def report(path: Path, stages: dict, requests: int):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        schema = detect_fts_schema(conn)
+        queries = get_query(stages, schema=schema)[0]
+        statement, params = queries[0]
+        plan = conn.execute(
+            text(f"EXPLAIN QUERY PLAN {statement.text}"), params).fetchall()
+        print(f"\n{schema} ({path.stat().st_size / 2**20:.1f}MB)")
+        for row in plan:
+            print(f"    {row[-1]}")
+
+        # Warm up the page cache and the statement cache
+        for _ in range(20):
+            fetch_data(conn, queries)
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            fetch_data(conn, queries)
+            latencies.append((time.perf_counter() - start) * 1e6)
+    engine.dispose()
+    p99 = statistics.quantiles(latencies, n=100)[98]
+    print(f"    p50 {statistics.median(latencies):.0f}us, p99 {p99:.0f}us")
+    return schema
+
+
+def main(args):
+    # The retrieval stage outputs of a meal without a restaurant or brand
+    stages = {
+        'restaurant_or_brand': AIMessage(content='none'),
+        'food_items': AIMessage(content=json.dumps(args.items))
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'CompFood.sqlite'
+        shutil.copyfile(DATABASE_URL, path)
+        if report(path, stages, args.requests) != LEGACY_SCHEMA:
+            print("The food database is already migrated")
+            return
+        migrate(path)
+        assert report(path, stages, args.requests) == EXTERNAL_CONTENT_SCHEMA
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", nargs="+",
+                        default=["chicken breast", "white rice", "egg"])
+    parser.add_argument("--requests", type=int, default=1000)
+    main(parser.parse_args())
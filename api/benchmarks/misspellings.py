@@ -0,0 +1,108 @@
+'''
+Recall and latency of the FTS retrieval queries on misspelled food items,
+exact words only against words corrected by the SpellingCorrector. An item
+is recalled when one of its rows contains the intended word or its plural.
+Pairs whose intended word is not in the database are skipped.
+
+    python -m benchmarks.misspellings
+'''
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+
+from db.comp_food_database import engine, SessionLocal
+from rags.protein_amount.chain import fetch_data
+from rags.protein_amount.retrieval import get_query
+from rags.protein_amount.spelling import (
+    SpellingCorrector,
+    fts_tokens,
+    SPELLING_MIN_TERM_FREQUENCY
+)
+
+# (as typed, intended word)
+MISSPELLINGS = [
+    ("keenwa", "quinoa"),
+    ("kinwa", "quinoa"),
+    ("chiken", "chicken"),
+    ("chikken", "chicken"),
+    ("brest", "breast"),
+    ("yoghurt", "yogurt"),
+    ("yogert", "yogurt"),
+    ("samon", "salmon"),
+    ("salman", "salmon"),
+    ("tost", "toast"),
+    ("brocoli", "broccoli"),
+    ("brocolli", "broccoli"),
+    ("avacado", "avocado"),
+    ("bannana", "banana"),
+    ("spagetti", "spaghetti"),
+    ("cinamon", "cinnamon"),
+    ("letuce", "lettuce"),
+    ("tomatoe", "tomato"),
+    ("potatoe", "potato"),
+    ("cheeze", "cheese"),
+    ("mozarella", "mozzarella"),
+    ("parmesian", "parmesan"),
+    ("sandwhich", "sandwich"),
+    ("hamburgur", "hamburger"),
+    ("oatmeel", "oatmeal"),
+    ("carots", "carrots"),
+    ("cucumbr", "cucumber"),
+    ("pinapple", "pineapple"),
+    ("strawbery", "strawberry"),
+    ("tortila", "tortilla"),
+]
+
+
+def recalled(rows: list, word: str) -> bool:
+    if not rows:
+        return False
+    index = rows[0].index('description')
+    # Plurals count, e.g. "tomatoes" for "tomato"
+    return any(token.startswith(word)
+               for row in rows[1:] for token in fts_tokens(row[index]))
+
+
+def main(args):
+    corrector = SpellingCorrector.build(engine, args.min_frequency)
+    vocabulary = corrector.vocabularies['non_branded_foods']
+    pairs = [(typo, word) for typo, word in MISSPELLINGS
+             if any(term.startswith(word) for term in vocabulary)]
+    print(f"{len(pairs)} of {len(MISSPELLINGS)} intended words "
+          f"are in non_branded_foods")
+
+    print(f"{'words':>10} {'recall':>8} {'p50 us':>8} {'p99 us':>8}")
+    with SessionLocal() as conn:
+        for name, spelling in [("exact", None), ("corrected", corrector)]:
+            hits, latencies = 0, []
+            for typo, word in pairs:
+                stages = {
+                    'restaurant_or_brand': AIMessage(content='none'),
+                    'food_items': AIMessage(content=json.dumps([typo]))
+                }
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    queries, _, _ = get_query(stages, corrector=spelling)
+                    rows = fetch_data(conn, queries)
+                    latencies.append((time.perf_counter() - start) * 1e6)
+                hits += recalled(rows, word)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{name:>10} {f'{hits}/{len(pairs)}':>8} "
+                  f"{statistics.median(latencies):>8.0f} {p99:>8.0f}")
+
+    if args.verbose:
+        for typo, word in pairs:
+            print(f"{typo:>12} -> "
+                  f"{corrector.correct(typo, 'non_branded_foods')} ({word})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--min-frequency", type=int,
+                        default=SPELLING_MIN_TERM_FREQUENCY)
+    parser.add_argument("--verbose", action="store_true")
+    main(parser.parse_args())
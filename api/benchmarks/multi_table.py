@@ -0,0 +1,74 @@
+'''
+Latency of searching the food tables: the one routed table, all three
+tables one after another on one connection, and all three at once on
+separate connections as RETRIEVAL_MODE=all_tables does.
+
+    python -m benchmarks.multi_table --items "chicken breast" "white rice"
+'''
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+
+from db.comp_food_database import SessionLocal
+from rags.protein_amount.chain import fetch_data, _execute
+from rags.protein_amount.retrieval import (
+    get_query,
+    merge_table_rows,
+    ROUTED_MODE,
+    ALL_TABLES_MODE
+)
+
+
+def routed(conn, stages: dict):
+    queries, _, _ = get_query(stages, mode=ROUTED_MODE)
+    return fetch_data(conn, queries)
+
+
+def sequential(conn, stages: dict):
+    searches, _, _ = get_query(stages, mode=ALL_TABLES_MODE)
+    results = {table: _execute(conn, search.queries)
+               for table, search in searches.items()}
+    return merge_table_rows(
+        {table: result for table, result in results.items()
+         if result[0] is not None},
+        searches)
+
+
+def concurrent(conn, stages: dict):
+    searches, _, _ = get_query(stages, mode=ALL_TABLES_MODE)
+    return fetch_data(conn, searches)
+
+
+def main(args):
+    stages = {
+        'restaurant_or_brand': AIMessage(content=args.restaurant_or_brand),
+        'food_items': AIMessage(content=json.dumps(args.items))
+    }
+    with SessionLocal() as conn:
+        print(f"{'tables':>22} {'rows':>5} {'p50 us':>8} {'p99 us':>8}")
+        for name, fetch in [("routed", routed),
+                            ("all, one after another", sequential),
+                            ("all, concurrent", concurrent)]:
+            # Warm up the page cache, the statement cache and the pool
+            for _ in range(20):
+                rows = fetch(conn, stages)
+            latencies = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                fetch(conn, stages)
+                latencies.append((time.perf_counter() - start) * 1e6)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{name:>22} {max(len(rows) - 1, 0):>5} "
+                  f"{statistics.median(latencies):>8.0f} {p99:>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", nargs="+",
+                        default=["chicken breast", "white rice", "egg"])
+    parser.add_argument("--restaurant-or-brand", default="none")
+    parser.add_argument("--requests", type=int, default=1000)
+    main(parser.parse_args())
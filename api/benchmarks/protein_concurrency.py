@@ -0,0 +1,79 @@
+'''
+Throughput of the /protein chain as the number of requests in flight grows.
+
+The OpenAI models are swapped for `SimulatedLatencyChatModel`, so the numbers
+measure how well the event loop overlaps requests rather than OpenAI itself.
+The FTS query runs against the real CompFood database.
+
+    python -m benchmarks.protein_concurrency --latency 0.25 --requests 64
+'''
+import argparse
+import asyncio
+import time
+
+from db.comp_food_database import SessionLocal
+from rags.protein_amount import chain
+from benchmarks.fakes import SimulatedLatencyChatModel
+
+MEAL = "chicken breast and rice"
+
+
+async def blocking_request():
+    # What the endpoint did before: a sync chain inside an async handler
+    with SessionLocal() as session:
+        return chain.run(MEAL, session)
+
+
+async def async_request():
+    with SessionLocal() as session:
+        return await chain.arun(MEAL, session)
+
+
+async def measure(request, total: int, in_flight: int) -> float:
+    semaphore = asyncio.Semaphore(in_flight)
+
+    async def limited():
+        async with semaphore:
+            await request()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+def install_fake_models(latency: float):
+    model = SimulatedLatencyChatModel(latency=latency)
+    chain.restaurant_or_brand_chain = chain.get_restaurant_or_brand_prompt | model
+    chain.food_items_chain = chain.food_items_prompt | model
+    chain.retrieval_chain = chain.RunnableParallel(
+        restaurant_or_brand=chain.restaurant_or_brand_chain,
+        food_items=chain.food_items_chain
+    ) | chain.RunnableLambda(chain.get_query)
+    chain.generation_chain = (
+        chain.generation_prompt | model | chain.JsonOutputParser())
+
+
+def disable_stage_memos():
+    # Every request should pay for its LLM calls
+    chain.restaurant_or_brand_memo.maxsize = 0
+    chain.food_items_memo.maxsize = 0
+
+
+async def main(args):
+    install_fake_models(args.latency)
+    disable_stage_memos()
+    print(f"{'in flight':>10} {'sync req/s':>12} {'async req/s':>12}")
+    for in_flight in args.in_flight:
+        sync_rps = await measure(blocking_request, args.requests, in_flight)
+        async_rps = await measure(async_request, args.requests, in_flight)
+        print(f"{in_flight:>10} {sync_rps:>12.2f} {async_rps:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.25,
+                        help="simulated seconds per LLM call")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--in-flight", type=int, nargs="+",
+                        default=[1, 4, 16, 32])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+'''
+Per-request Redis overhead of the get_redis / get_async_redis dependencies,
+before (a new client and connection per request) and after (clients handed
+out from the process-wide pool). Each request issues one GET.
+
+    REDIS_URL=redis://localhost:6379/0 python -m benchmarks.redis_overhead
+'''
+import argparse
+import asyncio
+import time
+
+import redis
+import redis.asyncio
+
+from cache.store import (
+    REDIS_URL,
+    get_redis,
+    get_async_redis,
+    init_redis_pools,
+    close_redis_pools
+)
+
+
+def unpooled_get_redis():
+    # get_redis before the connection pool
+    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+    try:
+        yield redis_client
+    finally:
+        redis_client.close()
+
+
+async def unpooled_get_async_redis():
+    redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+    try:
+        yield redis_client
+    finally:
+        await redis_client.aclose()
+
+
+def measure_sync(dependency, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        dependency_gen = dependency()
+        next(dependency_gen).get("benchmark:redis_overhead")
+        dependency_gen.close()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def measure_async(dependency, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        dependency_gen = dependency()
+        await (await anext(dependency_gen)).get("benchmark:redis_overhead")
+        await dependency_gen.aclose()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main(args):
+    await init_redis_pools()
+    try:
+        print(f"{'dependency':>18} {'unpooled us/req':>16} "
+              f"{'pooled us/req':>14}")
+        print(f"{'get_redis':>18} "
+              f"{measure_sync(unpooled_get_redis, args.requests):>16.0f} "
+              f"{measure_sync(get_redis, args.requests):>14.0f}")
+        unpooled = await measure_async(unpooled_get_async_redis, args.requests)
+        pooled = await measure_async(get_async_redis, args.requests)
+        print(f"{'get_async_redis':>18} {unpooled:>16.0f} {pooled:>14.0f}")
+    finally:
+        await close_redis_pools()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
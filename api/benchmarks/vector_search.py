@@ -0,0 +1,56 @@
+'''
+CPU latency of searching the embedding index, for requests of 1 to 8 food
+items. The index holds random vectors of the given size in a temporary
+directory, so no embedding calls are made.
+
+    python -m benchmarks.vector_search --rows 400000 --dimensions 256
+'''
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rags.protein_amount.embeddings import EmbeddingIndex
+from rags.protein_amount.retrieval import RETRIEVAL_LIMIT
+
+TABLE = 'branded_foods'
+
+
+def main(args):
+    generator = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+        EmbeddingIndex.write(path, {TABLE: (
+            np.arange(1, args.rows + 1, dtype=np.int64),
+            generator.standard_normal((args.rows, args.dimensions),
+                                      dtype=np.float32))})
+        index = EmbeddingIndex(path)
+        size = (path / 'vectors.npy').stat().st_size / 2 ** 20
+        print(f"{args.rows} x {args.dimensions} int8 vectors, {size:.0f} MB")
+
+        print(f"{'items':>5} {'p50 ms':>8} {'p99 ms':>8}")
+        for items in (1, 4, 8):
+            queries = generator.standard_normal(
+                (items, args.dimensions), dtype=np.float32)
+            # Warm up the page cache
+            for _ in range(3):
+                index.search(queries, TABLE, RETRIEVAL_LIMIT)
+            latencies = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                index.search(queries, TABLE, RETRIEVAL_LIMIT)
+                latencies.append((time.perf_counter() - start) * 1e3)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{items:>5} {statistics.median(latencies):>8.2f} "
+                  f"{p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=400_000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=200)
+    main(parser.parse_args())
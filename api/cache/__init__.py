@@ -1,17 +1,43 @@
 from cache.store import (
     get_redis,
+    get_async_redis,
     generate_challenge,
+    generate_challenges,
     CHALLENGE_PREFIX,
     KEY_CHALLENGE_PREFIX,
     KEY_COUNTER_PREFIX,
-    KEY_PUBLIC_KEY_PREFIX
+    KEY_PUBLIC_KEY_PREFIX,
+    CHALLENGE_TTL_SECONDS,
+    KEY_CHALLENGE_TTL_SECONDS
 )
+from cache.response_cache import (
+    get_cached_response,
+    get_cached_responses,
+    set_cached_response,
+    normalize_text,
+    response_key,
+    PROTEIN_RESPONSE_PREFIX
+)
+from cache.singleflight import SingleFlight
+from cache.accounting import prefix_usage
 
 __all__ = [
     'get_redis',
+    'get_async_redis',
     'generate_challenge',
+    'generate_challenges',
     'CHALLENGE_PREFIX',
     'KEY_CHALLENGE_PREFIX',
     'KEY_COUNTER_PREFIX',
-    'KEY_PUBLIC_KEY_PREFIX'
+    'KEY_PUBLIC_KEY_PREFIX',
+    'CHALLENGE_TTL_SECONDS',
+    'KEY_CHALLENGE_TTL_SECONDS',
+    'get_cached_response',
+    'get_cached_responses',
+    'set_cached_response',
+    'normalize_text',
+    'response_key',
+    'PROTEIN_RESPONSE_PREFIX',
+    'SingleFlight',
+    'prefix_usage'
 ]
@@ -0,0 +1,82 @@
+import logging
+import os
+
+import redis.asyncio
+
+from cache.store import (
+    CHALLENGE_PREFIX,
+    KEY_CHALLENGE_PREFIX,
+    KEY_COUNTER_PREFIX,
+    KEY_PUBLIC_KEY_PREFIX
+)
+from cache.response_cache import PROTEIN_RESPONSE_PREFIX
+from cache.memo import STAGE_MEMO_PREFIX
+from cache.singleflight import SINGLEFLIGHT_PREFIX
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIXES = [
+    CHALLENGE_PREFIX,
+    KEY_CHALLENGE_PREFIX,
+    KEY_COUNTER_PREFIX,
+    KEY_PUBLIC_KEY_PREFIX,
+    PROTEIN_RESPONSE_PREFIX,
+    STAGE_MEMO_PREFIX,
+    SINGLEFLIGHT_PREFIX,
+]
+REDIS_MEMORY_SAMPLE_SIZE = int(os.getenv("REDIS_MEMORY_SAMPLE_SIZE", 100))
+REDIS_SCAN_COUNT = 1000
+
+
+async def _sampled_memory(redis_client: redis.asyncio.Redis, keys: list[str]):
+    """Total MEMORY USAGE of the keys, or None if the server lacks it"""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.memory_usage(key)
+        usages = await pipe.execute(raise_on_error=False)
+    if any(isinstance(usage, redis.ResponseError) for usage in usages):
+        return None
+    # Keys that expired since the scan report None
+    return [usage for usage in usages if usage is not None]
+
+
+async def prefix_usage(
+    redis_client: redis.asyncio.Redis,
+    prefixes: list[str] = REDIS_PREFIXES,
+    sample_size: int = REDIS_MEMORY_SAMPLE_SIZE
+) -> dict[str, dict]:
+    '''
+    Number of keys and estimated memory of each key prefix. Keys are counted
+    with SCAN and memory is extrapolated from the MEMORY USAGE of the first
+    `sample_size` keys scanned. The counts are also kept as gauges.
+    '''
+    usage = {}
+    for prefix in prefixes:
+        count, sample = 0, []
+        async for key in redis_client.scan_iter(
+                match=f"{prefix}*", count=REDIS_SCAN_COUNT):
+            count += 1
+            if len(sample) < sample_size:
+                sample.append(key)
+
+        memory = await _sampled_memory(redis_client, sample) \
+            if sample else []
+        if memory is None:
+            logger.warning("MEMORY USAGE is not supported by this server")
+            average_bytes = estimated_bytes = None
+        else:
+            average_bytes = sum(memory) / len(memory) if memory else 0
+            estimated_bytes = round(average_bytes * count)
+
+        name = prefix.rstrip(':')
+        metrics.set_gauge(f"redis.{name}.keys", count)
+        if estimated_bytes is not None:
+            metrics.set_gauge(f"redis.{name}.estimated_bytes", estimated_bytes)
+        usage[prefix] = {
+            "keys": count,
+            "sampled_keys": len(sample),
+            "average_bytes": average_bytes,
+            "estimated_bytes": estimated_bytes,
+        }
+    return usage
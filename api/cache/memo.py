@@ -0,0 +1,97 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import redis.asyncio
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+STAGE_MEMO_PREFIX = "stage_memo:"
+
+
+class TieredMemo:
+    '''
+    Two tier memo of string values: an in-process LRU in front of a shared
+    Redis tier. Hits and misses of each tier are counted under
+    `stage_memo.{name}.*` and the overall hit rate is kept as a gauge.
+
+    A `maxsize` of 0 disables the local tier, and the Redis tier is skipped
+    when no client is given or `ttl` is 0.
+    '''
+
+    def __init__(self, name: str, maxsize: int, ttl: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = OrderedDict()
+        self._lookups = 0
+        self._hits = 0
+
+    def _redis_key(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return f"{STAGE_MEMO_PREFIX}{self.name}:{digest}"
+
+    def _count(self, outcome: str):
+        self._lookups += 1
+        if outcome != "misses":
+            self._hits += 1
+        metrics.incr(f"stage_memo.{self.name}.{outcome}")
+        metrics.set_gauge(f"stage_memo.{self.name}.hit_rate",
+                          self._hits / self._lookups)
+
+    def _set_local(self, key: str, value: str):
+        if self.maxsize <= 0:
+            return
+        self._local[key] = value
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+            metrics.incr(f"stage_memo.{self.name}.evictions")
+
+    async def get(
+        self,
+        key: str,
+        redis_client: Optional[redis.asyncio.Redis] = None
+    ) -> Optional[str]:
+        """Get a memoized value, checking the local tier first"""
+        if key in self._local:
+            self._local.move_to_end(key)
+            self._count("local_hits")
+            return self._local[key]
+
+        value = None
+        if redis_client is not None and self.ttl > 0:
+            try:
+                value = await redis_client.get(self._redis_key(key))
+            except redis.RedisError as e:
+                logger.warning(f"Stage memo unavailable: {e}")
+
+        if value is None:
+            self._count("misses")
+            return None
+
+        self._set_local(key, value)
+        self._count("redis_hits")
+        return value
+
+    async def set(
+        self,
+        key: str,
+        value: str,
+        redis_client: Optional[redis.asyncio.Redis] = None
+    ):
+        """Memoize a value in both tiers"""
+        self._set_local(key, value)
+        if redis_client is None or self.ttl <= 0:
+            return
+        try:
+            await redis_client.set(self._redis_key(key), value, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Stage memo unavailable: {e}")
+
+    def clear(self):
+        """Drop every entry of the local tier"""
+        self._local.clear()
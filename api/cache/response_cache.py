@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+
+import redis.asyncio
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROTEIN_RESPONSE_PREFIX = "protein_response:"
+PROTEIN_RESPONSE_INDEX = "protein_response_index"
+
+PROTEIN_CACHE_TTL_SECONDS = int(
+    os.getenv("PROTEIN_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+PROTEIN_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("PROTEIN_CACHE_MAX_ENTRY_BYTES", 16 * 1024))
+PROTEIN_CACHE_MAX_ENTRIES = int(
+    os.getenv("PROTEIN_CACHE_MAX_ENTRIES", 100_000))
+
+NUMBER_WORDS = {
+    'a dozen': '12',
+    'half a': '0.5',
+    'half': '0.5',
+    'one': '1',
+    'two': '2',
+    'three': '3',
+    'four': '4',
+    'five': '5',
+    'six': '6',
+    'seven': '7',
+    'eight': '8',
+    'nine': '9',
+    'ten': '10',
+    'eleven': '11',
+    'twelve': '12',
+    'dozen': '12',
+}
+NUMBER_WORDS_PATTERN = re.compile(
+    r'\b(' + '|'.join(NUMBER_WORDS) + r')\b')
+THOUSANDS_PATTERN = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+# "½", "1½" and "1 ½", matched before NFKC turns "1½" into "11⁄2"
+VULGAR_FRACTION_PATTERN = re.compile(
+    r'(?:\b(\d+)\s*)?([\u00bc-\u00be\u2150-\u215e])')
+# "1/2" and the mixed number "1 1/2"
+FRACTION_PATTERN = re.compile(r'\b(?:(\d+)\s+)?(\d+)\s*[/⁄]\s*(\d+)\b')
+NUMBER_PATTERN = re.compile(r'\d*\.?\d+')
+NUMBER_UNIT_PATTERN = re.compile(r'(\d)([a-z])')
+APOSTROPHE_PATTERN = re.compile(r"['’]")
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s.]|_|\.(?!\d)')
+
+
+def _format_number(match: re.Match) -> str:
+    return f"{float(match.group(0)):f}".rstrip('0').rstrip('.') or '0'
+
+
+def _format_vulgar_fraction(match: re.Match) -> str:
+    whole = int(match.group(1) or 0)
+    return f" {whole + unicodedata.numeric(match.group(2)):.3f} "
+
+
+def _format_fraction(match: re.Match) -> str:
+    whole = int(match.group(1) or 0)
+    numerator, denominator = int(match.group(2)), int(match.group(3))
+    if not denominator:
+        return match.group(0)
+    return f"{whole + numerator / denominator:.3f}"
+
+
+def normalize_text(text: str) -> str:
+    '''
+    Fold a meal description to the form used as the cache key:
+    - unicode, case and whitespace are normalized
+    - punctuation is dropped
+    - numbers are canonical ("2.0", "02" and "two" all become "2",
+      "1,000" becomes "1000", "1/2" or "½" becomes "0.5" and "1 1/2" or
+      "1½" becomes "1.5")
+    - numbers are split from their units ("100g" becomes "100 g")
+    '''
+    text = VULGAR_FRACTION_PATTERN.sub(_format_vulgar_fraction, text)
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = APOSTROPHE_PATTERN.sub('', text)
+    text = THOUSANDS_PATTERN.sub('', text)
+    text = FRACTION_PATTERN.sub(_format_fraction, text)
+    text = PUNCTUATION_PATTERN.sub(' ', text)
+    text = NUMBER_WORDS_PATTERN.sub(
+        lambda match: NUMBER_WORDS[match.group(0)], text)
+    text = NUMBER_PATTERN.sub(_format_number, text)
+    text = NUMBER_UNIT_PATTERN.sub(r'\1 \2', text)
+    return ' '.join(text.split())
+
+
+def response_key(text: str) -> str:
+    """Get the Redis key of the cached response for a meal description"""
+    digest = hashlib.sha1(normalize_text(text).encode()).hexdigest()
+    return f"{PROTEIN_RESPONSE_PREFIX}{digest}"
+
+
+async def get_cached_response(redis_client: redis.asyncio.Redis, text: str):
+    """Get the cached /protein results for a meal, or None on a miss"""
+    try:
+        cached = await redis_client.get(response_key(text))
+    except redis.RedisError as e:
+        logger.warning(f"Response cache unavailable: {e}")
+        cached = None
+
+    if cached is None:
+        metrics.incr("protein_response_cache.misses")
+        return None
+
+    metrics.incr("protein_response_cache.hits")
+    return json.loads(cached)
+
+
+async def get_cached_responses(
+    redis_client: redis.asyncio.Redis,
+    texts: list[str]
+) -> list:
+    """Get the cached results of many meals in one round trip"""
+    if not texts:
+        return []
+    try:
+        cached = await redis_client.mget([response_key(text) for text in texts])
+    except redis.RedisError as e:
+        logger.warning(f"Response cache unavailable: {e}")
+        cached = [None] * len(texts)
+
+    hits = sum(value is not None for value in cached)
+    metrics.incr("protein_response_cache.hits", hits)
+    metrics.incr("protein_response_cache.misses", len(texts) - hits)
+    return [json.loads(value) if value is not None else None
+            for value in cached]
+
+
+async def set_cached_response(
+    redis_client: redis.asyncio.Redis,
+    text: str,
+    results
+):
+    '''
+    Cache the /protein results for a meal.
+    Entries expire after PROTEIN_CACHE_TTL_SECONDS. Entries larger than
+    PROTEIN_CACHE_MAX_ENTRY_BYTES are not stored, and once there are more than
+    PROTEIN_CACHE_MAX_ENTRIES the oldest ones are evicted.
+    '''
+    value = json.dumps(results, separators=(',', ':'))
+    if len(value.encode()) > PROTEIN_CACHE_MAX_ENTRY_BYTES:
+        metrics.incr("protein_response_cache.skipped_too_large")
+        return
+
+    key = response_key(text)
+    now = time.time()
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(key, value, ex=PROTEIN_CACHE_TTL_SECONDS)
+            pipe.zadd(PROTEIN_RESPONSE_INDEX, {key: now})
+            pipe.zremrangebyscore(PROTEIN_RESPONSE_INDEX, '-inf',
+                                  now - PROTEIN_CACHE_TTL_SECONDS)
+            pipe.zcard(PROTEIN_RESPONSE_INDEX)
+            *_, size = await pipe.execute()
+
+        overflow = size - PROTEIN_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = await redis_client.zpopmin(
+                PROTEIN_RESPONSE_INDEX, overflow)
+            await redis_client.delete(*(key for key, _ in evicted))
+            metrics.incr("protein_response_cache.evictions", len(evicted))
+    except redis.RedisError as e:
+        logger.warning(f"Response cache unavailable: {e}")
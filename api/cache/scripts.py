@@ -0,0 +1,102 @@
+import hashlib
+
+import redis.asyncio
+from redis.exceptions import NoScriptError
+
+
+class RedisScript:
+    '''
+    A Lua script invoked by its SHA1. The script is loaded into Redis the
+    first time EVALSHA reports it missing (e.g. after a restart or failover),
+    so the source is sent once rather than with every call.
+    '''
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    async def __call__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        keys: list[str],
+        args: list
+    ):
+        try:
+            return await redis_client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await redis_client.script_load(self.source)
+            return await redis_client.evalsha(self.sha, len(keys), *keys, *args)
+
+
+# KEYS: public key, key challenge, counter
+# ARGV: public key the signature was verified with, challenge,
+#       assertion counter, challenge TTL in seconds (0 keeps it as is)
+# Advances the counter only if the public key is still the stored one, the
+# challenge matches and the counter increased, and refreshes the TTL of the
+# challenge. Returns {"ok"}, {"invalid"} or {"stale_key", stored public key}.
+CHECK_ASSERTION_SCRIPT = RedisScript("""
+local public_key = redis.call('GET', KEYS[1])
+if public_key ~= ARGV[1] then
+    return {'stale_key', public_key or ''}
+end
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+    return {'invalid'}
+end
+local counter = tonumber(redis.call('GET', KEYS[3]) or '0')
+if tonumber(ARGV[3]) <= counter then
+    return {'invalid'}
+end
+redis.call('SET', KEYS[3], ARGV[3])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+return {'ok'}
+""")
+
+# Delete the lock only if this caller still holds it
+RELEASE_LOCK_SCRIPT = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# KEYS: challenge
+# ARGV: challenge value sent with the request, challenge value and counter
+#       from the token nonce, challenge TTL in seconds (0 keeps it as is)
+# Counters are compared as digit strings, since they have more digits than a
+# Lua number holds exactly. Advances the stored counter, refreshing the TTL,
+# and returns "ok", or returns "missing", "invalid" or "replay".
+ADVANCE_CHALLENGE_SCRIPT = RedisScript("""
+local function is_greater(a, b)
+    a = string.gsub(a, '^0+', '')
+    b = string.gsub(b, '^0+', '')
+    if #a ~= #b then
+        return #a > #b
+    end
+    return a > b
+end
+
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+    return 'missing'
+end
+local dot = string.find(stored, '.', 1, true)
+if not dot then
+    return 'invalid'
+end
+local value = string.sub(stored, 1, dot - 1)
+local counter = string.sub(stored, dot + 1)
+if value ~= ARGV[1] or value ~= ARGV[2] then
+    return 'invalid'
+end
+if not string.match(ARGV[3], '^%d+$') or not is_greater(ARGV[3], counter) then
+    return 'replay'
+end
+if tonumber(ARGV[4]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[2] .. '.' .. ARGV[3], 'EX', ARGV[4])
+else
+    redis.call('SET', KEYS[1], ARGV[2] .. '.' .. ARGV[3], 'KEEPTTL')
+end
+return 'ok'
+""")
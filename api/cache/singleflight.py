@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Awaitable, Callable, Optional
+
+import redis.asyncio
+
+from cache.scripts import RELEASE_LOCK_SCRIPT
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_PREFIX = "singleflight:"
+SINGLEFLIGHT_LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", 30_000))
+SINGLEFLIGHT_RESULT_TTL_MS = int(
+    os.getenv("SINGLEFLIGHT_RESULT_TTL_MS", 10_000))
+SINGLEFLIGHT_POLL_INTERVAL_MS = int(
+    os.getenv("SINGLEFLIGHT_POLL_INTERVAL_MS", 50))
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls with the same key into one execution.
+
+    Callers in the same worker wait on the leader's future. Across workers
+    the leader holds a short-lived Redis lock and publishes its JSON result
+    in a result slot, which the other workers poll until the lock is gone.
+    Waiters are counted under `singleflight.{name}.*`.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _keys(self, key: str) -> tuple[str, str]:
+        return (f"{SINGLEFLIGHT_PREFIX}{self.name}:lock:{key}",
+                f"{SINGLEFLIGHT_PREFIX}{self.name}:result:{key}")
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable],
+        redis_client: Optional[redis.asyncio.Redis] = None
+    ):
+        """Run fn, or wait for the result of an identical call in flight"""
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            metrics.incr(f"singleflight.{self.name}.local_waiters")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._do_shared(key, fn, redis_client)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody was waiting
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                # The leader was cancelled, so are its waiters
+                future.cancel()
+            del self._inflight[key]
+
+    async def _do_shared(self, key, fn, redis_client):
+        if redis_client is None:
+            metrics.incr(f"singleflight.{self.name}.leaders")
+            return await fn()
+
+        lock_key, result_key = self._keys(key)
+        token = secrets.token_hex(8)
+        try:
+            result = await redis_client.get(result_key)
+            if result is not None:
+                metrics.incr(f"singleflight.{self.name}.remote_waiters")
+                return json.loads(result)
+            acquired = await redis_client.set(
+                lock_key, token, nx=True, px=SINGLEFLIGHT_LOCK_TTL_MS)
+        except redis.RedisError as e:
+            logger.warning(f"Single-flight lock unavailable: {e}")
+            metrics.incr(f"singleflight.{self.name}.leaders")
+            return await fn()
+
+        if not acquired:
+            result = await self._wait(redis_client, lock_key, result_key)
+            if result is not None:
+                return result
+            # The leader failed or timed out, so run it here instead
+            metrics.incr(f"singleflight.{self.name}.fallbacks")
+            return await fn()
+
+        metrics.incr(f"singleflight.{self.name}.leaders")
+        try:
+            result = await fn()
+            await redis_client.set(result_key, json.dumps(result),
+                                   px=SINGLEFLIGHT_RESULT_TTL_MS)
+            return result
+        finally:
+            try:
+                await RELEASE_LOCK_SCRIPT(redis_client, [lock_key], [token])
+            except redis.RedisError as e:
+                logger.warning(f"Could not release single-flight lock: {e}")
+
+    async def _wait(self, redis_client: redis.asyncio.Redis,
+                    lock_key: str, result_key: str):
+        """Poll the result slot while another worker holds the lock"""
+        metrics.incr(f"singleflight.{self.name}.remote_waiters")
+        deadline = time.monotonic() + SINGLEFLIGHT_LOCK_TTL_MS / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL_MS / 1000)
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.get(result_key)
+                    pipe.exists(lock_key)
+                    result, locked = await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Single-flight result unavailable: {e}")
+                return None
+            if result is not None:
+                return json.loads(result)
+            if not locked:
+                return None
+        return None
@@ -1,14 +1,19 @@
+import asyncio
 import os
 import secrets
 import string
 import redis
-import random
+import redis.asyncio
 
 from utils.get_secret import get_secret
 
 # Get Redis connection parameters from environment variables
 REDIS_URL = get_secret("REDIS_URL")
 ENV = os.getenv("ENVIRONMENT", "dev")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_SOCKET_KEEPALIVE = os.getenv(
+    "REDIS_SOCKET_KEEPALIVE", "true").lower() == "true"
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
 
 # Key prefixes for different stores
 CHALLENGE_PREFIX = "challenge:"
@@ -17,26 +22,119 @@ KEY_COUNTER_PREFIX = "key_counter:"
 KEY_PUBLIC_KEY_PREFIX = "key_public_key:"
 CHALLENGE_COUNTER_BIT_LENGTH = 16
 
+# Lifetime of challenges, refreshed each time a challenge is used (0 keeps
+# them forever)
+CHALLENGE_TTL_SECONDS = int(os.getenv("CHALLENGE_TTL_SECONDS", 60 * 60 * 24))
+KEY_CHALLENGE_TTL_SECONDS = int(
+    os.getenv("KEY_CHALLENGE_TTL_SECONDS", 60 * 60 * 24 * 7))
+
+
+# Process-wide connection pools, created by the app lifespan
+_redis_pool = None
+_async_redis_pool = None
+_async_redis_pool_loop = None
+
+
+def _pool_options() -> dict:
+    return {
+        "decode_responses": True,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "socket_keepalive": REDIS_SOCKET_KEEPALIVE,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def _get_redis_pool() -> redis.ConnectionPool:
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = redis.ConnectionPool.from_url(
+            REDIS_URL, **_pool_options())
+    return _redis_pool
+
+
+def _get_async_redis_pool() -> redis.asyncio.ConnectionPool:
+    global _async_redis_pool, _async_redis_pool_loop
+    # asyncio connections belong to the loop that opened them
+    loop = asyncio.get_running_loop()
+    if _async_redis_pool is None or _async_redis_pool_loop is not loop:
+        _async_redis_pool = redis.asyncio.ConnectionPool.from_url(
+            REDIS_URL, **_pool_options())
+        _async_redis_pool_loop = loop
+    return _async_redis_pool
+
+
+async def init_redis_pools():
+    """Create the connection pools (called on app startup)"""
+    _get_redis_pool()
+    _get_async_redis_pool()
+
+
+async def close_redis_pools():
+    """Disconnect the connection pools (called on app shutdown)"""
+    global _redis_pool, _async_redis_pool, _async_redis_pool_loop
+    if _redis_pool is not None:
+        _redis_pool.disconnect()
+    if _async_redis_pool is not None:
+        await _async_redis_pool.disconnect()
+    _redis_pool = _async_redis_pool = _async_redis_pool_loop = None
+
 
 def get_redis():
     """Get Redis client for dependency injection"""
-    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+    redis_client = redis.Redis(connection_pool=_get_redis_pool())
     try:
         yield redis_client
     finally:
+        # Returns the connection to the pool, the pool stays open
         redis_client.close()
 
 
+async def get_async_redis():
+    """Get asyncio Redis client for dependency injection"""
+    redis_client = redis.asyncio.Redis(
+        connection_pool=_get_async_redis_pool())
+    try:
+        yield redis_client
+    finally:
+        # Returns the connection to the pool, the pool stays open
+        await redis_client.aclose()
+
+
+# Random bytes map onto the 62 letters and digits. Bytes from 248 (4 * 62)
+# up are dropped so that every character is equally likely.
+CHALLENGE_ALPHABET = (string.ascii_letters + string.digits).encode()
+_ALPHABET_LIMIT = 256 - 256 % len(CHALLENGE_ALPHABET)
+_ALPHABET_TABLE = bytes(
+    CHALLENGE_ALPHABET[i % len(CHALLENGE_ALPHABET)] for i in range(256))
+_ALPHABET_REJECTED = bytes(range(_ALPHABET_LIMIT, 256))
+
+
 def get_random_str(length: int) -> str:
     """Get a random string of a given length"""
-    return ''.join(secrets.choice(
-        string.ascii_letters + string.digits) for _ in range(length))
+    value = b''
+    while len(value) < length:
+        # A few spare bytes make a second draw rare
+        raw = secrets.token_bytes(length - len(value) + 8)
+        value += raw.translate(_ALPHABET_TABLE, _ALPHABET_REJECTED)
+    return value[:length].decode()
+
+
+def _challenge_counter() -> int:
+    """Random counter of CHALLENGE_COUNTER_BIT_LENGTH digits"""
+    low = 10**(CHALLENGE_COUNTER_BIT_LENGTH - 1)
+    return low + secrets.randbelow(9 * low)
+
+
+def generate_challenges(count: int) -> list[str]:
+    """Create many challenges from one draw of random bytes"""
+    random_str = get_random_str(48 * count)
+    return [
+        f"{random_str[i:i + 16]}.{random_str[i + 16:i + 48]}."
+        f"{_challenge_counter()}"
+        for i in range(0, 48 * count, 48)
+    ]
 
 
-def generate_challenge() -> tuple[str, str]:
+def generate_challenge() -> str:
     """Create a new challenge"""
-    id = get_random_str(16)
-    challenge = get_random_str(32)
-    counter = random.randint(10**(CHALLENGE_COUNTER_BIT_LENGTH - 1),
-                             (10**CHALLENGE_COUNTER_BIT_LENGTH) - 1)
-    return f"{id}.{challenge}.{counter}"
+    return generate_challenges(1)[0]
@@ -1,20 +1,135 @@
-from sqlalchemy import create_engine
+import logging
+import os
+import sqlite3
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from pathlib import Path
 
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
 # Get the database path relative to the main.py file
 DATABASE_URL = Path(__file__).parent / 'CompFood.sqlite'
 
-# Create SQLAlchemy engine with optimizations for SQLite
-engine = create_engine(
-    f"sqlite:///{DATABASE_URL}",
-    connect_args={
-        "check_same_thread": False  # Needed for SQLite
-    },
-    # Performance optimizations
-    pool_pre_ping=True,
-    pool_recycle=300,
-)
+# "default" opens the file like any database, "readonly" serves it as the
+# immutable reference dataset it is at runtime and "memory" serves a copy of
+# it loaded into memory at startup
+FOOD_DB_MODE = os.getenv("FOOD_DB_MODE", "default")
+FOOD_DB_CACHE_SIZE_KB = int(os.getenv("FOOD_DB_CACHE_SIZE_KB", 64 * 1024))
+FOOD_DB_MEMORY_LIMIT_MB = int(os.getenv("FOOD_DB_MEMORY_LIMIT_MB", 4096))
+
+# Keeps the in-memory copy alive, SQLite frees a shared in-memory database
+# when its last connection closes
+_memory_anchor = None
+
+
+def _default_engine():
+    # Create SQLAlchemy engine with optimizations for SQLite
+    return create_engine(
+        f"sqlite:///{DATABASE_URL}",
+        connect_args={
+            "check_same_thread": False  # Needed for SQLite
+        },
+        # Performance optimizations
+        pool_pre_ping=True,
+        pool_recycle=300,
+    )
+
+
+def _readonly_engine():
+    '''
+    Open the file read-only and immutable, so SQLite skips locking and
+    change detection, and memory-map all of it. Connections never go stale,
+    so there is no pre-ping or recycling.
+    '''
+    mmap_size = int(os.getenv("FOOD_DB_MMAP_SIZE",
+                              DATABASE_URL.stat().st_size))
+    engine = create_engine(
+        f"sqlite:///file:{DATABASE_URL}?mode=ro&immutable=1&uri=true",
+        connect_args={
+            "check_same_thread": False  # Needed for SQLite
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA mmap_size = {mmap_size}")
+        cursor.execute(f"PRAGMA cache_size = -{FOOD_DB_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.close()
+
+    return engine
+
+
+def _memory_engine():
+    '''
+    Copy the whole file into a shared-cache in-memory database with the
+    backup API, so every thread of the worker queries the same copy. Files
+    larger than FOOD_DB_MEMORY_LIMIT_MB are served in readonly mode instead.
+    '''
+    global _memory_anchor
+
+    size = DATABASE_URL.stat().st_size
+    if size > FOOD_DB_MEMORY_LIMIT_MB * 1024 * 1024:
+        logger.warning(f"Food database is {size / 2**20:.0f}MB, over the "
+                       f"{FOOD_DB_MEMORY_LIMIT_MB}MB limit of memory mode, "
+                       "serving it in readonly mode")
+        return _readonly_engine()
+
+    uri = f"file:{DATABASE_URL.stem}?mode=memory&cache=shared"
+    start = time.perf_counter()
+    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    source = sqlite3.connect(f"file:{DATABASE_URL}?mode=ro", uri=True)
+    try:
+        source.backup(anchor)
+    finally:
+        source.close()
+    if _memory_anchor is not None:
+        _memory_anchor.close()
+    _memory_anchor = anchor
+    load_seconds = time.perf_counter() - start
+
+    metrics.set_gauge("food_db.memory_load_seconds", load_seconds)
+    metrics.set_gauge("food_db.memory_bytes", size)
+    logger.info(f"Loaded the food database into memory ({size / 2**20:.0f}MB)"
+                f" in {load_seconds:.2f}s")
+
+    # The default pool for in-memory databases keeps a connection per thread
+    # and closes the oldest past five threads
+    engine = create_engine(
+        f"sqlite:///{uri}&uri=true",
+        connect_args={
+            "check_same_thread": False  # Needed for SQLite
+        },
+        poolclass=QueuePool,
+    )
+
+    @event.listens_for(engine, "connect")
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.close()
+
+    return engine
+
+
+ENGINES = {
+    "default": _default_engine,
+    "readonly": _readonly_engine,
+    "memory": _memory_engine,
+}
+
+if FOOD_DB_MODE not in ENGINES:
+    raise ValueError(f"Unknown FOOD_DB_MODE {FOOD_DB_MODE!r}, "
+                     f"expected one of {', '.join(ENGINES)}")
+
+engine = ENGINES[FOOD_DB_MODE]()
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
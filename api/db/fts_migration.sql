@@ -0,0 +1,87 @@
+/* ------------------- External-content FTS5 tables keyed on the food id ------------------- */
+
+-- Run after migration.sql:
+--     sqlite3 db/CompFood.sqlite < db/fts_migration.sql
+--
+-- The base tables get `id` as INTEGER PRIMARY KEY, i.e. the rowid, and the fts5 tables index
+-- them as external content with rowid = id. Descriptions are stored once, and each match is
+-- joined to its food with a primary key lookup instead of comparing an `id` text column.
+-- The fts5 tables are not kept in sync by triggers, the database is read-only at runtime.
+-- After changing a base table, rerun its 'rebuild' statement.
+
+BEGIN;
+
+-- Step 1: Rebuild the base tables with id as the primary key, keeping the first row of an id
+CREATE TABLE restaurant_menu_foods_new (
+    id INTEGER PRIMARY KEY,
+    restaurant TEXT,
+    food_category TEXT,
+    description TEXT,
+    energy_amount REAL,
+    fat_amount REAL,
+    carb_amount REAL,
+    protein_amount REAL,
+    serving_size REAL,
+    serving_unit TEXT
+);
+
+INSERT OR IGNORE INTO restaurant_menu_foods_new (id, restaurant, food_category, description, energy_amount, fat_amount, carb_amount, protein_amount, serving_size, serving_unit)
+SELECT id, restaurant, food_category, description, energy_amount, fat_amount, carb_amount, protein_amount, serving_size, serving_unit
+FROM restaurant_menu_foods
+WHERE id IS NOT NULL
+ORDER BY rowid;
+
+DROP TABLE restaurant_menu_foods;
+ALTER TABLE restaurant_menu_foods_new RENAME TO restaurant_menu_foods;
+
+CREATE TABLE non_branded_foods_new (id INTEGER PRIMARY KEY, description TEXT, energy_amount REAL, fat_amount REAL, carb_amount REAL, protein_amount REAL, serving_size REAL);
+
+INSERT OR IGNORE INTO non_branded_foods_new (id, description, energy_amount, fat_amount, carb_amount, protein_amount, serving_size)
+SELECT id, description, energy_amount, fat_amount, carb_amount, protein_amount, serving_size
+FROM non_branded_foods
+WHERE id IS NOT NULL
+ORDER BY rowid;
+
+DROP TABLE non_branded_foods;
+ALTER TABLE non_branded_foods_new RENAME TO non_branded_foods;
+
+CREATE TABLE branded_foods_new (id INTEGER PRIMARY KEY, description TEXT, brand_name TEXT, food_category TEXT, energy_amount REAL, fat_amount REAL, carb_amount REAL, protein_amount REAL, serving_size REAL, serving_unit TEXT);
+
+INSERT OR IGNORE INTO branded_foods_new (id, description, brand_name, food_category, energy_amount, fat_amount, carb_amount, protein_amount, serving_size, serving_unit)
+SELECT id, description, brand_name, food_category, energy_amount, fat_amount, carb_amount, protein_amount, serving_size, serving_unit
+FROM branded_foods
+WHERE id IS NOT NULL
+ORDER BY rowid;
+
+DROP TABLE branded_foods;
+ALTER TABLE branded_foods_new RENAME TO branded_foods;
+
+-- Step 2: Replace the fts5 tables with external-content tables
+--    - Search fields: description (and restaurant or brand_name, used to filter)
+--    - prefix: indexes of 2 and 3 character prefixes, so short prefix queries do not scan the term list
+DROP TABLE restaurant_menu_foods_fts;
+DROP TABLE non_branded_foods_fts;
+DROP TABLE branded_foods_fts;
+
+CREATE VIRTUAL TABLE restaurant_menu_foods_fts USING fts5(description, restaurant, content='restaurant_menu_foods', content_rowid='id', prefix='2 3');
+CREATE VIRTUAL TABLE non_branded_foods_fts USING fts5(description, content='non_branded_foods', content_rowid='id', prefix='2 3');
+CREATE VIRTUAL TABLE branded_foods_fts USING fts5(description, brand_name, content='branded_foods', content_rowid='id', prefix='2 3');
+
+INSERT INTO restaurant_menu_foods_fts (restaurant_menu_foods_fts) VALUES ('rebuild');
+INSERT INTO non_branded_foods_fts (non_branded_foods_fts) VALUES ('rebuild');
+INSERT INTO branded_foods_fts (branded_foods_fts) VALUES ('rebuild');
+
+-- Step 3: Rank by bm25 with description terms weighted over the restaurant or brand name
+INSERT INTO restaurant_menu_foods_fts (restaurant_menu_foods_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+INSERT INTO branded_foods_fts (branded_foods_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+-- Step 4: Merge each index into a single b-tree
+INSERT INTO restaurant_menu_foods_fts (restaurant_menu_foods_fts) VALUES ('optimize');
+INSERT INTO non_branded_foods_fts (non_branded_foods_fts) VALUES ('optimize');
+INSERT INTO branded_foods_fts (branded_foods_fts) VALUES ('optimize');
+
+COMMIT;
+
+-- Reclaim the space of the dropped copies of the descriptions
+VACUUM;
+ANALYZE;
@@ -5,6 +5,10 @@ class SearchRequest(BaseModel):
     text: str
 
 
+class BatchSearchRequest(BaseModel):
+    texts: list[str]
+
+
 class AttestRequest(BaseModel):
     attestation: str
     keyId: str
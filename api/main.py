@@ -1,9 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 import os
 from dotenv import load_dotenv
 from api.v1.endpoints import router as api_router
+from cache.store import init_redis_pools, close_redis_pools
+from rags.protein_amount.chain import load_indexes
 
-app = FastAPI(title="Protein Habit API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_redis_pools()
+    await run_in_threadpool(load_indexes)
+    yield
+    await close_redis_pools()
+
+
+app = FastAPI(title="Protein Habit API", lifespan=lifespan)
 
 # Load environment variables
 environment = os.getenv('ENVIRONMENT')
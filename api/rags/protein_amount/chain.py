@@ -1,22 +1,53 @@
+import asyncio
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import redis.asyncio
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from dotenv import load_dotenv
 from langchain_community.utilities import SQLDatabase
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnableLambda, RunnableParallel
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.messages import AIMessage
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 from db.comp_food_database import engine
 
 from db.comp_food_database import get_db
 from rags.protein_amount.retrieval import (
     get_restaurant_or_brand_prompt,
     food_items_prompt,
-    get_query
+    get_query,
+    fallback_queries,
+    merge_table_rows,
+    reciprocal_rank_fusion,
+    rows_statement,
+    VectorSearch,
+    FILTER_COLUMNS,
+    RETRIEVAL_MODE,
+    VECTOR_MODE,
+    HYBRID_MODE
+)
+from rags.protein_amount.embeddings import (
+    ItemEmbedder,
+    load_index,
+    openai_embed
 )
 from rags.protein_amount.generation import generation_prompt
+from rags.protein_amount.extraction import (
+    FoodItemExtractor,
+    ExtractedItem,
+    find_quantity
+)
+from rags.protein_amount.spelling import SpellingCorrector, fts_tokens
+from rags.protein_amount.computation import compute_protein
+from rags.protein_amount.compaction import compact_context, load_encoding
+from cache.memo import TieredMemo
+from cache.response_cache import normalize_text
 from utils.get_secret import get_secret
+from utils import metrics
 
 OPENAI_API_KEY = get_secret("OPENAI_API_KEY")
 
@@ -40,25 +71,360 @@ db = SQLDatabase(
         'non_branded_foods_fts'
     ])
 
+# Searches misspelled food items as the closest known words. Loaded by
+# `load_indexes` when the app starts, until then words are searched as typed.
+spelling_corrector: Optional[SpellingCorrector] = None
+
+# Embedding index and query embedder of the "vector" and "hybrid" retrieval
+# modes. Without an index they search with FTS only.
+food_embedding_index = load_index() \
+    if RETRIEVAL_MODE in (VECTOR_MODE, HYBRID_MODE) else None
+item_embedder = ItemEmbedder(openai_embed(
+    food_embedding_index.meta['model'],
+    food_embedding_index.meta['dimensions'])) \
+    if food_embedding_index is not None else None
+# Rows of other restaurants or brands are dropped after the vector search
+VECTOR_FILTER_OVERSAMPLING = 4
+
+# The chains are stateless, so they are built once and shared by every request
+restaurant_or_brand_chain = get_restaurant_or_brand_prompt | llm4omini1
+food_items_chain = food_items_prompt | llm4omini2
+
+retrieval_chain = RunnableParallel(
+    restaurant_or_brand=restaurant_or_brand_chain,
+    food_items=food_items_chain
+) | RunnableLambda(lambda text: get_query(text, corrector=spelling_corrector))
+
+generation_chain = generation_prompt | llm4omini2 | JsonOutputParser()
+
+# Both retrieval stages run at temperature 0, so their answers are memoized
+STAGE_MEMO_TTL_SECONDS = int(
+    os.getenv("STAGE_MEMO_TTL_SECONDS", 30 * 24 * 60 * 60))
+restaurant_or_brand_memo = TieredMemo(
+    "restaurant_or_brand",
+    maxsize=int(os.getenv("RESTAURANT_OR_BRAND_MEMO_SIZE", 10_000)),
+    ttl=STAGE_MEMO_TTL_SECONDS
+)
+food_items_memo = TieredMemo(
+    "food_items",
+    maxsize=int(os.getenv("FOOD_ITEMS_MEMO_SIZE", 10_000)),
+    ttl=STAGE_MEMO_TTL_SECONDS
+)
+
+# Splits most meals into food items without the food_items LLM stage.
+# Loaded by `load_indexes` when the app starts, until then every meal goes
+# through the LLM stage.
+food_item_extractor: Optional[FoodItemExtractor] = None
+
+
+def load_indexes():
+    '''
+    Load the local indexes built from the food database, building and saving
+    them if missing, and the token encoding of the generation context.
+    Called once per worker in the app's lifespan, so that importing the
+    chain does not scan the database and requests never wait on them.
+    '''
+    global food_item_extractor, spelling_corrector
+    food_item_extractor = FoodItemExtractor.load(engine)
+    spelling_corrector = SpellingCorrector.load(engine)
+    load_encoding()
+
+# Words that do not change the answer of either retrieval stage
+FILLER_WORDS = {
+    'i', 'had', 'have', 'ate', 'eaten', 'just', 'some', 'my', 'for', 'with',
+    'today', 'tonight', 'breakfast', 'lunch', 'dinner', 'snack',
+}
+
+
+# Searches the tables of "all_tables" retrieval, each on its own connection
+RETRIEVAL_TABLE_THREADS = int(os.getenv("RETRIEVAL_TABLE_THREADS", 12))
+table_search_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_TABLE_THREADS, thread_name_prefix="table-search")
+
+
+def _execute(conn, queries: list[tuple]):
+    columns, rows = None, []
+    for statement, params in queries:
+        result = conn.execute(statement, params)
+        columns = columns or tuple(result.keys())
+        rows.extend(result.fetchall())
+    return columns, rows
+
+
+def _search_table(bind, queries: list[tuple]):
+    with bind.connect() as conn:
+        return _execute(conn, queries)
+
+
+def _fetch_all_tables(conn, searches: dict) -> list[tuple]:
+    '''
+    Search every table at once, the first one on `conn` and the others on
+    separate pooled connections, so the latency is the one of the slowest
+    table. SQLite releases the GIL while it runs a query.
+    '''
+    bind = conn.get_bind() if isinstance(conn, Session) else conn.engine
+    tables = [table for table, search in searches.items() if search.queries]
+    futures = {
+        table: table_search_executor.submit(
+            _search_table, bind, searches[table].queries)
+        for table in tables[1:]
+    }
+    results = {table: _execute(conn, searches[table].queries)
+               for table in tables[:1]}
+    results.update(
+        (table, future.result()) for table, future in futures.items())
+    return merge_table_rows(
+        {table: result for table, result in results.items()
+         if result[0] is not None},
+        searches)
+
+
+def _vector_rows(conn, search: VectorSearch):
+    '''
+    The rows of the table closest to each food item in the embedding index,
+    shaped like the FTS rows with the negative cosine similarity as rank
+    '''
+    vectors = item_embedder.embed(search.items)
+    k = search.limit * (VECTOR_FILTER_OVERSAMPLING if search.name else 1)
+    hits = food_embedding_index.search(vectors, search.table, k)
+    ids = sorted({food_id for item_hits in hits for food_id, _ in item_hits})
+    result = conn.execute(rows_statement(search.table),
+                          {'ids': json.dumps(ids)})
+    columns = ('food_item', *tuple(result.keys())[1:], 'rank')
+    fields = {row[0]: tuple(row[1:]) for row in result}
+
+    name_index = columns.index(FILTER_COLUMNS[search.table]) - 1 \
+        if search.name else None
+    name_tokens = set(fts_tokens(search.name or ''))
+    rows = []
+    for item, item_hits in zip(search.items, hits):
+        kept = 0
+        for food_id, similarity in item_hits:
+            row = fields.get(food_id)
+            if row is None or kept == search.limit:
+                continue
+            if name_index is not None and not name_tokens <= set(
+                    fts_tokens(row[name_index] or '')):
+                continue
+            rows.append((item, *row, -similarity))
+            kept += 1
+    return columns, rows
+
+
+def _fetch_vector(conn, search: VectorSearch) -> list[tuple]:
+    if food_embedding_index is None:
+        return fetch_data(conn, search.queries)
+
+    columns, rows = _vector_rows(conn, search)
+    if search.mode == HYBRID_MODE:
+        fts_rows = fetch_data(conn, search.queries)[1:]
+        rows = reciprocal_rank_fusion([fts_rows, rows], search.limit)
+    if not rows:
+        return []
+    return [columns, *sorted(rows, key=lambda row: row[-1])]
+
+
+def fetch_data(conn: Session, queries) -> list[tuple]:
+    '''
+    Run the FTS queries of `get_query` and return their rows, best ranked
+    first, with the column names first. Items without rows are searched
+    again with their `fallback_queries`.
+    '''
+    if isinstance(queries, dict):
+        return _fetch_all_tables(conn, queries)
+    if isinstance(queries, VectorSearch):
+        return _fetch_vector(conn, queries)
+
+    columns, rows = _execute(conn, queries)
+    if columns is None:
+        return []
+
+    # Misspelled items without rows are searched with a looser correction
+    found = {row[0] for row in rows}
+    retries = fallback_queries(queries, found)
+    if retries:
+        metrics.incr("spelling.fallback_queries", len(retries))
+        _, retry_rows = _execute(conn, retries)
+        rows.extend(row for row in retry_rows if row[0] not in found)
+
+    rank_index = columns.index('rank')
+    rows.sort(key=lambda row: row[rank_index])
+    return [columns, *rows]
+
 
 def run(input: str, conn: Session = Depends(get_db)):
     # Step 1: Retrieve necessary data from the database
+    queries, retrieval_text, _ = retrieval_chain.invoke({'text': input})
+    data = fetch_data(conn, queries)
+
+    # Step 2: Generate the response with augmented data
+    response = generation_chain.invoke({
+        'data': compact_context(data),
+        'text': retrieval_text,
+        'original_input': input
+    })
+
+    return response
 
-    retrieval_chain = RunnableParallel(
-        restaurant_or_brand=get_restaurant_or_brand_prompt | llm4omini1,
-        food_items=food_items_prompt | llm4omini2
-    ) | RunnableLambda(get_query)
 
-    query, retrieval_text = retrieval_chain.invoke({'text': input})
-    result = conn.execute(text(query))
-    data = [
-        tuple(result.keys()),
-        *result.fetchall()
+def stage_key(input: str) -> str:
+    """Memo key of the retrieval stages: the normalized text minus filler"""
+    return ' '.join(word for word in normalize_text(input).split()
+                    if word not in FILLER_WORDS)
+
+
+async def _memoized_stage(
+    memo: TieredMemo,
+    stage_chain,
+    input: str,
+    redis_client: Optional[redis.asyncio.Redis]
+) -> AIMessage:
+    key = stage_key(input)
+    content = await memo.get(key, redis_client)
+    if content is None:
+        content = (await stage_chain.ainvoke({'text': input})).content
+        await memo.set(key, content, redis_client)
+    return AIMessage(content=content)
+
+
+async def aretrieve(
+    input: str,
+    redis_client: Optional[redis.asyncio.Redis] = None
+):
+    '''
+    Run both retrieval stages concurrently and build the FTS queries.
+    The food_items LLM stage is skipped when the local extractor is confident.
+    Returns the queries, the retrieval text and the food items with their
+    quantities.
+    '''
+    restaurant_or_brand_stage = _memoized_stage(
+        restaurant_or_brand_memo, restaurant_or_brand_chain, input,
+        redis_client)
+
+    extracted_items = food_item_extractor.extract(input) \
+        if food_item_extractor is not None else None
+    if extracted_items is not None:
+        restaurant_or_brand = await restaurant_or_brand_stage
+        food_items = AIMessage(content=json.dumps(
+            [item.name for item in extracted_items]))
+    else:
+        restaurant_or_brand, food_items = await asyncio.gather(
+            restaurant_or_brand_stage,
+            _memoized_stage(food_items_memo, food_items_chain,
+                            input, redis_client)
+        )
+    queries, retrieval_text, labels = get_query({
+        'restaurant_or_brand': restaurant_or_brand,
+        'food_items': food_items
+    }, corrector=spelling_corrector)
+
+    # Rows are labeled with the item names used in the query
+    extracted = {item.name: item for item in extracted_items or []}
+    items = [
+        extracted.get(label) or ExtractedItem(label, *find_quantity(label, input))
+        for label in labels
     ]
+    return queries, retrieval_text, items
 
-    # Step 2: Generate the response with augmented data
-    generation_chain = generation_prompt | llm4omini2 | JsonOutputParser()
-    response = generation_chain.invoke(
-        {'data': data, 'text': retrieval_text, 'original_input': input})
 
-    return response
+async def _aprepare(
+    input: str,
+    conn: Session,
+    redis_client: Optional[redis.asyncio.Redis]
+):
+    '''
+    Retrieve the nutrition data and compute every item with a confident
+    match. Returns the computed results and the generation chain input for
+    the remaining items, or None when nothing is left for the LLM.
+    '''
+
+    # Step 1: Retrieve necessary data from the database
+    queries, retrieval_text, items = await aretrieve(input, redis_client)
+    if not items:
+        return [], None
+    data = await run_in_threadpool(fetch_data, conn, queries)
+
+    # Step 2: Compute the protein of every item with a confident match
+    computed, unmatched = compute_protein(items, data)
+    metrics.incr("protein_computation.computed_items", len(computed))
+    metrics.incr("protein_computation.llm_items", len(unmatched))
+    if not unmatched:
+        return computed, None
+
+    unmatched_names = {item.name for item in unmatched}
+    columns, *rows = data
+    food_item_index = columns.index('food_item')
+    data = [columns, *(row for row in rows
+                       if row[food_item_index] in unmatched_names)]
+    retrieval_text = {
+        **retrieval_text,
+        'food_items': json.dumps([item.name for item in unmatched])
+    }
+    # Tokenizing is CPU work, kept off the event loop like the query
+    context = await run_in_threadpool(compact_context, data)
+    return computed, {
+        'data': context,
+        'text': retrieval_text,
+        'original_input': input
+    }
+
+
+def _is_new(result, computed: list[dict]) -> bool:
+    # The LLM sees the whole meal, so it may repeat computed items
+    return isinstance(result, dict) and \
+        str(result.get('food_item', '')).lower() not in \
+        {item['food_item'].lower() for item in computed}
+
+
+async def arun(
+    input: str,
+    conn: Session,
+    redis_client: Optional[redis.asyncio.Redis] = None
+):
+    '''
+    Async version of `run`. Both LLM stages are awaited and the SQLite query
+    is offloaded to the threadpool, so a slow OpenAI round trip never blocks
+    the event loop for other requests. The retrieval stage outputs are
+    memoized, in Redis too when a client is given.
+    '''
+    response, generation_input = await _aprepare(input, conn, redis_client)
+    if generation_input is None:
+        return response
+
+    # Step 3: Generate the response for the rest with augmented data
+    generated = await generation_chain.ainvoke(generation_input)
+    return response + [result for result in generated
+                       if _is_new(result, response)]
+
+
+async def astream(
+    input: str,
+    conn: Session,
+    redis_client: Optional[redis.asyncio.Redis] = None
+):
+    '''
+    Streaming version of `arun` that yields each food item as soon as it is
+    complete. Computed items come first, then the generation LLM's items
+    as its JSON array is parsed incrementally.
+    '''
+    computed, generation_input = await _aprepare(input, conn, redis_client)
+    for result in computed:
+        yield result
+    if generation_input is None:
+        return
+
+    # The parser yields the whole array parsed so far. An element is only
+    # complete once the next one has started, or the stream has ended.
+    emitted = 0
+    partial = []
+    async for partial in generation_chain.astream(generation_input):
+        if not isinstance(partial, list):
+            continue
+        while emitted < len(partial) - 1:
+            if _is_new(partial[emitted], computed):
+                yield partial[emitted]
+            emitted += 1
+
+    if isinstance(partial, list) and emitted < len(partial) \
+            and _is_new(partial[emitted], computed):
+        yield partial[emitted]
@@ -0,0 +1,148 @@
+'''
+Compact nutrition data for the generation LLM.
+
+The retrieved rows are sent to the generation prompt, whose latency and
+cost grow with its tokens. Instead of the repr of every row, each food item
+gets its best ranked rows with near-identical descriptions dropped, in a
+dense table that fits a token budget:
+
+    food item: description | serving | protein
+    # Chicken Breast
+    Chicken, broilers or fryers, breast, meat only, cooked, roasted | 100 | 31
+'''
+import logging
+import math
+import os
+from functools import lru_cache
+from typing import Optional
+
+import tiktoken
+
+from rags.protein_amount.extraction import tokenize, singular
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+GENERATION_MODEL = "gpt-4o-mini"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1000))
+CONTEXT_ROWS_PER_ITEM = int(os.getenv("CONTEXT_ROWS_PER_ITEM", 4))
+# Rows of an item whose description words overlap this much with a better
+# ranked row add nothing for the LLM
+DUPLICATE_SIMILARITY = 0.8
+
+# Average characters per token of English text, to estimate without encoding
+CHARS_PER_TOKEN = 4
+
+HEADER = "food item: description | serving | protein"
+# Columns naming the restaurant or brand of a row
+NAME_COLUMNS = ('restaurant', 'brand_name', 'restaurant_or_brand')
+
+
+@lru_cache(maxsize=None)
+def load_encoding() -> Optional[tiktoken.Encoding]:
+    """The generation model's encoding, loaded once per process"""
+    try:
+        return tiktoken.encoding_for_model(GENERATION_MODEL)
+    except Exception as e:
+        # The encoding is downloaded on first use
+        logger.warning(f"Counting tokens as characters / 4, "
+                       f"could not load the {GENERATION_MODEL} encoding: {e}")
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    encoding = load_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def _number(value) -> str:
+    if value is None:
+        return '?'
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _line(row: dict) -> str:
+    description = row.get('description') or ''
+    name = next((row[column] for column in NAME_COLUMNS if row.get(column)),
+                None)
+    if name:
+        description = f"{description} ({name})"
+    serving = _number(row.get('serving_size'))
+    if row.get('serving_unit'):
+        serving = f"{serving} {row['serving_unit']}"
+    return f"{description} | {serving} | {_number(row.get('protein_amount'))}"
+
+
+def _words(row: dict) -> set[str]:
+    return {singular(token) for token in tokenize(row.get('description') or '')}
+
+
+def _is_duplicate(words: set[str], kept: list[set[str]]) -> bool:
+    return any(len(words & other) / len(words | other) >= DUPLICATE_SIMILARITY
+               for other in kept if words | other)
+
+
+def compact_rows(data: list[tuple],
+                 rows_per_item: int = CONTEXT_ROWS_PER_ITEM,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    '''
+    Encode data shaped like the output of `chain.fetch_data` (column names
+    first, best ranked rows first). Every item gets its best row before any
+    item gets a second one, until the budget is spent.
+    '''
+    if not data:
+        return ''
+    columns, *rows = data
+
+    candidates = {}
+    for row in rows:
+        row = dict(zip(columns, row))
+        item = candidates.setdefault(row['food_item'], ([], []))
+        lines, kept_words = item
+        words = _words(row)
+        if len(lines) >= rows_per_item or _is_duplicate(words, kept_words):
+            continue
+        lines.append(_line(row))
+        kept_words.append(words)
+
+    remaining = token_budget - count_tokens(HEADER)
+    selected = {food_item: [] for food_item in candidates}
+    for depth in range(rows_per_item):
+        for food_item, (lines, _) in candidates.items():
+            if depth >= len(lines):
+                continue
+            # The item's heading is paid for with its first row
+            cost = count_tokens(lines[depth]) + 1
+            if depth == 0:
+                cost += count_tokens(f"# {food_item}") + 1
+            if cost <= remaining:
+                selected[food_item].append(lines[depth])
+                remaining -= cost
+
+    sections = [HEADER]
+    for food_item, lines in selected.items():
+        if lines:
+            sections.append(f"# {food_item}")
+            sections.extend(lines)
+    return '\n'.join(sections)
+
+
+def compact_context(data: list[tuple]) -> str:
+    '''
+    compact_rows, recording the input tokens saved over the rows' repr. The
+    repr is only estimated from its length, encoding it would cost more than
+    the compaction.
+    '''
+    compacted = compact_rows(data)
+    tokens = count_tokens(compacted)
+    saved = max(estimate_tokens(str(data)) - tokens, 0)
+    metrics.incr("generation_context.tokens", tokens)
+    metrics.incr("generation_context.tokens_saved", saved)
+    metrics.set_gauge("generation_context.last_tokens_saved", saved)
+    return compacted
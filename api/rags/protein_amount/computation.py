@@ -0,0 +1,124 @@
+'''
+Deterministic protein computation.
+
+Scales the `protein_amount` of the best ranked row of each food item by the
+amount the user ate, producing the same shape as the generation LLM:
+[{"food_item", "protein_amount", "protein_unit"}]. Items without a
+confident match are left for the generation LLM.
+'''
+from typing import Optional
+
+from rags.protein_amount.extraction import ExtractedItem, tokenize, singular
+
+GRAMS_PER_UNIT = {
+    'g': 1.0,
+    'kg': 1000.0,
+    'oz': 28.35,
+    'lb': 453.59,
+}
+# Volumes are only converted to servings measured in volume, the density of
+# the food is unknown
+ML_PER_UNIT = {
+    'ml': 1.0,
+    'cup': 240.0,
+    'tbsp': 15.0,
+    'tsp': 5.0,
+}
+
+# Units that count servings rather than measure an amount. They are only
+# computed against rows whose serving is a portion, rows without a serving
+# unit (non_branded_foods) are per 100 g.
+SERVING_UNITS = {None, 'slice', 'piece', 'serving', 'scoop'}
+
+SERVING_UNIT_ALIASES = {
+    'gram': 'g', 'grams': 'g', 'gr': 'g',
+    'ounce': 'oz', 'ounces': 'oz',
+    'milliliter': 'ml', 'milliliters': 'ml', 'mls': 'ml',
+}
+
+
+def _serving_amount(row: dict, units: dict[str, float]) -> Optional[float]:
+    '''
+    Size of the row's serving in the base unit of `units`, or None when it
+    is measured otherwise. The nutrition data is in grams unless the row
+    says otherwise.
+    '''
+    serving_size = row.get('serving_size')
+    if not serving_size or serving_size <= 0:
+        return None
+    unit = (row.get('serving_unit') or 'g').strip().lower()
+    unit = SERVING_UNIT_ALIASES.get(unit, unit)
+    if unit not in units:
+        return None
+    return serving_size * units[unit]
+
+
+def best_rows(data: list[tuple]) -> dict[str, dict]:
+    '''
+    Best ranked row of each food item, from data shaped like the output of
+    `chain.fetch_data` (column names first).
+    '''
+    if not data:
+        return {}
+    columns, *rows = data
+    best = {}
+    for row in rows:
+        row = dict(zip(columns, row))
+        current = best.get(row['food_item'])
+        if current is None or row['rank'] < current['rank']:
+            best[row['food_item']] = row
+    return best
+
+
+def is_confident_match(item: ExtractedItem, row: Optional[dict]) -> bool:
+    """The row describes every word of the item and has usable amounts"""
+    if row is None or row.get('protein_amount') is None:
+        return False
+    description = {singular(token)
+                   for token in tokenize(row.get('description') or '')}
+    return all(singular(token) in description
+               for token in tokenize(item.name))
+
+
+def compute_item(item: ExtractedItem, row: dict) -> Optional[dict]:
+    '''
+    Protein of a food item, or None when its amount cannot be converted to
+    the row's serving.
+    '''
+    protein = row['protein_amount']
+    quantity = item.quantity if item.quantity is not None else 1.0
+
+    if item.unit in SERVING_UNITS:
+        if not row.get('serving_unit'):
+            return None
+        protein *= quantity
+    else:
+        units = GRAMS_PER_UNIT if item.unit in GRAMS_PER_UNIT else ML_PER_UNIT
+        serving = _serving_amount(row, units)
+        if item.unit not in units or serving is None:
+            return None
+        protein *= quantity * units[item.unit] / serving
+
+    return {
+        "food_item": item.name,
+        "protein_amount": round(protein),
+        "protein_unit": "grams"
+    }
+
+
+def compute_protein(items: list[ExtractedItem], data: list[tuple]):
+    '''
+    Compute the protein of every item with a confident match.
+    Returns the computed results and the items left for the generation LLM.
+    '''
+    rows = best_rows(data)
+    results, unmatched = [], []
+    for item in items:
+        row = rows.get(item.name)
+        result = compute_item(item, row) \
+            if is_confident_match(item, row) else None
+        if result is None:
+            unmatched.append(item)
+        else:
+            results.append(result)
+    return results, unmatched
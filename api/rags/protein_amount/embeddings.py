@@ -0,0 +1,238 @@
+'''
+Vector retrieval over the food descriptions.
+
+FTS5 only finds descriptions sharing the item's words, so "soda" never
+finds "Beverages, carbonated, cola". The embedding index holds a vector of
+every description, L2-normalized and quantized to int8 with one scale per
+row, and is memory-mapped from disk, so workers share its pages. A request
+embeds its food items in one call and scores all of them against the
+table's rows in one pass over the matrix.
+
+Build the index ahead of time, one embedding call per
+EMBEDDING_BATCH_SIZE descriptions:
+
+    python -m rags.protein_amount.embeddings
+'''
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from rags.protein_amount.retrieval import TABLES
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+FOOD_EMBEDDINGS_PATH = Path(os.getenv(
+    "FOOD_EMBEDDINGS_PATH",
+    Path(__file__).parents[2] / 'db' / 'food_embeddings'))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 256))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10_000))
+EMBEDDING_BATCH_SIZE = 512
+# Rows scored at once. Their float32 copy (4 MB at 256 dimensions) stays in
+# the CPU cache, larger blocks were slower.
+SEARCH_BLOCK_ROWS = 4096
+# Column the index is keyed by, recorded in meta.json
+INDEX_KEY = 'id'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Symmetric int8 quantization of normalized vectors, one scale per row,
+    so that vectors ~= quantized * scales[:, None]
+    '''
+    vectors = normalize(vectors)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class EmbeddingIndex:
+    '''
+    int8 vectors, their scales and food ids, memory-mapped from `path`.
+    meta.json records the model and each table's row range. Rows are keyed
+    by the `id` column, which survives db/fts_migration.sql, not by rowid.
+    '''
+
+    def __init__(self, path: Path = FOOD_EMBEDDINGS_PATH):
+        with open(path / 'meta.json') as f:
+            self.meta = json.load(f)
+        if self.meta.get('key') != INDEX_KEY:
+            raise ValueError(f"The embedding index at {path} is not keyed by "
+                             f"{INDEX_KEY}, rebuild it")
+        self.vectors = np.load(path / 'vectors.npy', mmap_mode='r')
+        self.scales = np.load(path / 'scales.npy', mmap_mode='r')
+        self.ids = np.load(path / 'ids.npy', mmap_mode='r')
+
+    @staticmethod
+    def write(path: Path, tables: dict[str, tuple[np.ndarray, np.ndarray]],
+              model: str = EMBEDDING_MODEL):
+        """Write the (ids, vectors) of each table as an index"""
+        path.mkdir(parents=True, exist_ok=True)
+        ranges, start = {}, 0
+        for table, (ids, _) in tables.items():
+            ranges[table] = [start, start + len(ids)]
+            start += len(ids)
+        dimensions = max(
+            (vectors.shape[1] for _, vectors in tables.values()), default=0)
+
+        vectors = np.lib.format.open_memmap(
+            path / 'vectors.npy', mode='w+', dtype=np.int8,
+            shape=(start, dimensions))
+        scales = np.empty(start, dtype=np.float32)
+        ids = np.empty(start, dtype=np.int64)
+        # Tables are stored one after the other
+        for table, (table_ids, table_vectors) in tables.items():
+            begin, end = ranges[table]
+            if begin == end:
+                continue
+            vectors[begin:end], scales[begin:end] = quantize(table_vectors)
+            ids[begin:end] = table_ids
+        vectors.flush()
+        np.save(path / 'scales.npy', scales)
+        np.save(path / 'ids.npy', ids)
+        with open(path / 'meta.json', 'w') as f:
+            json.dump({'model': model, 'dimensions': dimensions,
+                       'key': INDEX_KEY, 'tables': ranges}, f)
+
+    @classmethod
+    def build(cls, engine: Engine, embed: Callable[[list[str]], list],
+              path: Path = FOOD_EMBEDDINGS_PATH,
+              model: str = EMBEDDING_MODEL) -> 'EmbeddingIndex':
+        """Embed every description of the food tables and write the index"""
+        tables = {}
+        with engine.connect() as conn:
+            for table in TABLES:
+                rows = conn.execute(text(
+                    f"SELECT id, description FROM {table} "
+                    "WHERE id IS NOT NULL ORDER BY id"
+                )).fetchall()
+                vectors = []
+                for start in range(0, len(rows), EMBEDDING_BATCH_SIZE):
+                    batch = rows[start:start + EMBEDDING_BATCH_SIZE]
+                    vectors.append(np.asarray(embed(
+                        [description or '' for _, description in batch]),
+                        dtype=np.float32))
+                    logger.info(f"Embedded {start + len(batch)} of "
+                                f"{len(rows)} {table} descriptions")
+                tables[table] = (
+                    np.array([food_id for food_id, _ in rows], dtype=np.int64),
+                    np.concatenate(vectors) if vectors
+                    else np.empty((0, 0), dtype=np.float32))
+        cls.write(path, tables, model)
+        return cls(path)
+
+    def search(self, queries: np.ndarray, table: str,
+               k: int) -> list[list[tuple[int, float]]]:
+        '''
+        The k (food id, cosine similarity) of `table` closest to each query
+        vector, best first. The table's rows are read once for all queries.
+        '''
+        queries = normalize(queries)
+        start, end = self.meta['tables'].get(table, (0, 0))
+        k = min(k, end - start)
+        if k <= 0 or not len(queries):
+            return [[] for _ in queries]
+
+        candidates, scores = [], []
+        for begin in range(start, end, SEARCH_BLOCK_ROWS):
+            stop = min(begin + SEARCH_BLOCK_ROWS, end)
+            block = self.vectors[begin:stop].astype(np.float32) @ queries.T
+            block *= self.scales[begin:stop, None]
+            top = min(k, stop - begin)
+            best = np.argpartition(-block, top - 1, axis=0)[:top]
+            candidates.append(best + begin)
+            scores.append(np.take_along_axis(block, best, axis=0))
+        candidates = np.concatenate(candidates)
+        scores = np.concatenate(scores)
+
+        results = []
+        for column in range(len(queries)):
+            order = np.argsort(-scores[:, column])[:k]
+            results.append([
+                (int(self.ids[candidates[i, column]]),
+                 float(scores[i, column]))
+                for i in order
+            ])
+        return results
+
+
+class ItemEmbedder:
+    '''
+    Embeds food items with the index's model, one call for all the items of
+    a request that are not in the in-process LRU cache
+    '''
+
+    def __init__(self, embed: Callable[[list[str]], list],
+                 maxsize: int = EMBEDDING_CACHE_SIZE):
+        self.embed_texts = embed
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, items: list[str]) -> np.ndarray:
+        keys = [item.strip().lower() for item in items]
+        with self._lock:
+            vectors = {key: self._cache[key] for key in keys
+                       if key in self._cache}
+            for key in vectors:
+                self._cache.move_to_end(key)
+        missing = list(dict.fromkeys(
+            key for key in keys if key not in vectors))
+        metrics.incr("item_embeddings.hits", len(keys) - len(missing))
+        if missing:
+            metrics.incr("item_embeddings.misses", len(missing))
+            embedded = normalize(self.embed_texts(missing))
+            vectors.update(zip(missing, embedded))
+            with self._lock:
+                for key, vector in zip(missing, embedded):
+                    self._cache[key] = vector
+                    if len(self._cache) > self.maxsize:
+                        self._cache.popitem(last=False)
+        return np.array([vectors[key] for key in keys], dtype=np.float32)
+
+
+def openai_embed(model: str = EMBEDDING_MODEL,
+                 dimensions: int = EMBEDDING_DIMENSIONS):
+    from langchain_openai import OpenAIEmbeddings
+    from utils.get_secret import get_secret
+
+    return OpenAIEmbeddings(
+        model=model, dimensions=dimensions,
+        openai_api_key=get_secret("OPENAI_API_KEY")
+    ).embed_documents
+
+
+def load_index(path: Path = FOOD_EMBEDDINGS_PATH):
+    """The embedding index, or None with a warning if it is missing or stale"""
+    if not (path / 'meta.json').exists():
+        logger.warning(f"No embedding index at {path}, build it with "
+                       "python -m rags.protein_amount.embeddings")
+        return None
+    try:
+        return EmbeddingIndex(path)
+    except ValueError as e:
+        logger.warning(e)
+        return None
+
+
+if __name__ == "__main__":
+    from db.comp_food_database import engine
+
+    index = EmbeddingIndex.build(engine, openai_embed())
+    print(f"Saved {len(index.ids)} embeddings to {FOOD_EMBEDDINGS_PATH}")
@@ -0,0 +1,324 @@
+'''
+LLM-free food item extraction.
+
+The meal text is segmented against a phrase index built from the
+descriptions in `non_branded_foods_fts` and `restaurant_menu_foods_fts`.
+When every word of the meal is explained by known phrases, quantities and
+units the extraction is confident and the `food_items` LLM stage is skipped.
+
+Build the phrase index ahead of time with:
+
+    python -m rags.protein_amount.extraction
+'''
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from cache.response_cache import normalize_text
+from utils import metrics
+from utils.files import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+FOOD_PHRASES_PATH = Path(os.getenv(
+    "FOOD_PHRASES_PATH",
+    Path(__file__).parents[2] / 'db' / 'food_phrases.json'))
+EXTRACTOR_MIN_PHRASE_FREQUENCY = int(
+    os.getenv("EXTRACTOR_MIN_PHRASE_FREQUENCY", 2))
+MAX_PHRASE_TOKENS = 4
+
+SEGMENT_SEPARATORS = re.compile(r'[,;+&\n]')
+CONNECTORS = {'and', 'with', 'plus'}
+CONNECTORS_PATTERN = re.compile(r'\b(?:and|with|plus)\b')
+DESCRIPTION_SEPARATORS = re.compile(r'[,()/]')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+QUANTITY_PATTERN = re.compile(r'^\d+(?:\.\d+)?$')
+
+UNITS = {
+    'g': 'g', 'gr': 'g', 'gram': 'g', 'grams': 'g',
+    'kg': 'kg', 'kilogram': 'kg', 'kilograms': 'kg',
+    'oz': 'oz', 'ounce': 'oz', 'ounces': 'oz',
+    'lb': 'lb', 'lbs': 'lb', 'pound': 'lb', 'pounds': 'lb',
+    'cup': 'cup', 'cups': 'cup',
+    'tbsp': 'tbsp', 'tablespoon': 'tbsp', 'tablespoons': 'tbsp',
+    'tsp': 'tsp', 'teaspoon': 'tsp', 'teaspoons': 'tsp',
+    'ml': 'ml', 'milliliter': 'ml', 'milliliters': 'ml',
+    'slice': 'slice', 'slices': 'slice',
+    'piece': 'piece', 'pieces': 'piece', 'pc': 'piece', 'pcs': 'piece',
+    'serving': 'serving', 'servings': 'serving',
+    'scoop': 'scoop', 'scoops': 'scoop',
+}
+
+# Words that never name a food item on their own
+IGNORED_WORDS = {
+    'a', 'an', 'the', 'of', 'some', 'i', 'had', 'have', 'ate', 'eaten',
+    'just', 'my', 'for', 'today', 'tonight', 'breakfast', 'lunch', 'dinner',
+    'snack', 'x', 'about', 'around',
+    'small', 'medium', 'large', 'big', 'regular',
+    'grilled', 'fried', 'baked', 'roasted', 'boiled', 'scrambled', 'steamed',
+    'cooked', 'raw', 'fresh', 'plain', 'homemade',
+}
+
+
+@dataclass
+class ExtractedItem:
+    name: str
+    quantity: Optional[float] = None
+    unit: Optional[str] = None
+
+
+def tokenize(value: str) -> list[str]:
+    value = unicodedata.normalize('NFKC', value).lower().replace("'", '')
+    return TOKEN_PATTERN.findall(value)
+
+
+def singular(token: str) -> str:
+    """Crude singular form, so that "eggs" matches "egg"."""
+    if len(token) < 4 or token.endswith(('ss', 'us', 'is')):
+        return token
+    if token.endswith('ies'):
+        return token[:-3] + 'y'
+    if token.endswith(('oes', 'ches', 'shes', 'xes')):
+        return token[:-2]
+    if token.endswith('s'):
+        return token[:-1]
+    return token
+
+
+def _title(tokens: list[str]) -> str:
+    return ' '.join(token.capitalize() for token in tokens)
+
+
+def parse_quantity(tokens: list[str]):
+    '''
+    Split a leading quantity and unit off a segment's tokens,
+    e.g. ["2", "cups", "rice"] -> (2.0, "cup", ["rice"])
+    '''
+    quantity, unit = None, None
+    if tokens and QUANTITY_PATTERN.match(tokens[0]):
+        quantity = float(tokens[0])
+        tokens = tokens[1:]
+    elif len(tokens) > 1 and tokens[0] in ('a', 'an') and tokens[1] in UNITS:
+        quantity = 1.0
+        tokens = tokens[1:]
+
+    if tokens and tokens[0] in UNITS:
+        unit = UNITS[tokens[0]]
+        tokens = tokens[1:]
+        if tokens and tokens[0] == 'of':
+            tokens = tokens[1:]
+
+    return quantity, unit, tokens
+
+
+def find_quantity(name: str, meal: str):
+    '''
+    Quantity and unit written in front of a food item in the meal text,
+    e.g. ("Chicken Breast", "I had 2 chicken breasts") -> (2.0, None)
+    '''
+    name_tokens = {singular(token) for token in tokenize(name)}
+    for segment in SEGMENT_SEPARATORS.split(meal):
+        for part in CONNECTORS_PATTERN.split(normalize_text(segment)):
+            tokens = tokenize(part)
+            while tokens and tokens[0] in IGNORED_WORDS - {'a', 'an'}:
+                tokens = tokens[1:]
+            quantity, unit, tokens = parse_quantity(tokens)
+            if name_tokens & {singular(token) for token in tokens}:
+                return quantity, unit
+    return None, None
+
+
+def _description_phrases(description: str):
+    """All phrases of up to MAX_PHRASE_TOKENS words in a description"""
+    segments = [tokenize(segment)
+                for segment in DESCRIPTION_SEPARATORS.split(description)]
+    segments = [segment for segment in segments if segment]
+    phrases = set()
+    for segment in segments:
+        for size in range(1, MAX_PHRASE_TOKENS + 1):
+            for start in range(len(segment) - size + 1):
+                phrase = segment[start:start + size]
+                # "and" or "chicken and" would keep meals from splitting
+                if phrase[0] in CONNECTORS or phrase[-1] in CONNECTORS:
+                    continue
+                phrases.add(' '.join(phrase))
+
+    # USDA descriptions put the food first and its cut or form after it,
+    # e.g. "Chicken, broilers or fryers, breast" also names "chicken breast"
+    if segments:
+        head = segments[0]
+        for segment in segments[1:]:
+            if len(head) + len(segment) <= MAX_PHRASE_TOKENS:
+                phrases.add(' '.join(head + segment))
+    return phrases
+
+
+class FoodItemExtractor:
+    '''
+    Greedy longest-match segmenter over a token trie of known food phrases.
+    Each segment of the meal, split on punctuation and on "and", "with" and
+    "plus", becomes one food item.
+    '''
+
+    def __init__(self, phrases: dict[str, int], ignored: list[str],
+                 min_frequency: int = EXTRACTOR_MIN_PHRASE_FREQUENCY):
+        self.phrases = phrases
+        self.ignored = set(ignored) | IGNORED_WORDS
+        self.min_frequency = min_frequency
+        self._lookups = 0
+        self._confident = 0
+        self._trie = {}
+        for phrase, frequency in phrases.items():
+            if frequency < min_frequency:
+                continue
+            node = self._trie
+            for token in phrase.split():
+                node = node.setdefault(singular(token), {})
+            node[None] = frequency
+
+    @classmethod
+    def build(cls, engine: Engine,
+              min_frequency: int = EXTRACTOR_MIN_PHRASE_FREQUENCY
+              ) -> 'FoodItemExtractor':
+        """Build the phrase index from the FTS tables"""
+        phrases = Counter()
+        ignored = set()
+        with engine.connect() as conn:
+            for (description,) in conn.execute(
+                    text("SELECT description FROM non_branded_foods_fts")):
+                phrases.update(_description_phrases(description or ''))
+            for description, restaurant in conn.execute(text(
+                    "SELECT description, restaurant "
+                    "FROM restaurant_menu_foods_fts")):
+                phrases.update(_description_phrases(description or ''))
+                ignored.update(tokenize(restaurant or ''))
+
+        # Restaurant names are dropped from the input, not treated as food
+        ignored -= set(phrases)
+        phrases = {phrase: frequency for phrase, frequency in phrases.items()
+                   if frequency >= min_frequency}
+        return cls(phrases, sorted(ignored), min_frequency)
+
+    @classmethod
+    def load(cls, engine: Engine, path: Path = FOOD_PHRASES_PATH):
+        """Load the phrase index from disk, building and saving it if missing"""
+        if path.exists():
+            with open(path) as f:
+                index = json.load(f)
+            return cls(index['phrases'], index['ignored'])
+
+        extractor = cls.build(engine)
+        try:
+            extractor.save(path)
+        except OSError as e:
+            logger.warning(f"Could not save food phrase index: {e}")
+        return extractor
+
+    def save(self, path: Path = FOOD_PHRASES_PATH):
+        write_json_atomic(path, {
+            'phrases': self.phrases,
+            'ignored': sorted(self.ignored - IGNORED_WORDS)
+        })
+
+    def _longest_match(self, tokens: list[str], start: int) -> int:
+        node, end = self._trie, None
+        for i in range(start, len(tokens)):
+            node = node.get(singular(tokens[i]))
+            if node is None:
+                break
+            if None in node:
+                end = i + 1
+        return end
+
+    def _split_connectors(self, tokens: list[str]) -> list[list[str]]:
+        '''
+        Split tokens on "and", "with" and "plus", except strictly inside a
+        known phrase such as "macaroni and cheese"
+        '''
+        parts, current, i = [], [], 0
+        while i < len(tokens):
+            end = self._longest_match(tokens, i)
+            if end and CONNECTORS.intersection(tokens[i + 1:end - 1]):
+                current.extend(tokens[i:end])
+                i = end
+                continue
+            if tokens[i] in CONNECTORS:
+                parts.append(current)
+                current = []
+            else:
+                current.append(tokens[i])
+            i += 1
+        parts.append(current)
+        return [part for part in parts if part]
+
+    def _item_tokens(self, tokens: list[str]) -> Optional[list[str]]:
+        '''
+        Cover a segment with known phrases and return the words of its food
+        item, or None if a word is unknown. Modifiers and filler are dropped
+        unless they are part of a longer phrase, as in "big mac".
+        '''
+        item, i = [], 0
+        while i < len(tokens):
+            end = self._longest_match(tokens, i)
+            if end and (end - i > 1 or tokens[i] not in self.ignored):
+                item.extend(tokens[i:end])
+                i = end
+            elif tokens[i] in self.ignored:
+                i += 1
+            else:
+                return None
+        return item
+
+    def extract(self, meal: str) -> Optional[list[ExtractedItem]]:
+        '''
+        Extract the food items of a meal, or None when not confident.
+        '''
+        segments = [
+            part
+            for segment in SEGMENT_SEPARATORS.split(meal)
+            for part in self._split_connectors(
+                tokenize(normalize_text(segment)))
+        ]
+
+        items = []
+        for tokens in segments:
+            # Drop filler such as "i had" in front of the quantity
+            while tokens and tokens[0] in self.ignored - {'a', 'an'} \
+                    and (self._longest_match(tokens, 0) or 0) < 2:
+                tokens = tokens[1:]
+            quantity, unit, tokens = parse_quantity(tokens)
+            item_tokens = self._item_tokens(tokens)
+            if item_tokens is None:
+                items = None
+                break
+            if item_tokens:
+                items.append(ExtractedItem(
+                    name=_title(item_tokens), quantity=quantity, unit=unit))
+
+        self._lookups += 1
+        if not items:
+            metrics.incr("food_item_extractor.fallback")
+            items = None
+        else:
+            self._confident += 1
+            metrics.incr("food_item_extractor.confident")
+        metrics.set_gauge("food_item_extractor.confident_rate",
+                          self._confident / self._lookups)
+        return items
+
+
+if __name__ == "__main__":
+    from db.comp_food_database import engine
+
+    extractor = FoodItemExtractor.build(engine)
+    extractor.save()
+    print(f"Saved {len(extractor.phrases)} phrases to {FOOD_PHRASES_PATH}")
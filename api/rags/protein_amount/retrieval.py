@@ -1,6 +1,11 @@
 from langchain.prompts import PromptTemplate
-from jinja2 import Template
+from sqlalchemy import text as sql_text
+from sqlalchemy.sql.elements import TextClause
+import os
 import re
+from collections import Counter
+from functools import lru_cache
+from typing import NamedTuple, Optional
 
 get_restaurant_or_brand_prompt = PromptTemplate.from_template(
     """
@@ -49,43 +54,196 @@ food_items_prompt = PromptTemplate.from_template(
     """
 )
 
-query_block_template = Template("""    SELECT {{ fields }}, tfts.rank
-    FROM {{ table }} t
-    INNER JOIN {{ table }}_fts tfts
-    ON t.id = tfts.id
-    WHERE {%- for d in description %} tfts.description MATCH '"{{ d }}"'
-    {%- if not loop.last %}
-    AND {%- endif %} {%- endfor %}
-    {%- if brand_match %}
-    AND tfts.brand_name MATCH '"{{ brand_match }}"'
-    {%- elif restaurant_match %}
-    AND tfts.restaurant MATCH '"{{ restaurant_match }}"'
-    {%- endif %}
+RETRIEVAL_LIMIT = 12
+
+FIELDS = ['t.description', 't.serving_size', 't.protein_amount']
+
+# Column matched against the restaurant or brand name of each table
+FILTER_COLUMNS = {
+    'restaurant_menu_foods': 'restaurant',
+    'branded_foods': 'brand_name',
+}
+EXTRA_FIELDS = {
+    'restaurant_menu_foods': ['t.serving_unit', 't.restaurant'],
+    'branded_foods': ['t.serving_unit', 't.brand_name'],
+    'non_branded_foods': [],
+}
+
+
+# Items per statement. Meals with more items run several statements.
+MAX_STATEMENT_ITEMS = 8
+# Parameters of the looser spelling correction of each item's description,
+# not bound by the statements
+FALLBACK_PREFIX = 'fallback_description_'
+
+# "routed" searches the one table picked from the restaurant_or_brand stage,
+# "all_tables" searches every table and merges their rows. "vector" searches
+# the routed table's embedding index instead of FTS and "hybrid" fuses both.
+ROUTED_MODE = 'routed'
+ALL_TABLES_MODE = 'all_tables'
+VECTOR_MODE = 'vector'
+HYBRID_MODE = 'hybrid'
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", ROUTED_MODE)
+# Reciprocal rank fusion constant, damps the weight of the first ranks
+RRF_K = 60
+
+TABLES = ['non_branded_foods', 'restaurant_menu_foods', 'branded_foods']
+# Weight of each table's rows in "all_tables" mode. The table picked from
+# the restaurant_or_brand stage gets ROUTED_TABLE_PRIOR.
+ROUTED_TABLE_PRIOR = 1.0
+TABLE_PRIORS = {
+    'non_branded_foods': 0.8,
+    'restaurant_menu_foods': 0.6,
+    'branded_foods': 0.5,
+}
+MERGED_COLUMNS = ('food_item', 'description', 'serving_size',
+                  'protein_amount', 'serving_unit', 'restaurant_or_brand',
+                  'source', 'rank')
+
+
+class TableSearch(NamedTuple):
+    prior: float
+    queries: list[tuple[TextClause, dict]]
+
+
+class VectorSearch(NamedTuple):
+    mode: str
+    table: str
+    items: list[str]
+    # Restaurant or brand name the rows must have
+    name: Optional[str]
+    limit: int
+    # The routed FTS queries, fused in "hybrid" mode and the fallback
+    # without an embedding index
+    queries: list[tuple[TextClause, dict]]
+
+# Layouts of the *_fts tables. "legacy" tables store the food id as an
+# indexed text column, "external_content" tables (db/fts_migration.sql) index
+# the base tables with rowid = id.
+LEGACY_SCHEMA = 'legacy'
+EXTERNAL_CONTENT_SCHEMA = 'external_content'
+JOIN_COLUMNS = {
+    LEGACY_SCHEMA: 'tfts.id',
+    EXTERNAL_CONTENT_SCHEMA: 'tfts.rowid',
+}
+
+
+def detect_fts_schema(conn) -> str:
+    """The layout of the *_fts tables of a database"""
+    sql = conn.execute(sql_text(
+        "SELECT sql FROM sqlite_master WHERE name = 'non_branded_foods_fts'"
+    )).scalar()
+    if sql and re.search(r'\bcontent\s*=', sql):
+        return EXTERNAL_CONTENT_SCHEMA
+    return LEGACY_SCHEMA
+
+
+@lru_cache(maxsize=None)
+def fts_schema() -> str:
+    """The layout of the *_fts tables of the food database"""
+    from db.comp_food_database import engine
+    with engine.connect() as conn:
+        return detect_fts_schema(conn)
+
+
+@lru_cache(maxsize=None)
+def statement(table: str, count: int, schema: str = LEGACY_SCHEMA,
+              filtered: bool = True) -> TextClause:
+    '''
+    The fixed statement that searches `table` for `count` food items,
+    filtered by restaurant or brand name if the table has one. All values
+    derived from the user's text are bound parameters, so there are at most
+    5 * MAX_STATEMENT_ITEMS distinct statements and SQLite reuses their
+    prepared form.
+    '''
+    filter_column = FILTER_COLUMNS.get(table) if filtered else None
+    fields = ', '.join(FIELDS + EXTRA_FIELDS[table])
+    blocks = [f"""
+    query_{i} AS (
+    SELECT :food_item_{i} AS food_item, {fields}, tfts.rank
+    FROM {table} t
+    INNER JOIN {table}_fts tfts
+    ON t.id = {JOIN_COLUMNS[schema]}
+    WHERE tfts.description MATCH :description_{i}
+    {f'AND tfts.{filter_column} MATCH :filter' if filter_column else ''}
     ORDER BY tfts.rank
-    LIMIT {{ limit }}
-""")
-
-final_query_template = Template("""WITH {%- for query in queries %}
-query_{{ loop.index }} AS (
-{{ query }}
-){%- if not loop.last %},{%- endif %}
-{%- endfor %}
-{%- for query in queries %}
-SELECT * FROM query_{{ loop.index }}
-{%- if not loop.last %}
-UNION ALL
-{%- endif %}
-{%- endfor %}
-ORDER BY rank;
-""")
-
-
-def escape_sql_string(value):
-    """Escape single quotes for safe SQL queries."""
-    return value.replace("'", "''") if value else value
-
-
-def get_query(text, limit=12):
+    LIMIT :limit
+    )""" for i in range(count)]
+    selects = ' UNION ALL '.join(
+        f"SELECT * FROM query_{i}" for i in range(count))
+    return sql_text(f"WITH {','.join(blocks)}\n{selects}\nORDER BY rank")
+
+
+def fts_phrase(value: str) -> str:
+    """Quote a value as an FTS5 phrase"""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _table_queries(table: str, items: list[str], name: Optional[str],
+                   limit: int, schema: str, corrector) -> list[tuple]:
+    """The queries of the food items in one table, filtered by `name`"""
+    if name is not None and corrector:
+        name = corrector.correct(name, f'{table}.{FILTER_COLUMNS[table]}')
+    queries = []
+    for start in range(0, len(items), MAX_STATEMENT_ITEMS):
+        chunk = items[start:start + MAX_STATEMENT_ITEMS]
+        params = {'limit': limit}
+        if name is not None:
+            params['filter'] = fts_phrase(name)
+        for i, item in enumerate(chunk):
+            params[f'food_item_{i}'] = item
+            words = item.split()
+            if corrector:
+                fallback = [corrector.correct(word, table, loose=True)
+                            for word in words]
+                words = [corrector.correct(word, table) for word in words]
+                # Searched by `fallback_queries` when the item has no rows
+                if fallback != words:
+                    params[f'{FALLBACK_PREFIX}{i}'] = ' '.join(
+                        fts_phrase(word) for word in fallback)
+            # Every word must appear in the description
+            params[f'description_{i}'] = ' '.join(
+                fts_phrase(word) for word in words)
+        queries.append(
+            (statement(table, len(chunk), schema, name is not None), params))
+    return queries
+
+
+def fallback_queries(queries: list[tuple], found: set[str]) -> list[tuple]:
+    '''
+    The queries to run again for the food items without rows that have a
+    looser spelling correction, searching that correction instead. Items
+    with rows are searched again as before, drop their rows.
+    '''
+    retries = []
+    for statement, params in queries:
+        retry = dict(params)
+        for key, description in params.items():
+            if not key.startswith(FALLBACK_PREFIX):
+                continue
+            i = key[len(FALLBACK_PREFIX):]
+            if params[f'food_item_{i}'] not in found:
+                retry[f'description_{i}'] = description
+        if retry != params:
+            retries.append((statement, retry))
+    return retries
+
+
+def get_query(text, limit=RETRIEVAL_LIMIT, schema=None, corrector=None,
+              mode=None):
+    '''
+    Build the FTS queries of the food items as (statement, parameters)
+    pairs, one per MAX_STATEMENT_ITEMS items, returning each item's best
+    rows. The schema defaults to the one of the food database. With a
+    SpellingCorrector, misspelled words are searched as the closest known
+    word of the table, rows keep the item's name as written.
+
+    In "all_tables" mode the queries are a TableSearch per table instead,
+    see `merge_table_rows`, and in "vector" and "hybrid" modes a
+    VectorSearch.
+    '''
+    schema = schema or fts_schema()
+    mode = mode or RETRIEVAL_MODE
     is_branded_query = 'brand_name' in text['restaurant_or_brand'].content
     is_restaurant_query = 'restaurant_name' in text['restaurant_or_brand'].content
 
@@ -94,47 +252,50 @@ def get_query(text, limit=12):
             else 'branded_foods' if is_branded_query \
             else 'non_branded_foods'
 
-    fields = ['t.description', 't.serving_size', 't.protein_amount']
-
     restaurant_match = ''
     brand_match = ''
 
     if is_restaurant_query:
         restaurant_match = text['restaurant_or_brand'].content.replace(
             'restaurant_name: ', '')
-        restaurant_match = escape_sql_string(
-            restaurant_match)  # Escape apostrophes
-        fields.append('t.restaurant')
 
     if is_branded_query:
         brand_match = text['restaurant_or_brand'].content.replace(
             'brand_name: ', '')
-        brand_match = escape_sql_string(brand_match)  # Escape apostrophes
-        fields.append('t.brand_name')
 
-    queries = []
-    fields = ', '.join(fields)
+    items = []
 
     food_items = re.sub(r'[\[\]\"\']', '', text['food_items'].content)
     food_items = food_items.split(',')
     for item in food_items:
         item = item.replace(brand_match, '')
         item = item.replace(restaurant_match, '')
-        item = escape_sql_string(item.strip())  # Escape food item names too
+        item = item.strip()
         if item:
-            queries.append(query_block_template.render(
-                fields=fields,
-                table=table,
-                description=item.split(' '),
-                brand_match=brand_match,
-                restaurant_match=restaurant_match,
-                limit=limit
-            ))
+            items.append(item)
 
-    final_query = final_query_template.render(
-        queries=queries,
-        limit=limit
-    )
+    name = brand_match or restaurant_match
+    if mode in (VECTOR_MODE, HYBRID_MODE):
+        name = name if table in FILTER_COLUMNS else None
+        if name is not None and corrector:
+            name = corrector.correct(name, f'{table}.{FILTER_COLUMNS[table]}')
+        queries = VectorSearch(
+            mode, table, items, name, limit,
+            _table_queries(table, items, name, limit, schema, corrector))
+    elif mode == ALL_TABLES_MODE:
+        # Only the table the restaurant or brand belongs to is filtered
+        queries = {
+            other: TableSearch(
+                ROUTED_TABLE_PRIOR if other == table else TABLE_PRIORS[other],
+                _table_queries(other, items,
+                               name if other == table and name else None,
+                               limit, schema, corrector))
+            for other in TABLES
+        }
+    else:
+        queries = _table_queries(
+            table, items, name if table in FILTER_COLUMNS else None,
+            limit, schema, corrector)
 
     retrieval_text = {}
     retrieval_text['food_items'] = text['food_items'].content
@@ -143,4 +304,86 @@ def get_query(text, limit=12):
     elif is_branded_query:
         retrieval_text['brand'] = text['restaurant_or_brand'].content
 
-    return final_query, retrieval_text
+    return queries, retrieval_text, items
+
+
+def merge_table_rows(results: dict[str, tuple],
+                     searches: dict[str, TableSearch]) -> list[tuple]:
+    '''
+    Merge the (columns, rows) of each table's search into MERGED_COLUMNS,
+    keeping as many rows of each food item as one table returns. bm25
+    scores are not comparable across tables, so each row's rank is divided
+    by the best rank of its item in its table and weighted by the table's
+    prior. Merged ranks are negative like bm25, the lower the better.
+    '''
+    merged = []
+    for table, (columns, rows) in results.items():
+        rows = [dict(zip(columns, row)) for row in rows]
+        best = {}
+        for row in rows:
+            best[row['food_item']] = min(
+                row['rank'], best.get(row['food_item'], 0))
+        prior = searches[table].prior
+        for row in rows:
+            best_rank = best[row['food_item']]
+            score = row['rank'] / best_rank if best_rank < 0 else 1.0
+            merged.append((
+                row['food_item'],
+                row['description'],
+                row['serving_size'],
+                row['protein_amount'],
+                row.get('serving_unit'),
+                row.get(FILTER_COLUMNS.get(table)),
+                table,
+                -prior * score,
+            ))
+    if not merged:
+        return []
+
+    limit = max((params['limit'] for search in searches.values()
+                 for _, params in search.queries), default=RETRIEVAL_LIMIT)
+    merged.sort(key=lambda row: row[-1])
+    kept, counts = [], Counter()
+    for row in merged:
+        counts[row[0]] += 1
+        if counts[row[0]] <= limit:
+            kept.append(row)
+    return [MERGED_COLUMNS, *kept]
+
+
+@lru_cache(maxsize=None)
+def rows_statement(table: str) -> TextClause:
+    '''
+    The fields of the rows of `table` with the given food ids, a primary key
+    lookup once db/fts_migration.sql has run
+    '''
+    fields = ', '.join(FIELDS + EXTRA_FIELDS[table])
+    return sql_text(
+        f"SELECT t.id AS food_id, {fields} FROM {table} t "
+        "WHERE t.id IN (SELECT value FROM json_each(:ids))")
+
+
+def reciprocal_rank_fusion(rankings: list[list[tuple]], limit: int,
+                           k: int = RRF_K) -> list[tuple]:
+    '''
+    Fuse rankings of rows shaped like the FTS rows (food item first, rank
+    last) into the best `limit` rows of each food item. A row's score is the
+    sum of 1 / (k + position) over the rankings it is in, rows are the same
+    when they have the same food item and description. Fused ranks are
+    negative scores, the lower the better.
+    '''
+    scores, rows = Counter(), {}
+    for ranking in rankings:
+        positions = Counter()
+        for row in ranking:
+            key = (row[0], row[1])
+            scores[key] += 1 / (k + positions[row[0]] + 1)
+            positions[row[0]] += 1
+            rows.setdefault(key, row)
+
+    fused, counts = [], Counter()
+    for key, score in sorted(scores.items(), key=lambda entry: -entry[1]):
+        counts[key[0]] += 1
+        if counts[key[0]] <= limit:
+            fused.append((*rows[key][:-1], -score))
+    return fused
@@ -0,0 +1,266 @@
+'''
+Typo-tolerant food item words.
+
+The FTS queries require every word of a food item in the description, so a
+single misspelled word ("brocoli") returns no rows. Words missing from a
+table's vocabulary are replaced by the closest known word, found by
+trigram similarity or by phonetic key and edit distance, before the query
+is built. Words the database knows are never changed.
+
+Words spelled far from how they sound ("keenwa" for "quinoa") are only
+corrected by a looser match, on the sound spellings of the words, which is
+searched when an item's query returns no rows (`fallback_queries` in
+retrieval).
+
+Build the vocabularies ahead of time with:
+
+    python -m rags.protein_amount.spelling
+'''
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from utils import metrics
+from utils.files import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+FOOD_VOCABULARY_PATH = Path(os.getenv(
+    "FOOD_VOCABULARY_PATH",
+    Path(__file__).parents[2] / 'db' / 'food_vocabulary.json'))
+# Words in fewer descriptions are known but never suggested
+SPELLING_MIN_TERM_FREQUENCY = int(
+    os.getenv("SPELLING_MIN_TERM_FREQUENCY", 2))
+SPELLING_MIN_SCORE = float(os.getenv("SPELLING_MIN_SCORE", 0.5))
+# Sounding alike counts as much as sharing half of the trigrams, for words
+# within MAX_PHONETIC_EDITS edits
+PHONETIC_WEIGHT = 0.5
+MIN_CORRECTED_LENGTH = 3
+
+# The columns searched by retrieval, keyed by vocabulary name
+VOCABULARY_QUERIES = {
+    'non_branded_foods':
+        "SELECT description FROM non_branded_foods_fts",
+    'restaurant_menu_foods':
+        "SELECT description FROM restaurant_menu_foods_fts",
+    'restaurant_menu_foods.restaurant':
+        "SELECT restaurant FROM restaurant_menu_foods_fts",
+    'branded_foods':
+        "SELECT description FROM branded_foods_fts",
+    'branded_foods.brand_name':
+        "SELECT brand_name FROM branded_foods_fts",
+}
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+# Spellings of the same sound, applied in order
+SOUND_RULES = [
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'ck|qu|q'), 'k'),
+    (re.compile(r'^kn|^gn'), 'n'),
+    (re.compile(r'^wr'), 'r'),
+    (re.compile(r'sch'), 'sk'),
+    (re.compile(r'ch|sh'), 'x'),
+    (re.compile(r'c(?=[eiy])'), 's'),
+    (re.compile(r'c'), 'k'),
+    (re.compile(r'dg'), 'j'),
+    (re.compile(r'z'), 's'),
+    (re.compile(r'gh'), 'g'),
+    (re.compile(r'ee|ea|ie|ey'), 'i'),
+    (re.compile(r'oo|ou'), 'u'),
+    # Silent final e, as in "cone"
+    (re.compile(r'(?<=[^aeiou])e$'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+PHONETIC_RULES = [
+    (re.compile(r'[aeiouwhy]'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+
+def fts_tokens(value: str) -> list[str]:
+    """The tokens FTS5's default unicode61 tokenizer finds in a value"""
+    value = unicodedata.normalize('NFKD', value.lower())
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return TOKEN_PATTERN.findall(value)
+
+
+def sound_spelling(word: str) -> str:
+    '''
+    A word respelled as it likely sounds, so that "keenwa" becomes "kinwa"
+    and "quinoa" becomes "kinoa"
+    '''
+    for pattern, replacement in SOUND_RULES:
+        word = pattern.sub(replacement, word)
+    return word
+
+
+def phonetic_key(word: str) -> str:
+    '''
+    Consonant skeleton of a word's likely pronunciation, so that "kofee"
+    and "coffee" both become "kf". Words of vowels only have an empty key.
+    '''
+    word = sound_spelling(word)
+    for pattern, replacement in PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    return word
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Insertions, deletions, substitutions and transpositions from a to b"""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous, before = current, previous
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] \
+                    and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SpellingCorrector:
+    '''
+    Per-table vocabularies of the searched columns with their document
+    frequencies, indexed by phonetic key and by trigram.
+    '''
+
+    def __init__(self, vocabularies: dict[str, dict[str, int]],
+                 min_frequency: int = SPELLING_MIN_TERM_FREQUENCY):
+        self.vocabularies = vocabularies
+        self.min_frequency = min_frequency
+        self._phonetic = {}
+        self._trigrams = {}
+        for name, vocabulary in vocabularies.items():
+            phonetic, grams = defaultdict(list), defaultdict(list)
+            for term, frequency in vocabulary.items():
+                if frequency < min_frequency or not term.isalpha():
+                    continue
+                key = phonetic_key(term)
+                if key:
+                    phonetic[key].append(term)
+                for gram in trigrams(term):
+                    grams[gram].append(term)
+            self._phonetic[name] = dict(phonetic)
+            self._trigrams[name] = dict(grams)
+
+    @classmethod
+    def build(cls, engine: Engine,
+              min_frequency: int = SPELLING_MIN_TERM_FREQUENCY
+              ) -> 'SpellingCorrector':
+        """Count the words of the searched columns in the FTS tables"""
+        vocabularies = {}
+        with engine.connect() as conn:
+            for name, query in VOCABULARY_QUERIES.items():
+                frequencies = Counter()
+                for (value,) in conn.execute(text(query)):
+                    frequencies.update(set(fts_tokens(value or '')))
+                vocabularies[name] = dict(frequencies)
+        return cls(vocabularies, min_frequency)
+
+    @classmethod
+    def load(cls, engine: Engine, path: Path = FOOD_VOCABULARY_PATH):
+        """Load the vocabularies from disk, building and saving them if missing"""
+        if path.exists():
+            with open(path) as f:
+                return cls(json.load(f))
+
+        corrector = cls.build(engine)
+        try:
+            corrector.save(path)
+        except OSError as e:
+            logger.warning(f"Could not save food vocabulary: {e}")
+        return corrector
+
+    def save(self, path: Path = FOOD_VOCABULARY_PATH):
+        write_json_atomic(path, self.vocabularies)
+
+    def suggest(self, token: str, vocabulary: str,
+                loose: bool = False) -> Optional[str]:
+        '''
+        The known word closest to an unknown token, or None if no word
+        scores SPELLING_MIN_SCORE. Scores are the Dice coefficient of the
+        trigrams, at least PHONETIC_WEIGHT for the same phonetic key within
+        a few edits, and ties go to the closer word, then to the word in
+        more descriptions.
+
+        `loose` suggestions, searched only when the query returned no rows,
+        also count the edits between the words' sound spellings, so that
+        "keenwa" ("kinwa") becomes "quinoa" ("kinoa").
+        '''
+        frequencies = self.vocabularies.get(vocabulary, {})
+        grams = trigrams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(vocabulary, {}).get(gram, ()))
+        sound = phonetic_key(token)
+        sounds_alike = set(
+            self._phonetic.get(vocabulary, {}).get(sound, ())) \
+            if sound else set()
+
+        best, best_key = None, None
+        max_edits = max(2, len(token) // 3)
+        for term in sorted(sounds_alike | set(shared)):
+            if abs(len(term) - len(token)) > max_edits:
+                continue
+            score = 2 * shared[term] / (len(grams) + len(term))
+            if score < SPELLING_MIN_SCORE and term not in sounds_alike:
+                continue
+            edits = edit_distance(token, term)
+            if loose and term in sounds_alike:
+                edits = min(edits, edit_distance(
+                    sound_spelling(token), sound_spelling(term)))
+            # A shared key alone is too loose, "keenwa" sounds like "cone"
+            if term in sounds_alike and edits <= max_edits:
+                score = max(score, PHONETIC_WEIGHT)
+            key = (score, -edits, frequencies[term])
+            if score >= SPELLING_MIN_SCORE and (best is None or key > best_key):
+                best, best_key = term, key
+        return best
+
+    def correct(self, value: str, vocabulary: str,
+                loose: bool = False) -> str:
+        '''
+        Replace the unknown words of a value with their suggestion. Values
+        whose words are all known are returned unchanged.
+        '''
+        tokens = fts_tokens(value)
+        frequencies = self.vocabularies.get(vocabulary, {})
+        if all(token in frequencies for token in tokens):
+            return value
+
+        corrected = []
+        for token in tokens:
+            suggestion = None
+            if token not in frequencies and token.isalpha() \
+                    and len(token) >= MIN_CORRECTED_LENGTH:
+                suggestion = self.suggest(token, vocabulary, loose)
+                if not loose:
+                    metrics.incr("spelling.corrected" if suggestion
+                                 else "spelling.uncorrected")
+            corrected.append(suggestion or token)
+        return ' '.join(corrected)
+
+
+if __name__ == "__main__":
+    from db.comp_food_database import engine
+
+    corrector = SpellingCorrector.build(engine)
+    corrector.save()
+    print(f"Saved {sum(map(len, corrector.vocabularies.values()))} words "
+          f"to {FOOD_VOCABULARY_PATH}")
@@ -1,3 +1,4 @@
-from .validate_token import validate_token
+from .validate_token import validate_token, decode_token
+from .keys import play_integrity_keys
 
-__all__ = ['validate_token']
+__all__ = ['validate_token', 'decode_token', 'play_integrity_keys']
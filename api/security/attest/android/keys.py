@@ -0,0 +1,73 @@
+import base64
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from utils.get_secret import get_secret
+
+DECRYPTION_KEY_SECRET = "PLAY_INTEGRITY_DECRYPTION_KEY"
+VERIFICATION_KEY_SECRET = "PLAY_INTEGRITY_VERIFICATION_KEY"
+
+# Re-read the key secrets this often (0 only reloads on demand)
+PLAY_INTEGRITY_KEYS_RELOAD_SECONDS = int(
+    os.getenv("PLAY_INTEGRITY_KEYS_RELOAD_SECONDS", 0))
+
+
+class KeySet(NamedTuple):
+    decryption_key: bytes
+    verification_key: ec.EllipticCurvePublicKey
+
+
+def load_key_set(decryption_key_b64: str, verification_key_b64: str):
+    """Decode the base64 keys from the Play Console into a KeySet"""
+    return KeySet(
+        decryption_key=base64.b64decode(decryption_key_b64),
+        verification_key=serialization.load_der_public_key(
+            base64.b64decode(verification_key_b64))
+    )
+
+
+class PlayIntegrityKeys:
+    '''
+    Holds the decoded Play Integrity decryption key and loaded verification
+    key. The keys are read from the secrets on first use and can be swapped
+    without a restart with `rotate` or `reload`. Readers always see a
+    matching pair, since the whole KeySet is replaced at once.
+    '''
+
+    def __init__(self, reload_seconds: int = PLAY_INTEGRITY_KEYS_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._keys: Optional[KeySet] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> KeySet:
+        keys = self._keys
+        if keys is None or (
+                self.reload_seconds > 0 and
+                time.monotonic() - self._loaded_at > self.reload_seconds):
+            keys = self.reload()
+        return keys
+
+    def reload(self) -> KeySet:
+        """Re-read the keys from the secrets"""
+        decryption_key = get_secret(DECRYPTION_KEY_SECRET)
+        verification_key = get_secret(VERIFICATION_KEY_SECRET)
+        if not decryption_key or not verification_key:
+            raise ValueError("Play Integrity keys are not configured")
+        return self.rotate(decryption_key, verification_key)
+
+    def rotate(self, decryption_key_b64: str, verification_key_b64: str):
+        """Replace the keys with the given base64 keys"""
+        keys = load_key_set(decryption_key_b64, verification_key_b64)
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+        return keys
+
+
+play_integrity_keys = PlayIntegrityKeys()
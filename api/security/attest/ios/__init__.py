@@ -1,4 +1,10 @@
-from .validate_attestation import validate_attestation, get_public_key
+from .validate_attestation import (
+    validate_attestation,
+    get_public_key,
+    ParsedAttestation
+)
 from .validate_assertion import validate_assertion
+from .public_key_cache import public_key_cache
 
-__all__ = ['validate_attestation', 'get_public_key', 'validate_assertion']
+__all__ = ['validate_attestation', 'get_public_key', 'ParsedAttestation',
+           'validate_assertion', 'public_key_cache']
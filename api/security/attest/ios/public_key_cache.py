@@ -0,0 +1,67 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from utils import metrics
+
+PUBLIC_KEY_CACHE_SIZE = int(os.getenv("PUBLIC_KEY_CACHE_SIZE", 10_000))
+
+
+class PublicKeyCache:
+    '''
+    Bounded LRU of loaded device public keys, keyed by key id.
+
+    Entries remember the stored DER string they were loaded from, so a key
+    re-registered through another worker is reloaded rather than served
+    stale. Lookups are counted under `public_key_cache.*`.
+    '''
+
+    def __init__(self, maxsize: int = PUBLIC_KEY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._keys: OrderedDict[str, tuple[str, ec.EllipticCurvePublicKey]] \
+            = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_id: str, public_key: str) -> ec.EllipticCurvePublicKey:
+        """Loaded key for the stored base64 DER public key of key_id"""
+        with self._lock:
+            entry = self._keys.get(key_id)
+            if entry is not None and entry[0] == public_key:
+                self._keys.move_to_end(key_id)
+                metrics.incr("public_key_cache.hits")
+                return entry[1]
+
+        metrics.incr("public_key_cache.misses")
+        key = serialization.load_der_public_key(base64.b64decode(public_key))
+        if self.maxsize <= 0:
+            return key
+
+        with self._lock:
+            self._keys[key_id] = (public_key, key)
+            self._keys.move_to_end(key_id)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+                metrics.incr("public_key_cache.evictions")
+        return key
+
+    def peek(self, key_id: str) -> Optional[str]:
+        """Stored DER string of the cached key of key_id, if any"""
+        with self._lock:
+            entry = self._keys.get(key_id)
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, key_id: str):
+        with self._lock:
+            self._keys.pop(key_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+public_key_cache = PublicKeyCache()
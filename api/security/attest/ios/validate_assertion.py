@@ -2,13 +2,22 @@ import json
 import hashlib
 import base64
 import cbor2
-from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import ec
 from cache import KEY_CHALLENGE_PREFIX, KEY_COUNTER_PREFIX, KEY_PUBLIC_KEY_PREFIX
-from redis import Redis
+from cache.store import KEY_CHALLENGE_TTL_SECONDS
+from cache.scripts import CHECK_ASSERTION_SCRIPT
+import redis.asyncio
 
+from .public_key_cache import public_key_cache
 
-def _verify_nonce(assertion: dict, client_data: dict, public_key: str) -> bool:
+
+def _verify_nonce(
+    assertion: dict,
+    client_data: dict,
+    key_id: str,
+    public_key: str
+) -> bool:
     '''
     Step 1: Use the public key that you store from the attestation object to
     verify that the assertion signature is valid for nonce.
@@ -21,9 +30,8 @@ def _verify_nonce(assertion: dict, client_data: dict, public_key: str) -> bool:
         (assertion['authenticatorData'] + client_data_hash)
     ).digest()
 
-    # Load the stored public key
-    public_key_bytes = base64.b64decode(public_key)
-    public_key_obj = serialization.load_der_public_key(public_key_bytes)
+    # Load the stored public key, parsed once per device
+    public_key_obj = public_key_cache.get(key_id, public_key)
 
     # Verify the signature
     signature = assertion['signature']
@@ -47,8 +55,8 @@ def _verify_rp_id(assertion: dict, app_id: str) -> bool:
     return app_id_hash == rp_id
 
 
-def validate_assertion(
-    redis_client: Redis,
+async def validate_assertion(
+    redis_client: redis.asyncio.Redis,
     client_data: dict,
     assertion: str,
     key_id: str,
@@ -56,31 +64,43 @@ def validate_assertion(
 ) -> bool:
     """Main validation method that orchestrates all validation steps"""
     try:
-        # Batch the three Redis GET operations into a single MGET call
-        keys = [
-            f"{KEY_PUBLIC_KEY_PREFIX}{key_id}",
-            f"{KEY_CHALLENGE_PREFIX}{key_id}",
-            f"{KEY_COUNTER_PREFIX}{key_id}"
-        ]
-        public_key, last_challenge, counter = redis_client.mget(keys)
-        counter = int(counter) if counter else 0
-
         assertion = cbor2.loads(base64.b64decode(assertion))
         assertion_count = int.from_bytes(assertion['authenticatorData']
                                          [32:], 'big')
 
-        checks = [
-            _verify_nonce(assertion, client_data, public_key),
-            _verify_rp_id(assertion, f"{app_id}"),
-            assertion_count > counter,
-            client_data['challenge'] == last_challenge
-        ]
+        if not _verify_rp_id(assertion, f"{app_id}"):
+            return False
 
-        passed = all(checks)
+        # The signature is checked against the key loaded by an earlier
+        # request, so the Redis side is a single script call. The script
+        # reports the stored key if it was re-registered since.
+        public_key = public_key_cache.peek(key_id)
+        if public_key is None:
+            public_key = await redis_client.get(
+                f"{KEY_PUBLIC_KEY_PREFIX}{key_id}")
 
-        redis_client.set(f"{KEY_COUNTER_PREFIX}{key_id}", f'{assertion_count}')
+        keys = [
+            f"{KEY_PUBLIC_KEY_PREFIX}{key_id}",
+            f"{KEY_CHALLENGE_PREFIX}{key_id}",
+            f"{KEY_COUNTER_PREFIX}{key_id}"
+        ]
+        for _ in range(2):
+            if not public_key:
+                return False
+            _verify_nonce(assertion, client_data, key_id, public_key)
+
+            # Atomically check the challenge and advance the counter
+            status, *stored = await CHECK_ASSERTION_SCRIPT(
+                redis_client,
+                keys,
+                [public_key, client_data['challenge'], assertion_count,
+                 KEY_CHALLENGE_TTL_SECONDS]
+            )
+            if status != 'stale_key':
+                return status == 'ok'
+            public_key = stored[0]
 
-        return passed
+        return False
 
     except Exception as e:
         print(f"Error in validate_assertion: {e}")
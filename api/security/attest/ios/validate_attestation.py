@@ -1,12 +1,19 @@
 import base64
 import hmac
 import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Union
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.constant_time import bytes_eq
 from cryptography.hazmat.primitives import serialization
 
+from utils import metrics
+
 
 def _to_fixed_length_hex(value: str, length: int = 16):
     return value.encode().ljust(length, b'\x00')[:length].hex()
@@ -47,62 +54,135 @@ root_cert = x509.load_pem_x509_certificate(
 )
 
 
-def get_public_key(parsed_data: dict) -> str:
-    """Get the public key from the attestation"""
-    x5c = parsed_data.get('attStmt', {}).get('x5c', [])
-    if not x5c:
-        raise ValueError("No x5c found in attestation")
-
-    cred_cert = x509.load_der_x509_certificate(x5c[0])
-
-    public_key = cred_cert.public_key()
-    public_bytes = public_key.public_bytes(
-        encoding=serialization.Encoding.X962,
-        format=serialization.PublicFormat.UncompressedPoint
-    )
-    public_bytes = _sha256(public_bytes)
-    key_hash_b64 = base64.b64encode(public_bytes).decode()
-    return key_hash_b64
-
-
-def _validate_certificate_chain(parsed_data: dict) -> bool:
-    """Step 1: Validate the certificate chain"""
-    x5c = parsed_data.get('attStmt', {}).get('x5c', [])
-    if not x5c:
+INTERMEDIATE_CACHE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class ParsedAttestation:
+    '''
+    An attestation object with its certificates and authData fields
+    decoded once, shared by every validation step.
+    '''
+    x5c: list[bytes]
+    certs: list[x509.Certificate]
+    auth_data: bytes
+    rp_id_hash: bytes
+    counter: int
+    aaguid: bytes
+    credential_id: bytes
+
+    @classmethod
+    def parse(cls, attestation: dict) -> 'ParsedAttestation':
+        x5c = attestation.get('attStmt', {}).get('x5c', [])
+        if not x5c:
+            raise ValueError("No x5c found in attestation")
+
+        auth_data = attestation['authData']
+        credential_id_length = int.from_bytes(auth_data[53:55], 'big')
+        return cls(
+            x5c=x5c,
+            certs=[x509.load_der_x509_certificate(cert) for cert in x5c],
+            auth_data=auth_data,
+            rp_id_hash=auth_data[:32],
+            counter=int.from_bytes(auth_data[33:37], 'big'),
+            aaguid=auth_data[37:53],
+            credential_id=auth_data[55:55 + credential_id_length],
+        )
+
+    @property
+    def leaf(self) -> x509.Certificate:
+        return self.certs[0]
+
+    @cached_property
+    def public_key(self):
+        return self.leaf.public_key()
+
+    @cached_property
+    def key_hash_b64(self) -> str:
+        """Base64 SHA256 of the uncompressed public key point (the key id)"""
+        public_bytes = self.public_key.public_bytes(
+            encoding=serialization.Encoding.X962,
+            format=serialization.PublicFormat.UncompressedPoint
+        )
+        return base64.b64encode(_sha256(public_bytes)).decode()
+
+    @cached_property
+    def public_key_der_b64(self) -> str:
+        """Base64 DER of the public key, as stored for assertions"""
+        public_bytes = self.public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return base64.b64encode(public_bytes).decode()
+
+
+# SHA256 fingerprints of intermediate certificates already verified up to
+# the root, so that only the leaf signature is checked per device
+_verified_intermediates: OrderedDict[bytes, None] = OrderedDict()
+_verified_intermediates_lock = threading.Lock()
+
+
+def _is_verified_intermediate(fingerprint: bytes) -> bool:
+    with _verified_intermediates_lock:
+        if fingerprint in _verified_intermediates:
+            _verified_intermediates.move_to_end(fingerprint)
+            return True
         return False
 
-    certs = [
-        x509.load_der_x509_certificate(cert_data)
-        for cert_data in x5c
-    ]
 
-    for i in range(len(certs) - 1):
-        certs[i].verify_directly_issued_by(certs[i + 1])
+def _add_verified_intermediates(fingerprints: list[bytes]):
+    with _verified_intermediates_lock:
+        for fingerprint in fingerprints:
+            _verified_intermediates[fingerprint] = None
+            _verified_intermediates.move_to_end(fingerprint)
+        while len(_verified_intermediates) > INTERMEDIATE_CACHE_SIZE:
+            _verified_intermediates.popitem(last=False)
 
-    certs[-1].verify_directly_issued_by(root_cert)
-    return True
 
-
-def _validate_nonce(parsed_data: dict, challenge: str) -> bool:
+def get_public_key(parsed_data: Union[dict, ParsedAttestation]) -> str:
+    """Get the public key from the attestation"""
+    if not isinstance(parsed_data, ParsedAttestation):
+        parsed_data = ParsedAttestation.parse(parsed_data)
+    return parsed_data.key_hash_b64
+
+
+def _verify_certificate_chain(parsed_data: ParsedAttestation) -> list[bytes]:
+    '''
+    Step 1: Validate the certificate chain up to the root, stopping at the
+    first intermediate already verified. Returns the fingerprints of the
+    intermediates verified by this call, certificates after a cached one
+    are never checked.
+    '''
+    chain = parsed_data.certs + [root_cert]
+    parsed_data.leaf.verify_directly_issued_by(chain[1])
+
+    verified = []
+    for i, cert in enumerate(parsed_data.x5c[1:], start=1):
+        fingerprint = _sha256(cert)
+        if _is_verified_intermediate(fingerprint):
+            metrics.incr("attestation.intermediate_cache.hits")
+            break
+        metrics.incr("attestation.intermediate_cache.misses")
+        chain[i].verify_directly_issued_by(chain[i + 1])
+        verified.append(fingerprint)
+    return verified
+
+
+def _validate_nonce(parsed_data: ParsedAttestation, challenge: str) -> bool:
     """Step 2: Verify nonce
     - compute client data hash
     - compute nonce
     - make sure nonce is valid
     """
-    cert = x509.load_der_x509_certificate(
-        parsed_data.get('attStmt', {}).get('x5c', [])[0],
-        default_backend()
-    )
-
     # It's required to hash the challenge first and append it to the auth data
     # before hashing that entire thing. The example given by apple might lead you
     # not to do this, but in practice we need this.
     hashed_challenge = _sha256(challenge.encode())
     # hashed_challenge = challenge.encode()
-    client_data_hash = parsed_data['authData']
+    client_data_hash = parsed_data.auth_data
     expected_nonce = _sha256(client_data_hash + hashed_challenge)
 
-    ext = cert.extensions.get_extension_for_oid(OID_APPLE)
+    ext = parsed_data.leaf.extensions.get_extension_for_oid(OID_APPLE)
     ext_nonce = ext.value.value[6:]
 
     if not bytes_eq(expected_nonce, ext_nonce):
@@ -111,7 +191,8 @@ def _validate_nonce(parsed_data: dict, challenge: str) -> bool:
     return True
 
 
-def _validate_key_consistency(parsed_data: dict, key_id: str) -> bool:
+def _validate_key_consistency(parsed_data: ParsedAttestation,
+                              key_id: str) -> bool:
     """Step 3: Verify key consistency
     - Compute keyIdentifier = SHA256(public key)
     - Ensure that keyIdentifier matches the value sent by the app
@@ -121,33 +202,29 @@ def _validate_key_consistency(parsed_data: dict, key_id: str) -> bool:
     return hmac.compare_digest(key_hash_b64, key_id)
 
 
-def _validate_rp_id(parsed_data: dict, app_id: str) -> bool:
+def _validate_rp_id(parsed_data: ParsedAttestation, app_id: str) -> bool:
     """Step 4: Verify RP id
     - Compute expected_rp_id_hash = SHA256(App ID)
     - Extract rpIdHash from authData and ensure it matches expected_rp_id_hash
     """
-    auth_data_rp_id_hash = parsed_data['authData'][:32]
     expected_rp_id_hash = _sha256(app_id.encode())
 
-    return hmac.compare_digest(auth_data_rp_id_hash, expected_rp_id_hash)
+    return hmac.compare_digest(parsed_data.rp_id_hash, expected_rp_id_hash)
 
 
-def _validate_counter(parsed_data: dict) -> bool:
+def _validate_counter(parsed_data: ParsedAttestation) -> bool:
     """Step 5: Verify counter to prevent replay attacks
     - Counter should be 0 at first attestation
     - Counter should be monotonically increasing for subsequent attestations
     """
-    counter_bytes = parsed_data['authData'][33:37]
-    counter = int.from_bytes(counter_bytes, 'big')
-
     # For first attestation, counter should be 0
-    if counter != 0:
+    if parsed_data.counter != 0:
         return False
 
     return True
 
 
-def _validate_environment(parsed_data: dict) -> bool:
+def _validate_environment(parsed_data: ParsedAttestation) -> bool:
     """Step 6: Verify environment
     - Check aaguid field in authData:
       - aaguid should be:
@@ -155,8 +232,7 @@ def _validate_environment(parsed_data: dict) -> bool:
         - "appattest000000000000" for production
       - Ensure that the attestation environment matches the expected one
     """
-    aaguid = parsed_data['authData'][37:53]
-    aaguid_hex = aaguid.hex()
+    aaguid_hex = parsed_data.aaguid.hex()
 
     if INTEGRITY_ENVIRONMENT == "development":
         expected_aaguid = DEV_AAGUID_HEX
@@ -166,20 +242,18 @@ def _validate_environment(parsed_data: dict) -> bool:
     return hmac.compare_digest(aaguid_hex, expected_aaguid)
 
 
-def _validate_auth_data_credential_id(parsed_data: dict, key_id: str) -> bool:
+def _validate_auth_data_credential_id(parsed_data: ParsedAttestation,
+                                      key_id: str) -> bool:
     """Step 7: Verify credential ID
     - Extract credentialID from authData and ensure it matches the value sent by the app
     """
-    credential_id_length = int.from_bytes(
-        parsed_data['authData'][53:55], 'big')
-    credential_id = parsed_data['authData'][55:55 + credential_id_length]
-    credential_id_b64 = base64.b64encode(credential_id).decode()
+    credential_id_b64 = base64.b64encode(parsed_data.credential_id).decode()
 
     return hmac.compare_digest(credential_id_b64, key_id)
 
 
 def validate_attestation(
-    attestation: dict,
+    attestation: Union[dict, ParsedAttestation],
     challenge: str,
     key_id: str,
     app_id: str,
@@ -187,8 +261,14 @@ def validate_attestation(
     """Main validation method that orchestrates all validation steps"""
 
     try:
+        if not isinstance(attestation, ParsedAttestation):
+            attestation = ParsedAttestation.parse(attestation)
+
+        # Step 1. Its intermediates are only cached once the whole
+        # attestation is valid.
+        verified_intermediates = _verify_certificate_chain(attestation)
+
         validation_steps = [
-            lambda: _validate_certificate_chain(attestation),
             lambda: _validate_nonce(attestation, challenge),
             lambda: _validate_rp_id(attestation, app_id),
             lambda: _validate_key_consistency(attestation, key_id),
@@ -202,6 +282,7 @@ def validate_attestation(
             if not result:
                 return False
 
+        _add_verified_intermediates(verified_intermediates)
         return True
 
     except Exception:
@@ -1,4 +1,5 @@
 from .is_valid_mobile import is_valid_mobile
 from .test_only import test_only
+from .admin_only import admin_only
 
-__all__ = ["is_valid_mobile", "test_only"]
+__all__ = ["is_valid_mobile", "test_only", "admin_only"]
@@ -0,0 +1,33 @@
+import hmac
+import os
+from typing import Optional
+from fastapi import Header, HTTPException
+from utils.get_secret import get_secret
+
+
+def _admin_token() -> Optional[str]:
+    '''
+    The ADMIN_TOKEN secret, read per request so that the app starts before
+    it is provisioned. None when it is missing, which forbids every request.
+    '''
+    try:
+        token = get_secret("ADMIN_TOKEN")
+    except OSError:
+        return None
+    # Secret files usually end with a newline
+    return token.strip() if token else None
+
+
+async def admin_only(x_admin_token: Optional[str] = Header(None)) -> bool:
+    '''
+    Require the x-admin-token header to match the ADMIN_TOKEN secret.
+    '''
+    if os.environ.get("ENVIRONMENT") == "development":
+        return True
+
+    admin_token = _admin_token()
+    if not admin_token or not x_admin_token or \
+            not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    return True
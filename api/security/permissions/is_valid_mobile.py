@@ -3,8 +3,8 @@ from fastapi import Depends, Header, HTTPException, Request
 from security.attest.ios import validate_assertion
 from security.attest.android import validate_token
 from appconf import IOS_APP_ID
-from redis import Redis
-from cache import get_redis
+import redis.asyncio
+from cache import get_async_redis
 from typing import Optional
 import json
 
@@ -15,7 +15,7 @@ async def is_valid_mobile(
     x_challenge: Optional[str] = Header(None),
     x_assertion: Optional[str] = Header(None),
     x_token: Optional[str] = Header(None),
-    redis_client: Redis = Depends(get_redis),
+    redis_client: redis.asyncio.Redis = Depends(get_async_redis),
 ) -> bool:
     '''
     Validate the assertion.
@@ -39,7 +39,7 @@ async def is_valid_mobile(
 
     # ios case
     if x_key_id:
-        assertion_valid = validate_assertion(
+        assertion_valid = await validate_assertion(
             redis_client=redis_client,
             key_id=x_key_id,
             app_id=IOS_APP_ID,
@@ -47,7 +47,7 @@ async def is_valid_mobile(
             client_data=client_data
         )
     elif x_token:
-        assertion_valid = validate_token(
+        assertion_valid = await validate_token(
             redis_client=redis_client,
             token=x_token,
             challenge=x_challenge,
@@ -0,0 +1,33 @@
+import asyncio
+import importlib
+
+import pytest
+from fastapi import HTTPException
+
+# The packages export functions under the same names as their modules
+permissions = importlib.import_module('security.permissions.admin_only')
+get_secret = importlib.import_module('utils.get_secret')
+
+
+@pytest.fixture
+def secrets(tmp_path, monkeypatch):
+    monkeypatch.setenv("ENVIRONMENT", "production")
+    monkeypatch.setattr(get_secret, "env", "production")
+    monkeypatch.setattr(get_secret, "SECRETS_PATH", str(tmp_path))
+    return tmp_path
+
+
+def test_token_read_from_a_secret_file_with_a_newline(secrets):
+    (secrets / "ADMIN_TOKEN").write_text("s3cret\n")
+
+    assert asyncio.run(permissions.admin_only("s3cret"))
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(permissions.admin_only("wrong"))
+    assert e.value.status_code == 403
+
+
+def test_missing_secret_forbids_every_request(secrets):
+    for token in ("", "s3cret", None):
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(permissions.admin_only(token))
+        assert e.value.status_code == 403
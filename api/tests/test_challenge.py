@@ -0,0 +1,47 @@
+import re
+
+from fastapi.testclient import TestClient
+
+from main import app
+from cache import CHALLENGE_PREFIX, generate_challenge, get_redis
+from cache.store import CHALLENGE_COUNTER_BIT_LENGTH
+
+client = TestClient(app)
+VERSION = "v1"
+
+CHALLENGE_PATTERN = re.compile(
+    r'^[A-Za-z0-9]{16}\.[A-Za-z0-9]{32}\.[1-9]\d{%d}$'
+    % (CHALLENGE_COUNTER_BIT_LENGTH - 1))
+
+
+def test_generate_challenge():
+    challenges = {generate_challenge() for _ in range(100)}
+
+    assert len(challenges) == 100
+    assert all(CHALLENGE_PATTERN.match(challenge) for challenge in challenges)
+
+
+def test_challenge_batch_stores_every_challenge():
+    response = client.post(f"/{VERSION}/challenge/batch?count=5")
+    assert response.status_code == 200
+
+    challenges = response.json()
+    redis_client = next(get_redis())
+    keys = [f"{CHALLENGE_PREFIX}{challenge.split('.')[0]}"
+            for challenge in challenges]
+    try:
+        assert len(set(challenges)) == 5
+        assert redis_client.mget(keys) == [
+            challenge.split('.', 1)[1] for challenge in challenges]
+        assert all(redis_client.ttl(key) > 0 for key in keys)
+    finally:
+        redis_client.delete(*keys)
+
+
+def test_challenge_batch_rejects_key_challenges_and_large_batches():
+    response = client.post(f"/{VERSION}/challenge/batch?count=5",
+                           headers={"x-key-id": "test_key_id"})
+    assert response.status_code == 400
+
+    response = client.post(f"/{VERSION}/challenge/batch?count=1000")
+    assert response.status_code == 400
@@ -0,0 +1,58 @@
+from rags.protein_amount.compaction import (
+    compact_rows,
+    compact_context,
+    count_tokens,
+    estimate_tokens,
+    HEADER
+)
+from utils import metrics
+
+COLUMNS = ('food_item', 'description', 'serving_size', 'protein_amount',
+           'serving_unit', 'restaurant', 'rank')
+DATA = [
+    COLUMNS,
+    ('Egg', 'Egg, whole, cooked, hard-boiled', 100.0, 12.6, None, None, -3.0),
+    ('Egg', 'Egg, whole, hard-boiled, cooked', 100.0, 12.5, None, None, -2.9),
+    ('Burrito Bowl', 'Chicken Burrito Bowl', 500.0, 53.0, 'g', 'Chipotle',
+     -2.5),
+    ('Egg', 'Egg, white, raw', 100.0, 10.9, None, None, -2.0),
+    ('Egg', 'Egg, yolk, raw', 100.0, 15.9, None, None, -1.0),
+]
+
+
+def test_encodes_rows_densely_per_item():
+    assert compact_rows(DATA, rows_per_item=2, token_budget=1000).split('\n') \
+        == [
+            HEADER,
+            '# Egg',
+            'Egg, whole, cooked, hard-boiled | 100 | 12.6',
+            'Egg, white, raw | 100 | 10.9',
+            '# Burrito Bowl',
+            'Chicken Burrito Bowl (Chipotle) | 500 g | 53',
+        ]
+
+
+def test_budget_gives_every_item_a_row_first():
+    first_rows = [
+        '# Egg', 'Egg, whole, cooked, hard-boiled | 100 | 12.6',
+        '# Burrito Bowl', 'Chicken Burrito Bowl (Chipotle) | 500 g | 53',
+    ]
+    budget = count_tokens(HEADER) + sum(
+        count_tokens(line) + 1 for line in first_rows)
+
+    assert compact_rows(DATA, rows_per_item=4, token_budget=budget) == \
+        '\n'.join([HEADER, *first_rows])
+    assert compact_rows(DATA, rows_per_item=4, token_budget=0) == HEADER
+
+
+def test_compact_context_records_tokens_saved():
+    before = metrics.snapshot()['counters'].get(
+        'generation_context.tokens_saved', 0)
+
+    compacted = compact_context(DATA)
+
+    saved = metrics.snapshot()['counters']['generation_context.tokens_saved']
+    assert saved - before == \
+        estimate_tokens(str(DATA)) - count_tokens(compacted)
+    assert saved > before
+    assert compact_context([]) == ''
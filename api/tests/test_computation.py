@@ -0,0 +1,81 @@
+from rags.protein_amount.computation import compute_protein, best_rows
+from rags.protein_amount.extraction import ExtractedItem, find_quantity
+
+COLUMNS = ('food_item', 'description', 'serving_size', 'protein_amount',
+           'serving_unit', 'rank')
+DATA = [
+    COLUMNS,
+    ('Chicken Breast', 'Chicken, broilers or fryers, breast, cooked',
+     100, 31.0, None, -10.0),
+    ('Chicken Breast', 'Chicken, breast, fried, with skin',
+     100, 28.0, None, -8.0),
+    ('Big Mac', 'Big Mac', 219, 25.0, 'g', -12.0),
+    ('Rice', 'Beans and noodles', 100, 7.0, None, -1.0),
+    # Per 100 g
+    ('Eggs', 'Egg, whole, cooked, hard-boiled', 100, 12.6, None, -9.0),
+    ('Bread', 'Bread, white, commercially prepared', 100, 9.0, None, -7.0),
+    ('White Rice', 'Rice, white, cooked', 100, 2.7, None, -6.0),
+    ('Milk', 'Whole milk', 240, 8.0, 'ml', -5.0),
+]
+
+
+def test_best_rows_picks_lowest_rank():
+    rows = best_rows(DATA)
+    assert rows['Chicken Breast']['protein_amount'] == 31.0
+    assert set(rows) == {'Chicken Breast', 'Big Mac', 'Rice', 'Eggs',
+                         'Bread', 'White Rice', 'Milk'}
+
+
+def test_compute_protein_scales_by_amount():
+    results, unmatched = compute_protein([
+        ExtractedItem('Chicken Breast', 6, 'oz'),
+        ExtractedItem('Big Mac', 2),
+    ], DATA)
+    assert results == [
+        {"food_item": "Chicken Breast", "protein_amount": 53,
+         "protein_unit": "grams"},
+        {"food_item": "Big Mac", "protein_amount": 50,
+         "protein_unit": "grams"},
+    ]
+    assert unmatched == []
+
+
+def test_compute_protein_leaves_unmatched_items_for_the_llm():
+    results, unmatched = compute_protein([
+        ExtractedItem('Rice', 1, 'cup'),
+        ExtractedItem('Salmon'),
+    ], DATA)
+    assert results == []
+    assert [item.name for item in unmatched] == ['Rice', 'Salmon']
+
+
+def test_counts_are_left_for_the_llm_on_per_100g_rows():
+    results, unmatched = compute_protein([
+        ExtractedItem('Eggs', 2),
+        ExtractedItem('Bread', 2, 'slice'),
+        ExtractedItem('Eggs'),
+        ExtractedItem('Bread', 50, 'g'),
+    ], DATA)
+    assert results == [{"food_item": "Bread", "protein_amount": 4,
+                        "protein_unit": "grams"}]
+    assert [(item.name, item.quantity) for item in unmatched] == [
+        ('Eggs', 2), ('Bread', 2), ('Eggs', None)]
+
+
+def test_volumes_only_convert_to_volume_servings():
+    results, unmatched = compute_protein([
+        ExtractedItem('White Rice', 1, 'cup'),
+        ExtractedItem('Milk', 2, 'cup'),
+        ExtractedItem('Milk', 100, 'g'),
+    ], DATA)
+    assert results == [{"food_item": "Milk", "protein_amount": 16,
+                        "protein_unit": "grams"}]
+    assert [(item.name, item.unit) for item in unmatched] == [
+        ('White Rice', 'cup'), ('Milk', 'g')]
+
+
+def test_find_quantity():
+    meal = "I had 2 chicken breasts and a cup of rice"
+    assert find_quantity("Chicken Breast", meal) == (2.0, None)
+    assert find_quantity("Rice", meal) == (1.0, 'cup')
+    assert find_quantity("Salmon", meal) == (None, None)
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+
+from rags.protein_amount.embeddings import (
+    EmbeddingIndex,
+    ItemEmbedder,
+    load_index,
+    normalize,
+    quantize
+)
+from utils import metrics
+
+
+def _vectors(rows: int, dimensions: int = 32, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(
+        (rows, dimensions), dtype=np.float32)
+
+
+def test_quantization_keeps_cosine_similarities():
+    vectors = normalize(_vectors(200))
+    quantized, scales = quantize(vectors)
+
+    assert quantized.dtype == np.int8
+    restored = quantized.astype(np.float32) * scales[:, None]
+    assert np.abs(restored @ vectors.T - vectors @ vectors.T).max() < 0.02
+
+
+def test_search_returns_each_querys_nearest_rows_of_the_table(tmp_path):
+    eggs, burritos = _vectors(50, seed=1), _vectors(30, seed=2)
+    EmbeddingIndex.write(tmp_path, {
+        'non_branded_foods': (np.arange(100, 150), eggs),
+        'branded_foods': (np.arange(0, 0), np.empty((0, 32))),
+        'restaurant_menu_foods': (np.arange(1, 31), burritos),
+    }, model='test')
+    index = EmbeddingIndex(tmp_path)
+
+    assert index.meta == {
+        'model': 'test', 'dimensions': 32, 'key': 'id', 'tables': {
+            'non_branded_foods': [0, 50], 'branded_foods': [50, 50],
+            'restaurant_menu_foods': [50, 80]}}
+    queries = np.stack([eggs[7] + 0.1 * eggs[3], eggs[42]])
+    results = index.search(queries, 'non_branded_foods', k=3)
+    assert [len(hits) for hits in results] == [3, 3]
+    assert [hits[0][0] for hits in results] == [107, 142]
+    assert results[1][0][1] > 0.99
+    assert all(hits == sorted(hits, key=lambda hit: -hit[1])
+               for hits in results)
+
+    assert index.search(queries, 'branded_foods', k=3) == [[], []]
+    nearest, = index.search(burritos[:1], 'restaurant_menu_foods', k=100)
+    assert len(nearest) == 30 and nearest[0][0] == 1
+
+
+def test_item_embedder_embeds_only_uncached_items():
+    calls = []
+
+    def embed(texts):
+        calls.append(texts)
+        return [[len(text), 1.0] for text in texts]
+
+    embedder = ItemEmbedder(embed, maxsize=2)
+    before = metrics.snapshot()['counters'].get('item_embeddings.hits', 0)
+
+    vectors = embedder.embed(['Egg', 'rice', 'egg '])
+    embedder.embed(['rice', 'toast'])
+    embedder.embed(['egg'])
+
+    assert calls == [['egg', 'rice'], ['toast'], ['egg']]
+    np.testing.assert_allclose(vectors[0], vectors[2])
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-6)
+    assert metrics.snapshot()['counters']['item_embeddings.hits'] - before \
+        == 2
+
+
+def test_indexes_not_keyed_by_food_id_are_not_loaded(tmp_path):
+    EmbeddingIndex.write(tmp_path, {'non_branded_foods': (
+        np.arange(1, 11), _vectors(10))})
+    meta = json.loads((tmp_path / 'meta.json').read_text())
+    del meta['key']
+    (tmp_path / 'meta.json').write_text(json.dumps(meta))
+
+    assert load_index(tmp_path) is None
@@ -0,0 +1,92 @@
+from rags.protein_amount.extraction import (
+    FoodItemExtractor,
+    ExtractedItem,
+    parse_quantity,
+    _description_phrases
+)
+
+extractor = FoodItemExtractor(
+    phrases={
+        'chicken': 10,
+        'chicken breast': 5,
+        'breast': 8,
+        'rice': 7,
+        'egg': 6,
+        'toast': 3,
+        'greek yogurt': 2,
+        'yogurt': 4,
+        'big mac': 2,
+        'macaroni and cheese': 2,
+        'medium': 9,
+    },
+    ignored=['chipotle'],
+    min_frequency=2
+)
+
+
+def test_extracts_items_with_quantities():
+    assert extractor.extract("I had 200g of grilled chicken breast and rice") \
+        == [ExtractedItem('Chicken Breast', 200.0, 'g'), ExtractedItem('Rice')]
+    assert extractor.extract("2 eggs, a cup of greek yogurt") == [
+        ExtractedItem('Eggs', 2.0, None),
+        ExtractedItem('Greek Yogurt', 1.0, 'cup')
+    ]
+
+
+def test_keeps_connectors_inside_known_phrases():
+    assert extractor.extract("macaroni and cheese with toast") == [
+        ExtractedItem('Macaroni And Cheese'), ExtractedItem('Toast')]
+
+
+def test_splits_on_connectors_known_as_words():
+    # Phrase indexes built before connectors were left out of them
+    with_connectors = FoodItemExtractor(
+        phrases={**extractor.phrases, 'and': 40, 'with': 30,
+                 'chicken and': 3, 'breast with': 2},
+        ignored=['chipotle'],
+        min_frequency=2
+    )
+
+    assert with_connectors.extract("chicken and rice") == [
+        ExtractedItem('Chicken'), ExtractedItem('Rice')]
+    assert with_connectors.extract("chicken breast with rice") == [
+        ExtractedItem('Chicken Breast'), ExtractedItem('Rice')]
+    assert with_connectors.extract("macaroni and cheese with toast") == [
+        ExtractedItem('Macaroni And Cheese'), ExtractedItem('Toast')]
+
+
+def test_description_phrases_do_not_start_or_end_with_connectors():
+    phrases = _description_phrases("Chicken and rice with vegetables")
+
+    assert 'chicken and rice' in phrases
+    assert not {'and', 'with', 'chicken and', 'and rice',
+                'rice with'} & phrases
+
+
+def test_keeps_modifiers_inside_known_phrases():
+    assert extractor.extract("Big Mac and medium rice") == [
+        ExtractedItem('Big Mac'), ExtractedItem('Rice')]
+
+
+def test_not_confident_on_unknown_words():
+    assert extractor.extract("keenwa salad") is None
+    assert extractor.extract("") is None
+
+
+def test_parse_quantity():
+    assert parse_quantity(['0.5', 'cups', 'rice']) == (0.5, 'cup', ['rice'])
+    assert parse_quantity(['an', 'oz', 'of', 'cheese']) == \
+        (1.0, 'oz', ['cheese'])
+    assert parse_quantity(['rice']) == (None, None, ['rice'])
+
+
+def test_saved_index_loads_without_the_database(tmp_path):
+    path = tmp_path / 'food_phrases.json'
+    extractor.save(path)
+
+    loaded = FoodItemExtractor.load(engine=None, path=path)
+
+    assert [p.name for p in tmp_path.iterdir()] == ['food_phrases.json']
+    assert loaded.phrases == extractor.phrases
+    assert loaded.extract("chipotle chicken breast and rice") == [
+        ExtractedItem('Chicken Breast'), ExtractedItem('Rice')]
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from db import comp_food_database
+
+
+@pytest.fixture
+def food_db(tmp_path, monkeypatch):
+    path = tmp_path / "foods.sqlite"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE foods (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.execute("INSERT INTO foods (name) VALUES ('egg')")
+    monkeypatch.setattr(comp_food_database, "DATABASE_URL", path)
+    return path
+
+
+def test_readonly_engine_serves_queries(food_db):
+    engine = comp_food_database.ENGINES["readonly"]()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT name FROM foods")).scalar() == "egg"
+        assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+        assert conn.execute(text("PRAGMA mmap_size")).scalar() == \
+            food_db.stat().st_size
+
+
+def test_readonly_engine_rejects_writes(food_db):
+    engine = comp_food_database.ENGINES["readonly"]()
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO foods (name) VALUES ('toast')"))
+
+
+def test_memory_engine_shares_one_copy(food_db):
+    engine = comp_food_database.ENGINES["memory"]()
+    # The copy outlives the file and every pooled connection sees it
+    food_db.unlink()
+    with engine.connect() as first, engine.connect() as second:
+        assert first.execute(text("SELECT name FROM foods")).scalar() == "egg"
+        assert second.execute(text("SELECT count(*) FROM foods")).scalar() == 1
+        with pytest.raises(OperationalError):
+            first.execute(text("DELETE FROM foods"))
+
+
+def test_memory_engine_falls_back_over_limit(food_db, monkeypatch):
+    monkeypatch.setattr(comp_food_database, "FOOD_DB_MEMORY_LIMIT_MB", 0)
+    engine = comp_food_database.ENGINES["memory"]()
+    assert "mode=ro" in str(engine.url)
@@ -0,0 +1,98 @@
+import base64
+import datetime
+import importlib
+
+import cbor2
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from tests.ios_variables import TEST_ATTESTATION, TEST_KEY_ID
+from security.attest.ios import ParsedAttestation, get_public_key
+from utils import metrics
+
+# The package exports the validate_attestation function under the same name
+validate_attestation = importlib.import_module(
+    'security.attest.ios.validate_attestation')
+
+
+def _parse():
+    return ParsedAttestation.parse(
+        cbor2.loads(base64.b64decode(TEST_ATTESTATION)))
+
+
+def test_parses_auth_data_and_key():
+    attestation = _parse()
+
+    assert attestation.counter == 0
+    assert base64.b64encode(attestation.credential_id).decode() == TEST_KEY_ID
+    assert attestation.key_hash_b64 == TEST_KEY_ID
+    assert get_public_key(cbor2.loads(
+        base64.b64decode(TEST_ATTESTATION))) == TEST_KEY_ID
+
+
+def test_verified_intermediates_are_not_verified_again():
+    validate_attestation._verified_intermediates.clear()
+    attestation = _parse()
+    before = metrics.snapshot()['counters']
+
+    verified = validate_attestation._verify_certificate_chain(attestation)
+    validate_attestation._add_verified_intermediates(verified)
+    assert validate_attestation._verify_certificate_chain(attestation) == []
+
+    after = metrics.snapshot()['counters']
+    key = 'attestation.intermediate_cache.{}'
+    assert after[key.format('misses')] - \
+        before.get(key.format('misses'), 0) == 1
+    assert after[key.format('hits')] - before.get(key.format('hits'), 0) == 1
+
+
+def _certificate(name: str, key, issuer_name: str, issuer_key,
+                 ca: bool) -> bytes:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder() \
+        .subject_name(x509.Name(
+            [x509.NameAttribute(NameOID.COMMON_NAME, name)])) \
+        .issuer_name(x509.Name(
+            [x509.NameAttribute(NameOID.COMMON_NAME, issuer_name)])) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None),
+                       critical=True) \
+        .sign(issuer_key, hashes.SHA256())
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+def test_certificates_after_a_verified_intermediate_are_not_trusted():
+    validate_attestation._verified_intermediates.clear()
+    attestation = _parse()
+    evil_key = ec.generate_private_key(ec.SECP256R1())
+    evil_ca = _certificate("Evil CA", evil_key, "Evil CA", evil_key, True)
+    evil_leaf = _certificate("Evil Leaf", ec.generate_private_key(
+        ec.SECP256R1()), "Evil CA", evil_key, False)
+
+    def chain(*x5c):
+        return ParsedAttestation.parse({
+            'attStmt': {'x5c': list(x5c)}, 'authData': attestation.auth_data})
+
+    validate_attestation._add_verified_intermediates(
+        validate_attestation._verify_certificate_chain(attestation))
+    # The forged CA rides after the cached Apple intermediate
+    assert validate_attestation._verify_certificate_chain(
+        chain(*attestation.x5c, evil_ca)) == []
+
+    with pytest.raises(Exception):
+        validate_attestation._verify_certificate_chain(
+            chain(evil_leaf, evil_ca))
+
+
+def test_intermediates_are_only_cached_for_valid_attestations():
+    validate_attestation._verified_intermediates.clear()
+
+    assert not validate_attestation.validate_attestation(
+        _parse(), "wrong challenge", TEST_KEY_ID, "wrong.app.id")
+    assert not validate_attestation._verified_intermediates
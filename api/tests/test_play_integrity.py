@@ -0,0 +1,77 @@
+import base64
+import json
+import os
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+
+from security.attest.android import decode_token
+from security.attest.android.keys import PlayIntegrityKeys
+
+PAYLOAD = {"requestDetails": {"nonce": "a" * 32}}
+
+
+def _b64url(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode()
+
+
+def _keys():
+    signing_key = ec.generate_private_key(ec.SECP256R1())
+    verification_key = signing_key.public_key().public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return (base64.b64encode(os.urandom(32)).decode(),
+            base64.b64encode(verification_key).decode(),
+            signing_key)
+
+
+def _token(decryption_key: str, signing_key) -> str:
+    jws = jwt.encode(PAYLOAD, signing_key, algorithm="ES256")
+    header = _b64url(json.dumps({"alg": "A256KW", "enc": "A256GCM"}).encode())
+    cek, iv = os.urandom(32), os.urandom(12)
+    sealed = AESGCM(cek).encrypt(iv, jws.encode(), header.encode())
+    return '.'.join([
+        header,
+        _b64url(aes_key_wrap(base64.b64decode(decryption_key), cek)),
+        _b64url(iv),
+        _b64url(sealed[:-16]),
+        _b64url(sealed[-16:])
+    ])
+
+
+def test_decode_token():
+    decryption_key, verification_key, signing_key = _keys()
+    keys = PlayIntegrityKeys()
+    keys.rotate(decryption_key, verification_key)
+
+    token = _token(decryption_key, signing_key)
+    assert decode_token(token, keys.current()) == PAYLOAD
+
+
+def test_rotated_keys_replace_the_old_ones():
+    old_decryption_key, old_verification_key, old_signing_key = _keys()
+    decryption_key, verification_key, signing_key = _keys()
+    keys = PlayIntegrityKeys()
+    keys.rotate(old_decryption_key, old_verification_key)
+    keys.rotate(decryption_key, verification_key)
+
+    assert decode_token(_token(decryption_key, signing_key),
+                        keys.current()) == PAYLOAD
+    with pytest.raises(Exception):
+        decode_token(_token(old_decryption_key, old_signing_key),
+                     keys.current())
+
+
+def test_keys_are_read_from_the_secrets(monkeypatch):
+    decryption_key, verification_key, signing_key = _keys()
+    monkeypatch.setenv("PLAY_INTEGRITY_DECRYPTION_KEY", decryption_key)
+    monkeypatch.setenv("PLAY_INTEGRITY_VERIFICATION_KEY", verification_key)
+
+    keys = PlayIntegrityKeys()
+    assert decode_token(_token(decryption_key, signing_key),
+                        keys.current()) == PAYLOAD
@@ -0,0 +1,38 @@
+import base64
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from security.attest.ios.public_key_cache import PublicKeyCache
+
+
+def _public_key_b64():
+    public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    return base64.b64encode(public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )).decode()
+
+
+def test_loads_each_key_once():
+    cache = PublicKeyCache(maxsize=2)
+    public_key = _public_key_b64()
+
+    assert cache.get("a", public_key) is cache.get("a", public_key)
+
+
+def test_reloads_a_re_registered_key():
+    cache = PublicKeyCache(maxsize=2)
+    first = cache.get("a", _public_key_b64())
+    assert cache.get("a", _public_key_b64()) is not first
+
+
+def test_evicts_least_recently_used():
+    cache = PublicKeyCache(maxsize=2)
+    keys = {key_id: _public_key_b64() for key_id in "abc"}
+    loaded = {key_id: cache.get(key_id, keys[key_id]) for key_id in "ab"}
+    cache.get("a", keys["a"])  # "b" is now least recently used
+    cache.get("c", keys["c"])
+
+    assert cache.get("a", keys["a"]) is loaded["a"]
+    assert cache.get("b", keys["b"]) is not loaded["b"]
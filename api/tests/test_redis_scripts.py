@@ -0,0 +1,119 @@
+import asyncio
+import redis.asyncio
+
+from cache.store import (
+    REDIS_URL,
+    CHALLENGE_PREFIX,
+    KEY_CHALLENGE_PREFIX,
+    KEY_COUNTER_PREFIX,
+    KEY_PUBLIC_KEY_PREFIX
+)
+from cache.scripts import CHECK_ASSERTION_SCRIPT, ADVANCE_CHALLENGE_SCRIPT
+
+KEY_ID = "test_script_key_id"
+KEYS = [
+    f"{KEY_PUBLIC_KEY_PREFIX}{KEY_ID}",
+    f"{KEY_CHALLENGE_PREFIX}{KEY_ID}",
+    f"{KEY_COUNTER_PREFIX}{KEY_ID}"
+]
+
+
+def _run(check):
+    async def run():
+        redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+        try:
+            await redis_client.mset(dict(zip(KEYS, ["key", "challenge", 1])))
+            # The script is loaded again when Redis no longer has it
+            await redis_client.script_flush()
+            return await check(redis_client)
+        finally:
+            await redis_client.delete(*KEYS)
+            await redis_client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_check_assertion_advances_the_counter_once():
+    async def check(redis_client):
+        results = await asyncio.gather(*[
+            CHECK_ASSERTION_SCRIPT(
+                redis_client, KEYS, ["key", "challenge", 2, 0])
+            for _ in range(5)
+        ])
+        return results, await redis_client.get(KEYS[2])
+
+    results, counter = _run(check)
+    assert sorted(results) == [["invalid"]] * 4 + [["ok"]]
+    assert counter == "2"
+
+
+def test_check_assertion_refreshes_the_challenge_ttl():
+    async def check(redis_client):
+        await CHECK_ASSERTION_SCRIPT(
+            redis_client, KEYS, ["key", "challenge", 2, 600])
+        return await redis_client.ttl(KEYS[1])
+
+    assert 0 < _run(check) <= 600
+
+
+def test_check_assertion_reports_a_re_registered_key():
+    async def check(redis_client):
+        result = await CHECK_ASSERTION_SCRIPT(
+            redis_client, KEYS, ["old key", "challenge", 2, 0])
+        return result, await redis_client.get(KEYS[2])
+
+    assert _run(check) == (["stale_key", "key"], "1")
+
+
+def test_check_assertion_rejects_a_wrong_challenge():
+    async def check(redis_client):
+        return await CHECK_ASSERTION_SCRIPT(
+            redis_client, KEYS, ["key", "other challenge", 2, 0])
+
+    assert _run(check) == ["invalid"]
+
+
+def test_advance_challenge_compares_long_counters_exactly():
+    key = f"{CHALLENGE_PREFIX}test_script_challenge"
+
+    async def run():
+        redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+        try:
+            # Both counters round to the same Lua number
+            await redis_client.set(key, "value.9007199254740993", ex=60)
+            results = [
+                await ADVANCE_CHALLENGE_SCRIPT(
+                    redis_client, [key], ["value", "value", counter, 0])
+                for counter in ["9007199254740992", "9007199254740994",
+                                "9007199254740994"]
+            ]
+            return results, await redis_client.get(key), \
+                await redis_client.ttl(key)
+        finally:
+            await redis_client.delete(key)
+            await redis_client.aclose()
+
+    results, stored, ttl = asyncio.run(run())
+    assert results == ["replay", "ok", "replay"]
+    assert stored == "value.9007199254740994"
+    assert ttl > 0
+
+
+def test_advance_challenge_rejects_another_challenge():
+    key = f"{CHALLENGE_PREFIX}test_script_challenge"
+
+    async def run():
+        redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+        try:
+            await redis_client.set(key, "value.1")
+            return [
+                await ADVANCE_CHALLENGE_SCRIPT(
+                    redis_client, [key], ["value", "other", "2", 0]),
+                await ADVANCE_CHALLENGE_SCRIPT(
+                    redis_client, [f"{key}:missing"], ["value", "value", "2", 0])
+            ]
+        finally:
+            await redis_client.delete(key)
+            await redis_client.aclose()
+
+    assert asyncio.run(run()) == ["invalid", "missing"]
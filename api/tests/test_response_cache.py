@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+import redis.asyncio
+
+from cache.store import REDIS_URL
+from cache.response_cache import (
+    normalize_text,
+    response_key,
+    get_cached_response,
+    set_cached_response
+)
+
+
+@pytest.mark.parametrize("text", [
+    "2 eggs and toast",
+    "2 Eggs and Toast!",
+    "two eggs, and toast",
+    "  2.0 EGGS and   toast ",
+    "02 eggs and toast.",
+])
+def test_normalize_text_folds_formatting(text):
+    assert normalize_text(text) == "2 eggs and toast"
+
+
+def test_normalize_text_numbers():
+    assert normalize_text("1,000g rice") == "1000 g rice"
+    assert normalize_text("½ cup Greek-yogurt") == "0.5 cup greek yogurt"
+    assert normalize_text("1/2 cup greek yogurt") == "0.5 cup greek yogurt"
+    assert normalize_text("3.50 oz steak") == "3.5 oz steak"
+    assert normalize_text("⅓ cup oats") == "0.333 cup oats"
+
+
+@pytest.mark.parametrize("text", [
+    "1½ cups rice",
+    "1 ½ cups rice",
+    "1 1/2 cups rice",
+    "1 1⁄2 cups rice",
+    "1.5 cups rice",
+])
+def test_normalize_text_mixed_numbers(text):
+    assert normalize_text(text) == "1.5 cups rice"
+
+
+def test_normalize_text_keeps_fractions_apart_from_whole_numbers():
+    assert normalize_text("5.5 cups rice") == "5.5 cups rice"
+    assert response_key("1½ cups rice") != response_key("5.5 cups rice")
+    assert response_key("2 eggs ½ cup rice") != response_key("2.5 cup rice")
+
+
+def test_normalize_text_keeps_distinct_meals_apart():
+    assert response_key("2 eggs") != response_key("3 eggs")
+    assert response_key("Big Mac") == response_key("big mac.")
+
+
+def test_cached_response_roundtrip():
+    '''
+    Test that a cached response is returned for an equivalent meal text
+    '''
+    results = [{"food_item": "Egg", "protein_amount": 12,
+                "protein_unit": "grams"}]
+
+    async def roundtrip():
+        redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+        try:
+            await redis_client.delete(response_key("2 eggs"))
+            assert await get_cached_response(redis_client, "2 eggs") is None
+
+            await set_cached_response(redis_client, "2 eggs", results)
+            return await get_cached_response(redis_client, "Two eggs!")
+        finally:
+            await redis_client.delete(response_key("2 eggs"))
+            await redis_client.aclose()
+
+    assert asyncio.run(roundtrip()) == results
@@ -0,0 +1,306 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import AIMessage
+from sqlalchemy import create_engine
+
+from rags.protein_amount import chain
+from rags.protein_amount.chain import fetch_data
+from rags.protein_amount.embeddings import EmbeddingIndex, ItemEmbedder
+from rags.protein_amount.spelling import SpellingCorrector
+from rags.protein_amount.retrieval import (
+    get_query,
+    detect_fts_schema,
+    fts_phrase,
+    MAX_STATEMENT_ITEMS,
+    RETRIEVAL_LIMIT,
+    LEGACY_SCHEMA,
+    EXTERNAL_CONTENT_SCHEMA,
+    ALL_TABLES_MODE,
+    ROUTED_MODE,
+    MERGED_COLUMNS,
+    ROUTED_TABLE_PRIOR,
+    TABLE_PRIORS,
+    HYBRID_MODE,
+    VECTOR_MODE,
+    TableSearch,
+    VectorSearch,
+    merge_table_rows,
+    reciprocal_rank_fusion
+)
+
+FTS_MIGRATION = Path(__file__).parent.parent / 'db' / 'fts_migration.sql'
+
+# The tables as db/migration.sql leaves them
+LEGACY_TABLES = """
+CREATE TABLE restaurant_menu_foods (id INTEGER, restaurant TEXT, food_category TEXT, description TEXT, energy_amount REAL, fat_amount REAL, carb_amount REAL, protein_amount REAL, serving_size REAL, serving_unit TEXT);
+CREATE TABLE non_branded_foods (id INTEGER, description, energy_amount REAL, fat_amount REAL, carb_amount REAL, protein_amount REAL, serving_size REAL);
+CREATE TABLE branded_foods (id INTEGER, description TEXT, brand_name TEXT, food_category TEXT, energy_amount REAL, fat_amount REAL, carb_amount REAL, protein_amount REAL, serving_size REAL, serving_unit TEXT);
+CREATE VIRTUAL TABLE restaurant_menu_foods_fts USING fts5(id, description, restaurant);
+CREATE VIRTUAL TABLE non_branded_foods_fts USING fts5(id, description, brand_name);
+CREATE VIRTUAL TABLE branded_foods_fts USING fts5(id, description, brand_name);
+INSERT INTO non_branded_foods VALUES
+    (7, 'Egg, whole, cooked, hard-boiled', 155, 10.6, 1.1, 12.6, 100),
+    (3, 'Egg, white, raw', 52, 0.2, 0.7, 10.9, 100),
+    (5, 'Toast, white bread', 293, 4, 54, 9, 100),
+    (9, 'Quinoa, cooked', 120, 1.9, 21.3, 4.4, 100);
+INSERT INTO restaurant_menu_foods VALUES
+    (101, 'Chipotle', 'Entrees', 'Chicken Burrito Bowl', 630, 24, 50, 53, 500, 'g');
+INSERT INTO non_branded_foods_fts (id, description) SELECT id, description FROM non_branded_foods;
+INSERT INTO restaurant_menu_foods_fts (id, description, restaurant) SELECT id, description, restaurant FROM restaurant_menu_foods;
+"""
+
+
+def _stages(restaurant_or_brand: str, food_items: str) -> dict:
+    return {
+        'restaurant_or_brand': AIMessage(content=restaurant_or_brand),
+        'food_items': AIMessage(content=food_items)
+    }
+
+
+def test_user_text_is_bound_not_inlined():
+    queries, _, items = get_query(_stages(
+        "restaurant_name: Chipotle",
+        '["Burrito Bowl Chipotle", "Chips Large"]'))
+
+    assert items == ["Burrito Bowl", "Chips Large"]
+    (statement, params), = queries
+    assert "Burrito" not in statement.text
+    assert params == {
+        'limit': RETRIEVAL_LIMIT,
+        'filter': '"Chipotle"',
+        'food_item_0': "Burrito Bowl",
+        'description_0': '"Burrito" "Bowl"',
+        'food_item_1': "Chips Large",
+        'description_1': '"Chips" "Large"',
+    }
+
+
+def test_fts_phrase_escapes_quotes():
+    assert fts_phrase('Ben "n" Jerry') == '"Ben ""n"" Jerry"'
+
+
+def test_meals_with_the_same_shape_share_a_statement():
+    first, _, _ = get_query(_stages('none', '["Egg", "Toast"]'))
+    second, _, _ = get_query(_stages('none', '["Chicken Breast", "Rice"]'))
+
+    assert first[0][0] is second[0][0]
+
+
+def test_long_meals_are_split_into_several_statements():
+    food_items = [f"Item {i}" for i in range(MAX_STATEMENT_ITEMS + 1)]
+    queries, _, items = get_query(_stages('none', str(food_items)))
+
+    assert items == food_items
+    assert [len([key for key in params if key.startswith('food_item_')])
+            for _, params in queries] == [MAX_STATEMENT_ITEMS, 1]
+
+
+@pytest.fixture
+def food_db(tmp_path):
+    path = tmp_path / "foods.sqlite"
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript(LEGACY_TABLES)
+    conn.close()
+    return path
+
+
+def _fetch(path, stages: dict) -> tuple[str, list]:
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        schema = detect_fts_schema(conn)
+        rows = fetch_data(conn, get_query(stages, schema=schema)[0])
+    engine.dispose()
+    return schema, [tuple(row) for row in rows]
+
+
+def test_fts_migration_keeps_the_retrieved_rows(food_db):
+    meals = [
+        _stages('none', '["Egg", "Toast"]'),
+        _stages('restaurant_name: Chipotle', '["Burrito Bowl"]'),
+    ]
+    before = [_fetch(food_db, stages) for stages in meals]
+
+    conn = sqlite3.connect(food_db, isolation_level=None)
+    conn.executescript(FTS_MIGRATION.read_text())
+    conn.close()
+    after = [_fetch(food_db, stages) for stages in meals]
+
+    assert [schema for schema, _ in before] == [LEGACY_SCHEMA] * 2
+    assert [schema for schema, _ in after] == [EXTERNAL_CONTENT_SCHEMA] * 2
+    # Everything but the rank, whose column weights changed
+    assert [sorted(row[:-1] for row in rows) for _, rows in after] == \
+        [sorted(row[:-1] for row in rows) for _, rows in before]
+    assert len(after[0][1]) == 4
+
+
+def test_all_tables_mode_only_filters_the_routed_table():
+    searches, _, items = get_query(
+        _stages("restaurant_name: Chipotle", '["Burrito Bowl"]'),
+        schema=LEGACY_SCHEMA, mode=ALL_TABLES_MODE)
+
+    assert items == ["Burrito Bowl"]
+    assert {table: search.prior for table, search in searches.items()} == {
+        'restaurant_menu_foods': ROUTED_TABLE_PRIOR,
+        'non_branded_foods': TABLE_PRIORS['non_branded_foods'],
+        'branded_foods': TABLE_PRIORS['branded_foods'],
+    }
+    assert [params.get('filter') for table in searches
+            for _, params in searches[table].queries] == \
+        [None, '"Chipotle"', None]
+    assert 'MATCH :filter' not in \
+        searches['branded_foods'].queries[0][0].text
+
+
+def test_merge_normalizes_ranks_per_table_and_item():
+    searches = {
+        'non_branded_foods': TableSearch(1.0, [(None, {'limit': 2})]),
+        'branded_foods': TableSearch(0.4, [(None, {'limit': 2})]),
+    }
+    merged = merge_table_rows({
+        'non_branded_foods': (
+            ('food_item', 'description', 'serving_size', 'protein_amount',
+             'rank'),
+            [('egg', 'Egg, whole', 100, 12.6, -2.0),
+             ('egg', 'Egg, white', 100, 10.9, -1.0),
+             ('egg', 'Egg, yolk', 100, 15.9, -0.5)]),
+        'branded_foods': (
+            ('food_item', 'description', 'serving_size', 'protein_amount',
+             'serving_unit', 'brand_name', 'rank'),
+            [('egg', 'Eggland Eggs', 50, 6, 'g', 'Eggland', -40.0)]),
+    }, searches)
+
+    assert merged[0] == MERGED_COLUMNS
+    assert merged[1:] == [
+        ('egg', 'Egg, whole', 100, 12.6, None, None, 'non_branded_foods',
+         -1.0),
+        ('egg', 'Egg, white', 100, 10.9, None, None, 'non_branded_foods',
+         -0.5),
+    ]
+
+
+def test_all_tables_fetch_merges_every_table(food_db):
+    engine = create_engine(f"sqlite:///{food_db}")
+    searches, _, _ = get_query(
+        _stages('none', '["Egg", "Chicken"]'),
+        schema=LEGACY_SCHEMA, mode=ALL_TABLES_MODE)
+    with engine.connect() as conn:
+        rows = fetch_data(conn, searches)
+    engine.dispose()
+
+    assert rows[0] == MERGED_COLUMNS
+    assert {(row[0], row[6]) for row in rows[1:]} == {
+        ('Egg', 'non_branded_foods'),
+        ('Chicken', 'restaurant_menu_foods'),
+    }
+    assert [row[-1] for row in rows[1:]] == sorted(row[-1] for row in rows[1:])
+
+
+def test_vector_modes_keep_the_routed_fts_queries():
+    stages = _stages("restaurant_name: Chipotle", '["Burrito Bowl Chipotle"]')
+    search, _, items = get_query(stages, schema=LEGACY_SCHEMA,
+                                 mode=HYBRID_MODE)
+
+    assert isinstance(search, VectorSearch)
+    assert search[:5] == (HYBRID_MODE, 'restaurant_menu_foods',
+                          ["Burrito Bowl"], "Chipotle", RETRIEVAL_LIMIT)
+    assert search.queries == get_query(stages, schema=LEGACY_SCHEMA)[0]
+    assert get_query(_stages('none', '["Egg"]'), schema=LEGACY_SCHEMA,
+                     mode=VECTOR_MODE)[0].name is None
+
+
+def test_reciprocal_rank_fusion_favours_rows_of_both_rankings():
+    fts = [('egg', 'Egg, whole', -3.0), ('egg', 'Egg, white', -2.0),
+           ('rice', 'Rice, white', -1.0)]
+    vector = [('egg', 'Egg, yolk', -0.9), ('egg', 'Egg, white', -0.8),
+              ('rice', 'Rice, brown', -0.7)]
+
+    fused = reciprocal_rank_fusion([fts, vector], limit=2)
+
+    # Ties keep the order of the first ranking
+    assert [row[:2] for row in fused] == [
+        ('egg', 'Egg, white'), ('egg', 'Egg, whole'),
+        ('rice', 'Rice, white'), ('rice', 'Rice, brown')]
+    assert fused[0][2] == -(1 / 62 + 1 / 62)
+
+
+def _embed(texts):
+    # Bag of words, so descriptions sharing words are close
+    vocabulary = ['egg', 'white', 'whole', 'toast', 'bread', 'chicken',
+                  'burrito', 'bowl', 'bagel']
+    return [[float(word in text.lower()) for word in vocabulary] + [0.1]
+            for text in texts]
+
+
+def test_hybrid_fetch_fuses_fts_and_vector_rows(food_db, monkeypatch):
+    engine = create_engine(f"sqlite:///{food_db}")
+    monkeypatch.setattr(chain, 'food_embedding_index', EmbeddingIndex.build(
+        engine, _embed, food_db.parent / 'embeddings'))
+    monkeypatch.setattr(chain, 'item_embedder', ItemEmbedder(_embed))
+    with engine.connect() as conn:
+        vector = fetch_data(conn, get_query(
+            _stages('none', '["White bread bagel"]'), limit=1,
+            schema=LEGACY_SCHEMA, mode=VECTOR_MODE)[0])
+        hybrid = fetch_data(conn, get_query(
+            _stages('none', '["Egg"]'), limit=2,
+            schema=LEGACY_SCHEMA, mode=HYBRID_MODE)[0])
+        other_restaurant = fetch_data(conn, get_query(
+            _stages('restaurant_name: Wendys', '["Burrito Bowl"]'),
+            schema=LEGACY_SCHEMA, mode=VECTOR_MODE)[0])
+    engine.dispose()
+
+    # FTS finds no description with "bagel"
+    assert vector[0] == ('food_item', 'description', 'serving_size',
+                         'protein_amount', 'rank')
+    assert [row[:2] for row in vector[1:]] == [
+        ('White bread bagel', 'Toast, white bread')]
+    assert [row[:2] for row in hybrid[1:]] == [
+        ('Egg', 'Egg, white, raw'), ('Egg', 'Egg, whole, cooked, hard-boiled')]
+    assert other_restaurant == []
+
+
+def test_embedding_index_survives_the_fts_migration(food_db, monkeypatch):
+    engine = create_engine(f"sqlite:///{food_db}")
+    monkeypatch.setattr(chain, 'food_embedding_index', EmbeddingIndex.build(
+        engine, _embed, food_db.parent / 'embeddings'))
+    monkeypatch.setattr(chain, 'item_embedder', ItemEmbedder(_embed))
+    search = get_query(_stages('none', '["White bread bagel"]'), limit=1,
+                       schema=LEGACY_SCHEMA, mode=VECTOR_MODE)[0]
+    with engine.connect() as conn:
+        before = fetch_data(conn, search)
+    engine.dispose()
+
+    # The migration renumbers the rowids of the base tables
+    conn = sqlite3.connect(food_db, isolation_level=None)
+    conn.executescript(FTS_MIGRATION.read_text())
+    conn.close()
+    engine = create_engine(f"sqlite:///{food_db}")
+    with engine.connect() as conn:
+        after = fetch_data(conn, search)
+    engine.dispose()
+
+    assert [row[:2] for row in after[1:]] == [row[:2] for row in before[1:]] \
+        == [('White bread bagel', 'Toast, white bread')]
+
+
+def test_items_without_rows_are_searched_with_a_looser_correction(food_db):
+    # "keenwa" sounds like all of them, but is spelled far from each
+    corrector = SpellingCorrector({'non_branded_foods': {
+        'quinoa': 2, 'cooked': 2, 'egg': 2, 'cone': 40, 'kona': 20,
+        'queen': 15}})
+    queries, _, _ = get_query(_stages('none', '["Keenwa", "Egg"]'),
+                              schema=LEGACY_SCHEMA, corrector=corrector,
+                              mode=ROUTED_MODE)
+    engine = create_engine(f"sqlite:///{food_db}")
+    with engine.connect() as conn:
+        rows = fetch_data(conn, queries)
+    engine.dispose()
+
+    (_, params), = queries
+    assert params['description_0'] == '"keenwa"'
+    assert params['fallback_description_0'] == '"quinoa"'
+    assert 'fallback_description_1' not in params
+    assert sorted(row[:2] for row in rows[1:]) == [
+        ('Egg', 'Egg, white, raw'), ('Egg', 'Egg, whole, cooked, hard-boiled'),
+        ('Keenwa', 'Quinoa, cooked')]
@@ -0,0 +1,48 @@
+import asyncio
+
+from cache.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"calls": len(calls)}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(5)))
+
+    assert asyncio.run(run()) == [{"calls": 1}] * 5
+    assert len(calls) == 1
+
+
+def test_waiters_receive_the_leaders_error():
+    flight = SingleFlight("test")
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        raise ValueError("chain failed")
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do("key", fn) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_calls_after_completion_run_again():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        return [await flight.do("key", fn), await flight.do("key", fn)]
+
+    assert asyncio.run(run()) == [1, 2]
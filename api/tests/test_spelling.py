@@ -0,0 +1,91 @@
+from langchain_core.messages import AIMessage
+
+from rags.protein_amount.retrieval import get_query, LEGACY_SCHEMA
+from rags.protein_amount.spelling import (
+    SpellingCorrector,
+    edit_distance,
+    phonetic_key
+)
+
+corrector = SpellingCorrector({
+    'non_branded_foods': {
+        'quinoa': 4, 'queen': 2, 'chicken': 30, 'breast': 12, 'cooked': 50,
+        'yogurt': 8, 'greek': 6, 'salmon': 5, 'rare': 1,
+    },
+    'restaurant_menu_foods': {'burrito': 6, 'bowl': 9, 'chicken': 7},
+    'restaurant_menu_foods.restaurant': {'chipotle': 40, 'mcdonald': 60,
+                                         's': 60},
+})
+
+
+def test_phonetic_key_ignores_spelling_of_the_same_sound():
+    assert phonetic_key('keenwa') == phonetic_key('quinoa')
+    assert phonetic_key('yoghurt') == phonetic_key('yogurt')
+    assert phonetic_key('chiken') == phonetic_key('chicken')
+
+
+# Words of the non_branded_foods descriptions that sound like the misspellings
+# below, more frequent than the intended words
+FOODS = SpellingCorrector({'non_branded_foods': {
+    'quinoa': 12, 'cone': 40, 'cayenne': 25, 'queen': 15, 'kona': 20,
+    'coffee': 90, 'toffee': 30, 'broccoli': 60, 'brick': 70, 'berry': 80,
+    'ahi': 14, 'soy': 150, 'salmon': 110, 'lemon': 140, 'almond': 130,
+}})
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance('brocoli', 'broccoli') == 1
+    assert edit_distance('samlon', 'salmon') == 1
+    assert edit_distance('keenwa', 'quinoa') == 4
+
+
+def test_corrects_unknown_words():
+    assert corrector.correct('chiken', 'non_branded_foods') == 'chicken'
+    assert corrector.correct('grek yoghurt', 'non_branded_foods') == \
+        'greek yogurt'
+
+
+def test_known_and_unmatched_words_are_kept():
+    assert corrector.correct('Chicken', 'non_branded_foods') == 'Chicken'
+    # Rare words are known, but never suggested
+    assert corrector.correct('rare', 'non_branded_foods') == 'rare'
+    assert corrector.correct('rar', 'non_branded_foods') == 'rar'
+    assert corrector.correct('pizza', 'non_branded_foods') == 'pizza'
+
+
+def test_corrections_are_close_words_not_frequent_ones():
+    assert FOODS.correct('kinoa', 'non_branded_foods') == 'quinoa'
+    assert FOODS.correct('kofee', 'non_branded_foods') == 'coffee'
+    assert FOODS.correct('brocoli', 'non_branded_foods') == 'broccoli'
+    assert FOODS.correct('salman', 'non_branded_foods') == 'salmon'
+    # Sounds like cone, cayenne, queen and kona, but is many edits from all
+    assert FOODS.correct('keenwa', 'non_branded_foods') == 'keenwa'
+    # The looser match of items without rows compares sound spellings
+    assert FOODS.correct('keenwa', 'non_branded_foods', loose=True) == \
+        'quinoa'
+    assert FOODS.correct('kofee', 'non_branded_foods', loose=True) == \
+        'coffee'
+
+
+def test_vowel_only_keys_do_not_match():
+    for word in ('way', 'yew', 'hoy'):
+        assert FOODS.correct(word, 'non_branded_foods') == word
+
+
+def test_vocabularies_are_per_column():
+    assert corrector.correct('salmn', 'restaurant_menu_foods') == 'salmn'
+    assert corrector.correct('Chipolte',
+                             'restaurant_menu_foods.restaurant') == 'chipotle'
+
+
+def test_get_query_searches_corrected_words():
+    queries, _, items = get_query({
+        'restaurant_or_brand': AIMessage(content='restaurant_name: Chipolte'),
+        'food_items': AIMessage(content='["Chiken Burito Bowl"]')
+    }, schema=LEGACY_SCHEMA, corrector=corrector)
+
+    (_, params), = queries
+    assert items == ["Chiken Burito Bowl"]
+    assert params['food_item_0'] == "Chiken Burito Bowl"
+    assert params['description_0'] == '"chicken" "burrito" "Bowl"'
+    assert params['filter'] == '"chipotle"'
@@ -0,0 +1,26 @@
+import asyncio
+
+from cache.memo import TieredMemo
+
+
+def test_local_tier_evicts_least_recently_used():
+    memo = TieredMemo("test", maxsize=2, ttl=0)
+
+    async def run():
+        await memo.set("a", "1")
+        await memo.set("b", "2")
+        assert await memo.get("a") == "1"  # "b" is now least recently used
+        await memo.set("c", "3")
+        return [await memo.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == ["1", None, "3"]
+
+
+def test_local_tier_can_be_disabled():
+    memo = TieredMemo("test", maxsize=0, ttl=0)
+
+    async def run():
+        await memo.set("a", "1")
+        return await memo.get("a")
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,20 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def write_json_atomic(path: Path, data):
+    '''
+    Write `data` as JSON to a temporary file next to `path`, then rename it
+    over `path`, so that readers never see a partially written file
+    '''
+    fd, temporary = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
@@ -0,0 +1,28 @@
+import threading
+from collections import Counter
+
+# In-process counters, reported per worker by the /metrics endpoint
+_counters = Counter()
+_gauges = {}
+_lock = threading.Lock()
+
+
+def incr(name: str, amount: int = 1):
+    """Increment a named counter"""
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name: str, value: float):
+    """Record the latest value of a named gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> dict:
+    """Get a copy of all counters and gauges"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges)
+        }